@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Measures the memory held by the frames of the chart pipeline on synthetic data, and the peak RSS of the
+process as it goes: loading the country / state / county hierarchy, then preprocessing and compiling a
+world, a US state and a US county chart. Peak RSS only grows, so every phase reports the peak so far.
+
+Like bench_pipeline.py, results are written as json so that runs at different commits can be compared
+with --compare. Run from the repository root:
+
+    benchmarks/bench_memory.py [--groups 200] [--counties 20] [--days 120] [--events 20]
+                               [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+sys.path.append('.')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import synthetic
+from bench_pipeline import RESULTS_DIR, git_commit, make_chart
+from chartlib import load_jhu_hierarchy, select_level
+from chartlib.instrument import peak_rss_bytes
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def phase(results, name, fn):
+    start = time.perf_counter()
+    df = fn()
+    results[name] = {
+        'seconds': time.perf_counter() - start,
+        'rows': len(df),
+        'frame_bytes': frame_bytes(df),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+    return df
+
+
+def chart_phases(results, name, chart):
+    chart_df = phase(results, f'preprocess[{name}]', chart._preprocess_df)
+
+    def compile_chart():
+        # reports the frame handed to altair
+        image_df = chart.add_image_column(chart_df)
+        chart.spec.compile(image_df).to_dict()
+        return image_df
+    phase(results, f'compile[{name}]', compile_chart)
+
+
+def run(args, data_dir):
+    paths = synthetic.write_synthetic_data(
+        data_dir, args.groups, args.days, args.events, seed=args.seed, counties=args.counties
+    )
+    results = {}
+    hierarchy = phase(
+        results, 'load_jhu_hierarchy',
+        lambda: load_jhu_hierarchy(paths[synthetic.JHU_CSV], paths[synthetic.JHU_COUNTY_CSV], cache_dir=None)
+    )
+
+    world_df = select_level(hierarchy, 'country')
+    us_df = select_level(hierarchy, 'state', {'Country_Region': 'United States'})
+    county_df = select_level(hierarchy, 'county', {'Country_Region': 'United States'})
+    placeholder = pd.DataFrame({'Country_Region': [], 'Province_State': [], 'lockdown_date': [], 'lockdown_type': []})
+    world_chart = make_chart(world_df, placeholder, 'Country_Region', 'country', 50, 'Confirmed', args.days)
+    us_chart = make_chart(us_df, placeholder, 'Province_State', 'usa', 20, 'Confirmed', args.days)
+    world_events = world_chart._ingest_country_quarantine_df(paths[synthetic.WORLD_QUARANTINE_CSV_NEW_EXPORT])
+    us_events = us_chart._ingest_usa_quarantine_df(paths[synthetic.US_QUARANTINE_CSV])
+
+    world_chart = make_chart(world_df, world_events, 'Country_Region', 'country', 50, 'Confirmed', args.days)
+    chart_phases(results, 'world', world_chart)
+    us_chart = make_chart(us_df, us_events, 'Province_State', 'usa', 20, 'Confirmed', args.days)
+    chart_phases(results, 'us', us_chart)
+    county_chart = make_chart(county_df, None, 'Admin2', 'county', 20, 'Confirmed', args.days)
+    county_events = county_chart._align_state_events_to_counties(us_events, county_df)
+    county_chart = make_chart(county_df, county_events, 'Admin2', 'county', 20, 'Confirmed', args.days)
+    chart_phases(results, 'county', county_chart)
+    return results
+
+
+def print_results(results, baseline=None):
+    mib = lambda nbytes: nbytes / (1 << 20)
+    width = max(len(name) for name in results)
+    header = f'{"phase":<{width}} {"rows":>9} {"frame (MiB)":>12} {"peak RSS (MiB)":>15}'
+    if baseline is not None:
+        header += f' {"baseline frame":>15} {"baseline RSS":>13}'
+    print(header)
+    for name, stats in results.items():
+        line = f'{name:<{width}} {stats["rows"]:>9} {mib(stats["frame_bytes"]):>12.1f} {mib(stats["peak_rss_bytes"]):>15.1f}'
+        if baseline is not None:
+            old = baseline['phases'].get(name)
+            if old is None:
+                line += f' {"-":>15} {"-":>13}'
+            else:
+                line += f' {mib(old["frame_bytes"]):>15.1f} {mib(old["peak_rss_bytes"]):>13.1f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=200, help='number of countries (and of US states)')
+    parser.add_argument('--counties', type=int, default=20, help='number of counties in each US state')
+    parser.add_argument('--days', type=int, default=120, help='number of days of case data')
+    parser.add_argument('--events', type=int, default=20, help='number of quarantine events per group')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help=f'where to write the json results (default: {RESULTS_DIR}/<commit>-memory.json)')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', FutureWarning)
+    commit, dirty = git_commit()
+    with tempfile.TemporaryDirectory() as data_dir:
+        with alt.data_transformers.enable('default', max_rows=None):
+            results = run(args, data_dir)
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'params': {k: getattr(args, k) for k in ('groups', 'counties', 'days', 'events', 'seed')},
+        'phases': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f'{(commit or "unknown")[:12]}{"-dirty" if dirty else ""}-memory.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline['params'] != report['params']:
+            print(f'warning: baseline was run with {baseline["params"]}', file=sys.stderr)
+    print_results(results, baseline)
+    print(f'wrote {output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
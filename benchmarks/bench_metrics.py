@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Times `chartlib.metrics.derive_metric` on synthetic JHU-shaped data with shuffled rows and missing days (NaN
+counts), and checks every metric against the per-group pandas implementation (`groupby().cumsum()`, `diff()`,
+`rolling()`, `shift()`) on the rows sorted by date.
+
+Run from the repository root:
+
+    benchmarks/bench_metrics.py [--groups 200] [--days 120] [--gaps 0.05] [--window 7]
+"""
+import argparse
+import sys
+import time
+sys.path.append('.')
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_jhu_frame
+from chartlib.metrics import CUMULATIVE, DOUBLING_TIME, GROWTH_FACTOR, METRICS, NEW, NEW_AVG, derive_metric
+from chartlib.utils import to_datetime_series
+
+GROUP_COLS = ['Country_Region', 'Province_State']
+
+
+def groupby_metric(df, col, metric, window):
+    # the per-group pandas implementation of each metric, for comparison
+    dates = to_datetime_series(df['Date'])
+    df = df.assign(_date=dates).sort_values(GROUP_COLS + ['_date'], kind='stable')
+    groups = df.groupby(GROUP_COLS, sort=False, dropna=False, observed=True)
+    values = df[col].astype(float)
+    if metric == CUMULATIVE:
+        derived = values.groupby([df[c] for c in GROUP_COLS], sort=False, dropna=False).cumsum()
+    else:
+        new = groups[col].diff().astype(float)
+        first = groups.cumcount() == 0
+        new[first] = values[first]
+        new_avg = new.groupby([df[c] for c in GROUP_COLS], sort=False, dropna=False).rolling(window).mean()
+        new_avg = new_avg.reset_index(level=list(range(len(GROUP_COLS))), drop=True)
+        if metric == NEW:
+            derived = new
+        elif metric == NEW_AVG:
+            derived = new_avg
+        elif metric == GROWTH_FACTOR:
+            before = new_avg.groupby([df[c] for c in GROUP_COLS], sort=False, dropna=False).shift(window)
+            derived = (new_avg / before).where(before > 0)
+        else:
+            ratio = values / groups[col].shift(window).astype(float)
+            derived = (window * np.log(2) / np.log(ratio)).where(ratio > 1)
+    return derived.reindex(df.index).sort_index()
+
+
+def make_frame(groups, days, gaps, seed=0):
+    rng = np.random.default_rng(seed)
+    df = make_jhu_frame(groups, days, seed)
+    df.loc[rng.random(len(df)) < gaps, ['Confirmed', 'Deaths']] = np.nan
+    return df.sample(frac=1., random_state=seed).reset_index(drop=True)
+
+
+def time_it(fn, *args):
+    start = time.perf_counter()
+    ret = fn(*args)
+    return time.perf_counter() - start, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--gaps', type=float, default=0.05, help='fraction of rows whose counts are missing')
+    parser.add_argument('--window', type=int, default=7)
+    args = parser.parse_args()
+
+    df = make_frame(args.groups, args.days, args.gaps)
+    print(f'{len(df)} rows')
+    print(f'{"metric":>14} {"vectorized (s)":>15} {"groupby (s)":>12}')
+    for metric in METRICS:
+        window = args.window if metric in (NEW_AVG, GROWTH_FACTOR, DOUBLING_TIME) else None
+        for col in ('Confirmed', 'Deaths'):
+            vectorized_time, vectorized = time_it(
+                derive_metric, df, col, metric, window, GROUP_COLS
+            )
+            groupby_time, expected = time_it(groupby_metric, df, col, metric, args.window)
+            pd.testing.assert_series_equal(
+                vectorized.astype(float), expected.astype(float), check_names=False, check_exact=False, rtol=1e-9
+            )
+        print(f'{metric:>14} {vectorized_time:>15.3f} {groupby_time:>12.3f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
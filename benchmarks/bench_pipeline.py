@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Times every stage of the chart pipeline on synthetic data: loading the JHU csv, derived metrics, each
+quarantine `_ingest_*` variant, `DaysSinceNumReached.transform`, `CovidChart._preprocess_df`,
+`_preprocess_lockdown_info`, `ChartSpec.compile`, `ChartSpec.compile_to_dict` with and without a cached spec
+template, and `CovidChart.export`, for a world and a US chart.
+
+Results are written as json (stage -> timings, plus the commit and library versions), so that runs
+at different commits can be compared with --compare. Run from the repository root:
+
+    benchmarks/bench_pipeline.py [--groups 200] [--days 120] [--events 20] [--repeat 3]
+                                 [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+sys.path.append('.')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import synthetic
+from chartlib import CovidChart, DaysSinceNumReached, datasets, derive_metric, load_jhu_data
+from chartlib.chart_spec import TEMPLATE_CACHE
+
+RESULTS_DIR = './benchmarks/results'
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def time_stage(fn, setup=None, repeat=3):
+    # `setup` runs before every repetition, outside of the timed region, and its result is passed to `fn`
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return {
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+    }
+
+
+def fresh_load(paths):
+    # forget parsed csvs, so that loads and ingests parse again
+    datasets._MEMO.clear()
+    return paths
+
+
+def lockdown_info_input(chart):
+    # the frame that `_preprocess_df` hands to `_preprocess_lockdown_info`
+    captured = []
+    original = CovidChart._preprocess_lockdown_info
+
+    def capture(self, df):
+        captured.append(df.copy())
+        return original(self, df)
+    CovidChart._preprocess_lockdown_info = capture
+    try:
+        chart._preprocess_df()
+    finally:
+        CovidChart._preprocess_lockdown_info = original
+    return captured[0]
+
+
+def make_chart(jhu_df, quarantine_df, groupcol, level, days_since, ycol, days):
+    chart = CovidChart(
+        jhu_df,
+        groupcol=groupcol,
+        start_criterion=DaysSinceNumReached(days_since, ycol),
+        ycol=ycol,
+        level=level,
+        xcol='Date',
+        sample_every=3,
+        quarantine_df=quarantine_df,
+    )
+    chart.set_xdomain((0, days)).set_ydomain((days_since, 1000000))
+    # there are more synthetic groups than colors in the color scheme
+    chart.set_colormap(default_color='lightgray')
+    chart.click_selection_init = sorted(jhu_df[groupcol].unique())[0]
+    return chart
+
+
+def chart_stages(name, chart, out_dir, repeat):
+    results = {}
+    df = chart.df.copy()
+    df[chart.Y] = df[chart.ycol]
+    results[f'DaysSinceNumReached.transform[{name}]'] = time_stage(
+        lambda df: chart.start_criterion.transform(chart, df), lambda: df.copy(), repeat
+    )
+    results[f'CovidChart._preprocess_df[{name}]'] = time_stage(lambda _: chart._preprocess_df(), repeat=repeat)
+    lockdown_df = lockdown_info_input(chart)
+    results[f'CovidChart._preprocess_lockdown_info[{name}]'] = time_stage(
+        lambda df: chart._preprocess_lockdown_info(df), lambda: lockdown_df.copy(), repeat
+    )
+    chart_df = chart.add_image_column(chart._preprocess_df())
+    results[f'ChartSpec.compile[{name}]'] = time_stage(lambda _: chart.spec.compile(chart_df), repeat=repeat)
+    results[f'ChartSpec.compile_to_dict[{name}][cold]'] = time_stage(
+        lambda _: chart.spec.compile_to_dict(chart_df), TEMPLATE_CACHE.clear, repeat
+    )
+    # the cold runs leave the template of this chart in the cache
+    results[f'ChartSpec.compile_to_dict[{name}][cached]'] = time_stage(
+        lambda _: chart.spec.compile_to_dict(chart_df), repeat=repeat
+    )
+    results[f'CovidChart.export[{name}]'] = time_stage(
+        lambda _: chart.export(os.path.join(out_dir, f'{name}.js'), name), TEMPLATE_CACHE.clear, repeat
+    )
+    for key in results:
+        results[key]['rows'] = len(chart.df)
+    return results
+
+
+def run(args, data_dir):
+    paths = synthetic.write_synthetic_data(data_dir, args.groups, args.days, args.events, seed=args.seed)
+    jhu_csv = paths[synthetic.JHU_CSV]
+    cache_dir = os.path.join(data_dir, 'cache')
+    results = {}
+
+    results['load_jhu_data[csv]'] = time_stage(
+        lambda _: load_jhu_data(jhu_csv, cache_dir=None), lambda: fresh_load(paths), args.repeat
+    )
+    load_jhu_data(jhu_csv, cache_dir=cache_dir)
+    results['load_jhu_data[cached]'] = time_stage(
+        lambda _: load_jhu_data(jhu_csv, cache_dir=cache_dir), lambda: fresh_load(paths), args.repeat
+    )
+    jhu_df = load_jhu_data(jhu_csv, cache_dir=cache_dir)
+    for metric in ('new', 'new_avg', 'growth_factor', 'doubling_time'):
+        results[f'derive_metric[{metric}]'] = time_stage(
+            lambda _, metric=metric: derive_metric(jhu_df, 'Confirmed', metric), repeat=args.repeat
+        )
+    for key in ('load_jhu_data[csv]', 'load_jhu_data[cached]') + tuple(k for k in results if k.startswith('derive_metric')):
+        results[key]['rows'] = len(jhu_df)
+
+    world_df = jhu_df.loc[jhu_df.Province_State.isnull()]
+    us_df = jhu_df.loc[(jhu_df.Country_Region == 'United States') & jhu_df.Province_State.notnull()]
+    placeholder = pd.DataFrame({'Country_Region': [], 'Province_State': [], 'lockdown_date': [], 'lockdown_type': []})
+    world_chart = make_chart(world_df, placeholder, 'Country_Region', 'country', 50, 'Confirmed', args.days)
+    us_chart = make_chart(us_df, placeholder, 'Province_State', 'usa', 20, 'Confirmed', args.days)
+
+    ingests = [
+        ('_ingest_country_quarantine_df[new-export]', world_chart._ingest_country_quarantine_df,
+         synthetic.WORLD_QUARANTINE_CSV_NEW_EXPORT),
+        ('_ingest_country_quarantine_df', world_chart._ingest_country_quarantine_df, synthetic.WORLD_QUARANTINE_CSV),
+        ('_ingest_country_quarantine_df_old', world_chart._ingest_country_quarantine_df_old,
+         synthetic.WORLD_QUARANTINE_CSV_OLD),
+        ('_ingest_usa_quarantine_df', us_chart._ingest_usa_quarantine_df, synthetic.US_QUARANTINE_CSV),
+        ('_ingest_usa_quarantine_df_old', us_chart._ingest_usa_quarantine_df_old, synthetic.US_QUARANTINE_CSV_OLD),
+    ]
+    ingested = {}
+    for name, ingest, fname in ingests:
+        results[f'CovidChart.{name}'] = time_stage(
+            lambda paths, ingest=ingest, fname=fname: ingest(paths[fname]), lambda: fresh_load(paths), args.repeat
+        )
+        ingested[name] = ingest(paths[fname])
+        results[f'CovidChart.{name}']['rows'] = len(ingested[name])
+
+    world_chart = make_chart(
+        world_df, ingested['_ingest_country_quarantine_df[new-export]'], 'Country_Region', 'country', 50, 'Confirmed',
+        args.days
+    )
+    us_chart = make_chart(
+        us_df, ingested['_ingest_usa_quarantine_df'], 'Province_State', 'usa', 20, 'Confirmed', args.days
+    )
+    out_dir = os.path.join(data_dir, 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    results.update(chart_stages('world', world_chart, out_dir, args.repeat))
+    results.update(chart_stages('us', us_chart, out_dir, args.repeat))
+    return results
+
+
+def print_results(results, baseline=None):
+    width = max(len(name) for name in results)
+    header = f'{"stage":<{width}} {"rows":>9} {"median (s)":>11} {"min (s)":>9}'
+    if baseline is not None:
+        header += f' {"baseline (s)":>13} {"ratio":>7}'
+    print(header)
+    for name, stats in results.items():
+        line = f'{name:<{width}} {stats["rows"]:>9} {stats["median"]:>11.4f} {stats["min"]:>9.4f}'
+        if baseline is not None:
+            old = baseline['stages'].get(name)
+            if old is None:
+                line += f' {"-":>13} {"-":>7}'
+            else:
+                line += f' {old["median"]:>13.4f} {stats["median"] / old["median"]:>7.2f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=200, help='number of countries (and of US states)')
+    parser.add_argument('--days', type=int, default=120, help='number of days of case data')
+    parser.add_argument('--events', type=int, default=20, help='number of quarantine events per group')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help=f'where to write the json results (default: {RESULTS_DIR}/<commit>.json)')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    # pandas deprecation warnings from chartlib would drown out the results
+    warnings.simplefilter('ignore', FutureWarning)
+    commit, dirty = git_commit()
+    with tempfile.TemporaryDirectory() as data_dir:
+        # the benchmark data can be much larger than what altair inlines by default
+        with alt.data_transformers.enable('default', max_rows=None):
+            results = run(args, data_dir)
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'altair': alt.__version__,
+        'params': {k: getattr(args, k) for k in ('groups', 'days', 'events', 'repeat', 'seed')},
+        'stages': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f'{(commit or "unknown")[:12]}{"-dirty" if dirty else ""}.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline['params'] != report['params']:
+            print(f'warning: baseline was run with {baseline["params"]}', file=sys.stderr)
+    print_results(results, baseline)
+    print(f'wrote {output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
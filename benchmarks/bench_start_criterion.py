@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Times `DaysSinceNumReached.transform` on the JHU data replicated 1x, 10x and 100x
+(each copy gets its own group names), comparing against the old row-wise implementation.
+
+Run from the repository root:
+
+    benchmarks/bench_start_criterion.py [--scales 1 10 100] [--rowwise-max-scale 10]
+"""
+import argparse
+import sys
+import time
+from types import SimpleNamespace
+sys.path.append('.')
+
+import pandas as pd
+
+from chartlib import DaysSinceNumReached, days_between, load_jhu_data
+
+
+def rowwise_transform(criterion, chart, df):
+    # the implementation that `DaysSinceNumReached.transform` replaced; kept for comparison
+    col = criterion.col if criterion.col is not None else chart.Y
+    days_since_N = df[df[col] > criterion.N].groupby(chart.groupcol, observed=True)[chart.xcol].min().to_dict()
+    df['date_of_N'] = df.apply(lambda x: days_since_N.get(x[chart.groupcol]), axis=1)
+    df = df.dropna(subset=['date_of_N'])
+    df[chart.X] = df.apply(lambda x: days_between(x['date_of_N'], x[chart.xcol]), axis=1)
+    return df
+
+
+def make_frame(scale):
+    jhu_df = load_jhu_data()
+    jhu_df = jhu_df.loc[jhu_df.Province_State.isnull()]
+    copies = []
+    for i in range(scale):
+        copy = jhu_df.copy()
+        copy['Country_Region'] = copy['Country_Region'].astype(str) + f'-{i}'
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def time_it(fn, *args):
+    start = time.perf_counter()
+    ret = fn(*args)
+    return time.perf_counter() - start, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100])
+    parser.add_argument('--rowwise-max-scale', type=int, default=10,
+                        help='skip the row-wise implementation above this scale')
+    args = parser.parse_args()
+
+    chart = SimpleNamespace(xcol='Date', groupcol='Country_Region', X='x', Y='y')
+    criterion = DaysSinceNumReached(50, 'Confirmed')
+    print(f'{"scale":>6} {"rows":>10} {"vectorized (s)":>15} {"row-wise (s)":>13}')
+    for scale in args.scales:
+        df = make_frame(scale)
+        vectorized_time, vectorized = time_it(criterion.transform, chart, df.copy())
+        rowwise_time = float('nan')
+        if scale <= args.rowwise_max_scale:
+            rowwise_time, rowwise = time_it(rowwise_transform, criterion, chart, df.copy())
+            pd.testing.assert_frame_equal(vectorized, rowwise, check_dtype=False)
+        print(f'{scale:>6} {len(df):>10} {vectorized_time:>15.3f} {rowwise_time:>13.3f}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
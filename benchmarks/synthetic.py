@@ -0,0 +1,220 @@
+"""
+Synthetic inputs for the benchmarks: JHU-shaped case data and quarantine event tables in every format
+that chartlib ingests, scaled by number of groups, days and events per group.
+
+Every group appears both as a country (`Country_Region`, no `Province_State`) and as a US state
+(`Country_Region` 'United States'), so the same data drives both the world and the US charts.
+"""
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+
+START_DATE = '2020-01-22'
+DATE_FORMAT = '%m-%d-%Y'
+
+# file names matter: the world ingest picks its event encoding based on the csv name
+JHU_CSV = 'jhu-data.csv'
+JHU_COUNTY_CSV = 'jhu-county-data.csv'
+US_QUARANTINE_CSV = 'combined-activity-US.csv'
+US_QUARANTINE_CSV_OLD = 'quarantine-activity-US.csv'
+WORLD_QUARANTINE_CSV = 'quarantine-activity-Apr19.csv'
+WORLD_QUARANTINE_CSV_NEW_EXPORT = 'quarantine-activity-world-new-export.csv'
+WORLD_QUARANTINE_CSV_OLD = 'quarantine-activity.csv'
+
+US_MEASURE_VALUES = {
+    'State of Emergency Declaration': ['State of Emergency declared'],
+    'Travel Restrictions': [
+        'Travel restrictions for out of state travelers', 'Travel restrictions for out of state travelers lifted',
+        'Border closures',
+    ],
+    'Shelter-in-place Order': ['Shelter-in-place order', 'Shelter-in-place order lifted', 'Night-time curfew'],
+    'Gathering Limitations': ['Banned gatherings of a certain size', 'Suggested limiting of gatherings'],
+    'Banning Gatherings of a Certain Size': [10.0, 50.0, 250.0],
+    'K-12 School Closure': ['Schools closed'],
+    'Bar and Dine-in Restaurant Closure': [
+        'Bar and dine-in restaurant closed (except take-out and delivery)',
+        'Bar and dine-in restaurant open with extra requirements',
+    ],
+    'Non-essential Businesses Closure': [
+        'Non-essential businesses closed', 'Some (cherry-picked) businesses closed',
+        'Non-essential businesses allowed to operate possibly with extra requirements',
+    ],
+    'Face Covering Requirements': ['Face covering requirements for some workers'],
+}
+US_COVERAGES = ['State-wide', 'State-wide', 'State-wide', 'Selected counties']
+
+WORLD_MEASURE_VALUES = {
+    'Travel Restrictions': ['Screening', 'Quarantine on high-risk regions', 'Ban on high risk regions'],
+    'Shelter-in-place Order': ['Restrict movement'],
+    'Gathering Limitations': ['Required Cancelling Public Events'],
+    'K-12 School Closure': ['Required Closing'],
+    'Non-essential Businesses Closure': ['Required Closing Workspaces'],
+}
+WORLD_COVERAGES = ['General', 'General', 'Targeted', None]
+
+NEW_EXPORT_MEASURE_VALUES = {
+    'K-12 School Closure': ['Require closing all levels', 'recommend closing', 'No measures'],
+    'Non-essential Businesses Closure': [
+        '3 require closing (or work from home) all-but essential workplaces',
+        '1 recommend closing (or work from home)', 'No measures',
+    ],
+    'Gathering Limitations': ['Require cancelling', 'Recommend cancelling', 'No measures'],
+    'Shelter-in-place Order': [
+        'Require not leaving house with minimal exceptions', 'recommend not leaving house', 'No measures',
+    ],
+    'Travel Restrictions': ['Total border closure', 'Screening', 'No measures'],
+}
+
+
+def group_names(groups: int):
+    return [f'Group {idx:05d}' for idx in range(groups)]
+
+
+def _dates(days: int) -> pd.DatetimeIndex:
+    return pd.date_range(START_DATE, periods=days, freq='D')
+
+
+def make_jhu_frame(groups: int, days: int, seed: int = 0) -> pd.DataFrame:
+    """Cumulative case counts that grow exponentially from a random onset, like `data/jhu-data.csv`."""
+    rng = np.random.default_rng(seed)
+    names = np.array(group_names(groups), dtype=object)
+    onset = rng.integers(0, max(days // 2, 1), size=groups)
+    rate = rng.uniform(0.08, 0.3, size=groups)
+    t = np.arange(days)
+    growth = np.clip(t[None, :] - onset[:, None], 0, None) * rate[:, None]
+    confirmed = np.floor(np.minimum(np.exp(growth), 5e6)) * (t[None, :] >= onset[:, None])
+    deaths = np.floor(confirmed * rng.uniform(0.01, 0.08, size=(groups, 1)))
+    recovered = np.floor(confirmed * rng.uniform(0.1, 0.5, size=(groups, 1)))
+    frame = pd.DataFrame({
+        'Country_Region': np.repeat(names, days),
+        'Province_State': np.nan,
+        'Confirmed': confirmed.ravel(),
+        'Recovered': recovered.ravel(),
+        'Active': (confirmed - recovered - deaths).ravel(),
+        'Deaths': deaths.ravel(),
+        'Date': np.tile(_dates(days).strftime(DATE_FORMAT), groups),
+    })
+    states = frame.assign(Province_State=frame.Country_Region, Country_Region='United States')
+    return pd.concat([frame, states], ignore_index=True)
+
+
+def make_jhu_county_frame(groups: int, counties: int, days: int, seed: int = 0) -> pd.DataFrame:
+    """County case counts for `counties` counties in each US state, like `data/jhu-county-data.csv`."""
+    frame = make_jhu_frame(groups * counties, days, seed)
+    frame = frame.loc[frame.Province_State.isnull()]
+    county_idx = np.repeat(np.arange(groups * counties), days)
+    return frame.assign(
+        Country_Region='United States',
+        Province_State=np.array(group_names(groups), dtype=object)[county_idx // counties],
+        Admin2=np.array([f'County {idx:03d}' for idx in range(counties)], dtype=object)[county_idx % counties],
+    )[['Country_Region', 'Province_State', 'Admin2', 'Confirmed', 'Recovered', 'Active', 'Deaths', 'Date']]
+
+
+def _event_rows(rng, groups: int, days: int, events: int):
+    # one (group, date) pair per event, with dates sorted within each group
+    group_idx = np.repeat(np.arange(groups), events)
+    day_idx = np.sort(rng.integers(0, days, size=(groups, events)), axis=1).ravel()
+    return np.array(group_names(groups), dtype=object)[group_idx], _dates(days)[day_idx].strftime(DATE_FORMAT)
+
+
+def _fill_measures(rng, n: int, measure_values: Dict, frame: pd.DataFrame):
+    # every event sets one measure, picked at random, to one of its values
+    measures = list(measure_values)
+    which = rng.integers(0, len(measures), size=n)
+    for idx, measure in enumerate(measures):
+        values = np.array(measure_values[measure], dtype=object)
+        column = np.full(n, np.nan, dtype=object)
+        chosen = which == idx
+        column[chosen] = values[rng.integers(0, len(values), size=chosen.sum())]
+        frame[measure] = column
+    return frame
+
+
+def make_us_quarantine_frame(groups: int, days: int, events: int, seed: int = 0) -> pd.DataFrame:
+    """US state events, like `data/combined-activity-US-Jun9.csv`."""
+    rng = np.random.default_rng(seed + 1)
+    names, dates = _event_rows(rng, groups, days, events)
+    frame = pd.DataFrame({
+        'State': names,
+        'Effective Date': dates,
+        'Coverage': np.array(US_COVERAGES, dtype=object)[rng.integers(0, len(US_COVERAGES), size=len(names))],
+    })
+    return _fill_measures(rng, len(names), US_MEASURE_VALUES, frame)
+
+
+def make_world_quarantine_frame(groups: int, days: int, events: int, seed: int = 0) -> pd.DataFrame:
+    """Country events, like `data/quarantine-activity-Apr19.csv`."""
+    rng = np.random.default_rng(seed + 2)
+    names, dates = _event_rows(rng, groups, days, events)
+    frame = pd.DataFrame({
+        'country_name': names,
+        'date': dates,
+        'coverage': np.array(WORLD_COVERAGES, dtype=object)[rng.integers(0, len(WORLD_COVERAGES), size=len(names))],
+    })
+    return _fill_measures(rng, len(names), WORLD_MEASURE_VALUES, frame)
+
+
+def make_world_new_export_frame(groups: int, days: int, events: int, seed: int = 0) -> pd.DataFrame:
+    """Country events that are interpreted relative to earlier ones, like the new OxCGRT world export."""
+    frame = make_world_quarantine_frame(groups, days, events, seed)
+    rng = np.random.default_rng(seed + 3)
+    frame = _fill_measures(rng, len(frame), NEW_EXPORT_MEASURE_VALUES, frame)
+    return frame.rename(columns={'coverage': 'Coverage'})
+
+
+def make_us_quarantine_frame_old(groups: int, days: int, events: int, seed: int = 0) -> pd.DataFrame:
+    """US lockdowns in the old format of `data/quarantine-activity-US.csv`."""
+    rng = np.random.default_rng(seed + 4)
+    names, dates = _event_rows(rng, groups, days, events)
+    n = len(names)
+    return pd.DataFrame({
+        'Province_State': names,
+        'Regions': np.where(rng.random(n) < 0.8, 'All', 'Some County'),
+        'State of emergency declared': _dates(days)[rng.integers(0, days, size=n)].strftime(DATE_FORMAT),
+        'Date Enacted': dates,
+        'Type': np.array(['Level 2 Lockdown', 'Level 1 Lockdown', 'None'], dtype=object)[rng.integers(0, 3, size=n)],
+    })
+
+
+def make_world_quarantine_frame_old(groups: int, days: int, events: int, seed: int = 0) -> pd.DataFrame:
+    """Country lockdowns in the old format of `data/quarantine-activity.csv`."""
+    rng = np.random.default_rng(seed + 5)
+    names, dates = _event_rows(rng, groups, days, events)
+    n = len(names)
+    choice = lambda values: np.array(values, dtype=object)[rng.integers(0, len(values), size=n)]
+    return pd.DataFrame({
+        'Country_Region': names,
+        'Date Enacted': dates,
+        'Type': choice(['Internal Lockdown', 'Border Control', 'School Closure']),
+        'Scope': choice(['Full', 'Partial']),
+        'Level': choice(['Enforcement', 'Enforcement', 'None']),
+    })
+
+
+def write_synthetic_data(
+        out_dir: str, groups: int, days: int, events: int, seed: int = 0, counties: int = 0
+) -> Dict[str, str]:
+    """
+    Writes every synthetic csv into `out_dir`; returns the paths keyed by file name.
+    The county csv is only written if `counties` (per state) is positive.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    frames = {
+        JHU_CSV: make_jhu_frame(groups, days, seed),
+        US_QUARANTINE_CSV: make_us_quarantine_frame(groups, days, events, seed),
+        US_QUARANTINE_CSV_OLD: make_us_quarantine_frame_old(groups, days, events, seed),
+        WORLD_QUARANTINE_CSV: make_world_quarantine_frame(groups, days, events, seed),
+        WORLD_QUARANTINE_CSV_NEW_EXPORT: make_world_new_export_frame(groups, days, events, seed),
+        WORLD_QUARANTINE_CSV_OLD: make_world_quarantine_frame_old(groups, days, events, seed),
+    }
+    if counties > 0:
+        frames[JHU_COUNTY_CSV] = make_jhu_county_frame(groups, counties, days, seed)
+    paths = {}
+    for fname, frame in frames.items():
+        paths[fname] = os.path.join(out_dir, fname)
+        # the jhu csvs are written with their index, like data/processData.py does
+        frame.to_csv(paths[fname], index=fname in (JHU_CSV, JHU_COUNTY_CSV))
+    return paths
@@ -1,3 +1,9 @@
 from .covid_chart import CovidChart
+from .datasets import (
+    load_dataset, load_ingested_data, load_jhu_county_data, load_jhu_data, load_jhu_hierarchy, load_quarantine_data
+)
+from .hierarchy import add_rollups, select_level
+from .instrument import add_stage_listener, recording_stages, remove_stage_listener, stage
+from .metrics import add_metric, derive_metric, metric_name
 from .start_criterion import DaysSinceNumReached
-from .utils import days_between
\ No newline at end of file
+from .utils import days_between
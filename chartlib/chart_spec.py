@@ -1,8 +1,19 @@
+import copy
+import json
+import re
+
 import altair as alt
 import numpy as np
 import pandas as pd
 
 from .dot_dict import DotDict
+from .dtypes import compact_int_dtype
+from .export import dataset_refs
+from .instrument import stage
+from .lru import LRUCache
+
+# compiled specs by the properties and data layout they were compiled for (see `ChartSpec.compile_to_dict`)
+TEMPLATE_CACHE = LRUCache(max_entries=64)
 
 
 def _fontSettings(font):
@@ -29,6 +40,116 @@ def _ensure_parens(expr):
     return f'({expr})'
 
 
+# `datum.field` or `datum["field"]` in a vega expression
+_DATUM_FIELD = re.compile(r'datum\.([A-Za-z_$][\w$]*)|datum\[\s*[\'"]([^\'"]+)[\'"]\s*\]')
+# keys of a Vega-Lite spec whose string values are expressions over `datum`
+_EXPRESSION_KEYS = ('filter', 'calculate', 'test', 'expr')
+
+
+def _referenced_fields(node, fields):
+    # collect the data fields that a Vega-Lite spec dict reads: encoding, selection and transform fields,
+    # plus the fields of `datum` used in expressions
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ('field', 'lookup') and isinstance(value, str):
+                fields.add(value)
+            elif key in ('fields', 'groupby', 'fold') and isinstance(value, list):
+                fields.update(field for field in value if isinstance(field, str))
+            elif key in _EXPRESSION_KEYS and isinstance(value, str):
+                fields.update(match.group(1) or match.group(2) for match in _DATUM_FIELD.finditer(value))
+            else:
+                _referenced_fields(value, fields)
+    elif isinstance(node, list):
+        for value in node:
+            _referenced_fields(value, fields)
+    return fields
+
+
+def _round_significant(values: pd.Series, digits: int) -> pd.Series:
+    # round to `digits` significant digits, such that the results print as at most that many digits
+    array = values.to_numpy(dtype=float, na_value=np.nan, copy=True)
+    nonzero = np.isfinite(array) & (array != 0)
+    exponents = digits - 1 - np.floor(np.log10(np.abs(array[nonzero]))).astype(int)
+    # dividing (rather than multiplying) by an exact power of 10 gives the closest float to the decimal
+    rounded = np.where(
+        exponents >= 0,
+        np.round(array[nonzero] * 10. ** exponents) / 10. ** exponents,
+        np.round(array[nonzero] / 10. ** -exponents) * 10. ** -exponents,
+    )
+    array[nonzero] = rounded
+    return pd.Series(array, index=values.index, name=values.name)
+
+
+def _dictionary_code(values: pd.Series, code_col: str, force: bool = False):
+    # integer codes for the strings of `values`, the most frequent first so that they print shortest, and
+    # the strings in code order; unless `force`d, None if the codes and their lookup table don't take fewer
+    # bytes than the strings would repeated on every row
+    distinct = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else values
+    if pd.api.types.infer_dtype(distinct, skipna=True) not in ('string', 'empty'):
+        return None
+    counts = values.value_counts(sort=True, dropna=True)
+    counts = counts[counts > 0]
+    if len(counts) == 0 and not force:
+        return None
+    counts_array = counts.to_numpy()
+    strings = [str(value) for value in counts.index]
+    string_lens = np.array([len(json.dumps(string)) for string in strings])
+    code_lens = np.array([len(str(code)) for code in range(len(strings))])
+    saved = (string_lens - code_lens) @ counts_array
+    saved -= len(values) * (len(code_col) - len(values.name))
+    # table rows look like {"code": 12, "<name>": "<string>"}
+    saved -= (string_lens + len(values.name) + 4).sum()
+    if saved <= 0 and not force:
+        return None
+    codes = values.astype(object).map(dict(zip(counts.index, range(len(strings)))))
+    return codes.astype(compact_int_dtype(codes)), strings
+
+
+def _json_scalar(value):
+    # numpy scalars in spec properties, e.g. a domain computed from the data; anything else has no
+    # faithful json form, so specs with it are not cached
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not json serializable')
+
+
+def _named_values(data):
+    # the dataset name and rows that altair gives `data` in a spec
+    spec = alt.Chart(data).to_dict(validate=False)
+    name = spec['data']['name']
+    return name, spec['datasets'][name]
+
+
+class _SpecTemplate(object):
+    # a compiled spec dict without the datasets derived from the rows of the chart's data, plus what it takes
+    # to derive them again: the columns that were projected and the ones that were dictionary-encoded
+    def __init__(self, spec, data_name, table_name, projection):
+        # a copy, since callers may rewrite the data references of their spec (see `externalize_datasets`)
+        self.spec = copy.deepcopy({key: value for key, value in spec.items() if key != 'datasets'})
+        # in their original order, with None for the ones to derive again
+        self.datasets = [
+            (name, None if name in (data_name, table_name) else values)
+            for name, values in spec.get('datasets', {}).items()
+        ]
+        self.data_name = data_name
+        self.table_name = table_name
+        self.projection = projection
+
+    def fill(self, data, table):
+        """The spec with the datasets of `data` and its lookup `table` in place of the ones it was compiled with."""
+        derived = {self.data_name: _named_values(data)}
+        if self.table_name is not None:
+            derived[self.table_name] = _named_values(table)
+        spec = copy.deepcopy(self.spec)
+        for ref in dataset_refs(spec, []):
+            if ref['name'] in derived:
+                ref['name'] = derived[ref['name']][0]
+        spec['datasets'] = dict(
+            derived[name] if values is None else (name, values) for name, values in self.datasets
+        )
+        return spec
+
+
 class ChartSpec(DotDict):
     """
     A wrapper around a dictionary capturing all the state that determines how
@@ -57,6 +178,12 @@ class ChartSpec(DotDict):
     DEFAULT_BACKGROUND_COLOR = 'white'
     DEFAULT_MIN_TREND_LINE_DAYS = 5
     DEFAULT_FONT = 'Khula'
+    # significant digits kept of float columns in the chart data
+    DEFAULT_DATA_PRECISION = 6
+    # dictionary-encoded string columns `col` are shipped as codes in `_col`, decoded by looking them up
+    # in a per-chart table keyed by `code`
+    ENCODED_COL_PREFIX = '_'
+    LOOKUP_KEY = 'code'
     MAX_LEGEND_MARKS = 33
     MAX_EMOJI_LEGEND_MARKS = 7
     EMPTY_SELECTION = ''
@@ -326,7 +453,7 @@ class ChartSpec(DotDict):
             ret = base.mark_image(height=size, width=size).encode(
                 x=self._get_x(), y=self._get_y(f'{ycol}:Q'),
                 opacity=alt.value(1),
-                url='image_url'
+                url='image_url:N'
             )
             if 'event_index' in df.columns:
                 ret = ret.transform_calculate(**{
@@ -528,8 +655,12 @@ class ChartSpec(DotDict):
             self[self.TRANSIENT]['colorby'] = self._get_old_legend_title()
             self[self.TRANSIENT]['detailby'] = self._get_old_legend_title()
 
+    def _manual_legend_groups(self, df):
+        groups = df.groupby(self.colorby)[['group_idx']].first().reset_index()
+        return groups.sort_values(self.colorby, ascending=True)
+
     def _make_manual_legend(self, df, click_selection):
-        groups = df.groupby(self.colorby).first().reset_index().sort_values(self.colorby, ascending=True)
+        groups = self._manual_legend_groups(df)
         group_names = list(groups[self.colorby].values)
         if len(group_names) > self.MAX_LEGEND_MARKS:
             raise ValueError(f'max {self.MAX_LEGEND_MARKS} supported for now ({len(group_names)} requested)')
@@ -684,7 +815,168 @@ class ChartSpec(DotDict):
     #         self._colorby: group_names,
     #     })
 
+    def _encode_strings(self, projected, encoded_cols=None):
+        """
+        Replaces the string columns of `projected` that repeat a few distinct values on many rows (`x_type`,
+        `lockdown_type`, `image_url`, the `Select_<group>` names, ...) by integer codes in `_<column>`, and
+        returns the frame and one table of the distinct values to look the codes up in (None if no column was
+        encoded). A column is only encoded if its codes and their table take fewer bytes than the strings; if
+        `encoded_cols` is given, those columns are encoded regardless (unless they no longer hold strings). `_lookups` makes the Vega-Lite lookup
+        transforms that restore the original fields before any layer reads them.
+        """
+        facetby = self.get('facetby', None)
+        table = {}
+        for col in list(projected.columns) if encoded_cols is None else encoded_cols:
+            code_col = f'{self.ENCODED_COL_PREFIX}{col}'
+            # vega-lite facets the data before any transform, so the facet column stays as it is
+            if col in (facetby, self.LOOKUP_KEY) or code_col in projected.columns:
+                continue
+            encoded = _dictionary_code(projected[col], code_col, force=encoded_cols is not None)
+            if encoded is None:
+                continue
+            codes, strings = encoded
+            projected.insert(projected.columns.get_loc(col), code_col, codes)
+            del projected[col]
+            table[col] = strings
+        if len(table) == 0:
+            return projected, None
+        num_codes = max(len(strings) for strings in table.values())
+        return projected, pd.DataFrame({
+            self.LOOKUP_KEY: np.arange(num_codes),
+            **{col: strings + [None] * (num_codes - len(strings)) for col, strings in table.items()},
+        })
+
+    def _lookups(self, table):
+        if table is None:
+            return []
+        return [
+            # the decoded strings go to a separate field from the codes, since layers may share their data tuples
+            alt.LookupTransform(**{
+                'lookup': f'{self.ENCODED_COL_PREFIX}{col}',
+                'from': alt.LookupData(data=table, key=self.LOOKUP_KEY, fields=[col]),
+            }) for col in table.columns if col != self.LOOKUP_KEY
+        ]
+
+    def _referenced_columns(self, df, layers):
+        """
+        The columns of `df` that the layers reading it reference: encoding, selection and transform fields,
+        `datum.*` in filter and calculate expressions, and the facet column.
+        """
+        fields = set()
+        for layer in layers.values():
+            if layer.data is df:
+                # without the data, so that altair doesn't serialize it; `context` still lets it infer field types
+                layer = layer.copy(deep=False)
+                layer.data = alt.Undefined
+                _referenced_fields(layer.to_dict(validate=False, context={'data': df}), fields)
+        facetby = self.get('facetby', None)
+        if facetby is not None:
+            fields.add(facetby)
+        return [col for col in df.columns if col in fields]
+
+    def _project_data(self, df, columns, encoded_cols=None):
+        """
+        Just `columns` of `df` (see `_referenced_columns`), which is what altair serializes into the spec instead
+        of every column that the preprocessing produced along the way. Float columns are rounded to the spec's
+        `data_precision` significant digits (`DEFAULT_DATA_PRECISION` unless set; None keeps full precision),
+        so that they print as at most that many digits, and repeated strings are dictionary-encoded (see
+        `_encode_strings`). Returns the frame and the lookup table of the encoded strings (or None).
+        """
+        projected = df.loc[:, columns]
+        precision = self.get('data_precision', self.DEFAULT_DATA_PRECISION)
+        if precision is not None:
+            for col in projected.columns:
+                if pd.api.types.is_float_dtype(projected[col]):
+                    projected[col] = _round_significant(projected[col], precision)
+        if not self.get('encode_strings', True):
+            return projected, None
+        return self._encode_strings(projected, encoded_cols)
+
+    def _with_projected_data(self, df, layers):
+        # give the layers that read `df` just the columns they reference, rounded to the data precision,
+        # rather than every column that the preprocessing produced along the way. Returns the layers, the
+        # lookup transforms that the layer chart should apply to decode dictionary-encoded strings, and the
+        # projected frame, its lookup table and the projection (see `_SpecTemplate`).
+        columns = self._referenced_columns(df, layers)
+        projected, table = self._project_data(df, columns)
+        lookups = self._lookups(table)
+        # the layer chart only holds the data (and so only runs its transforms on it) if all layers share it
+        lookups_on_layers = not all(layer.data is df for layer in layers.values())
+        projected_layers = {}
+        for name, layer in layers.items():
+            if layer.data is df:
+                layer = layer.copy(deep=False)
+                layer.data = projected
+                if lookups_on_layers and len(lookups) > 0:
+                    layer.transform = lookups + ([] if layer.transform is alt.Undefined else list(layer.transform))
+            projected_layers[name] = layer
+        encoded_cols = [] if table is None else [col for col in table.columns if col != self.LOOKUP_KEY]
+        return (
+            projected_layers, [] if lookups_on_layers else lookups, projected, table, (columns, encoded_cols)
+        )
+
+    def _template_key(self, df):
+        # everything that shapes the compiled spec besides the rows of the data: the spec's properties, the
+        # columns of `df` and the types that altair infers for them, and the groups and emojis that end up in
+        # selections, color scales and legends. None if the properties can't be told apart by their json.
+        try:
+            props = json.dumps(self, sort_keys=True, default=_json_scalar)
+        except (TypeError, ValueError):
+            return None
+        key = [
+            props,
+            tuple((col, str(alt.utils.infer_vegalite_type(df[col]))) for col in df.columns),
+        ]
+        group_cols = [self.get('colorby', None), self.get('detailby', None), self._get_old_legend_title()]
+        for col in dict.fromkeys(group_cols):
+            if col in df.columns:
+                key.append(tuple(df[col].unique()))
+        if self._manual_legend:
+            groups = self._manual_legend_groups(df)
+            key.append(tuple(zip(groups[self.colorby], groups['group_idx'])))
+        if self.get('emoji_legend', False):
+            # the emoji legend only depends on which emojis there are
+            key.append(tuple(sorted(df['emoji'].dropna().unique())))
+        return tuple(key)
+
+    def compile_to_dict(self, df):
+        """
+        The Vega-Lite spec dict of `compile(df)`, validated. Specs are kept in `TEMPLATE_CACHE` by the spec's
+        properties and the layout of `df`, so a later call whose `df` only differs in its rows skips building
+        and validating the layers and just swaps in the chart's new data.
+        """
+        with stage('spec_to_dict', rows_in=len(df)) as record:
+            key = self._template_key(df)
+            template = None if key is None else TEMPLATE_CACHE.get(key)
+            if template is not None:
+                if template.projection is None:
+                    record['template_cache_hit'] = True
+                    return template.fill(df, None)
+                columns, encoded_cols = template.projection
+                projected, table = self._project_data(df, columns, encoded_cols)
+                # a column that no longer holds strings can't be encoded as before; compile the spec afresh
+                if encoded_cols == ([] if table is None else [col for col in table.columns if col != self.LOOKUP_KEY]):
+                    record['template_cache_hit'] = True
+                    return template.fill(projected, table)
+            record['template_cache_hit'] = False
+            chart, data, table, projection = self._compile(df)
+            spec = chart.to_dict()
+            if key is None:
+                return spec
+            TEMPLATE_CACHE.put(key, _SpecTemplate(
+                spec,
+                _named_values(data)[0],
+                None if table is None else _named_values(table)[0],
+                projection,
+            ))
+            return spec
+
     def compile(self, df):
+        return self._compile(df)[0]
+
+    def _compile(self, df):
+        # the chart, plus the frame and lookup table that the layers reading `df` got, and the projection
+        # that made them (None if the data is not projected)
         self.validate(df)
         self[self.TRANSIENT] = DotDict()
         try:
@@ -802,7 +1094,13 @@ class ChartSpec(DotDict):
             if self.get('emoji_legend', False):
                 self._collect_emoji_legend_layers(df, layers)
 
+            lookups, data, table, projection = [], df, None, None
+            if self.get('project_data', True):
+                layers, lookups, data, table, projection = self._with_projected_data(df, layers)
+
             layered = alt.layer(*layers.values())
+            if len(lookups) > 0:
+                layered.transform = lookups
             layered = self._maybe_add_facet(layered)
             if self.get('interactive', False):
                 layered = layered.interactive(bind_x=True, bind_y=True)
@@ -820,6 +1118,6 @@ class ChartSpec(DotDict):
                 final_chart = final_chart.configure_legend(symbolType='diamond')
             alt.themes.register('customFont', _fontSettings(self._font))
             alt.themes.enable('customFont')
-            return final_chart
+            return final_chart, data, table, projection
         finally:
             del self[self.TRANSIENT]
@@ -1,19 +1,27 @@
 from __future__ import annotations
 from typing import Union, Dict
 
+import altair as alt
 import numpy as np
 import pandas as pd
 
 from .chart_spec import ChartSpec
+from .datasets import load_ingested_data, load_quarantine_data
+from .dtypes import X_DTYPE, X_TYPE_DTYPE, align_categories, compact_frame, concat_frames, with_dtypes
+from .export import externalize_datasets
+from .hierarchy import LEVEL, LEVELS, LEVEL_COLS, select_level
+from .instrument import stage
+from .metrics import CUMULATIVE, add_metric, derive_metric, parse_metric_name
 from .start_criterion import StartCriterion
 from .utils import (
-    create_lockdown_type,
-    create_lockdown_type_world,
-    create_lockdown_type_world_new_export,
-    days_between,
+    copy_on_write,
+    encode_new_export_lockdown_types,
+    encode_us_lockdown_types,
+    encode_world_lockdown_types,
     strip_nans,
     split_into_list,
-    str2emo
+    str2emo,
+    to_datetime_series
 )
 
 
@@ -42,13 +50,14 @@ class CovidChart(object):
             groupcol: str,
             start_criterion: StartCriterion,
             ycol: str,
-            level: str = 'US',  # one of: [usa_old, US, USA, country]
+            level: str = 'US',  # one of: [usa_old, US, USA, country, county]
             use_defaults: bool = True,
             ycol_is_cumulative: bool = True,
             top_k_groups: int = None,
             xcol: str = 'date',
             quarantine_df: Union[str, pd.DataFrame] = None,
             sample_every: int = None,
+            parent: Dict[str, str] = None,
     ):
         object.__setattr__(self, 'groupcol', groupcol)
         object.__setattr__(self, 'start_criterion', start_criterion)
@@ -62,22 +71,39 @@ class CovidChart(object):
 
         if isinstance(df, str):
             df = pd.read_csv(df, parse_dates=[xcol], infer_datetime_format=True)
+        if LEVEL in df.columns:
+            # a frame with rollups (see `load_jhu_hierarchy`); keep the groups at our level
+            df = select_level(df, level, parent)
+        elif parent is not None:
+            raise ValueError('parent filters need a frame with a level column, e.g. from load_jhu_hierarchy')
+        for col in (ycol, getattr(start_criterion, 'col', None)):
+            if col is not None and col not in df.columns and parse_metric_name(col) is not None:
+                # a derived metric, e.g. Confirmed_new_avg_7d (see `metrics.metric_name`)
+                df = add_metric(df, col, group_cols=self._metric_group_cols(df), date_col=xcol)
         self._validate_df(df)
 
         readable_group_name = level
         if isinstance(quarantine_df, str):
             if level.lower() == 'usa_old':
-                quarantine_df = self._ingest_usa_quarantine_df_old(quarantine_df)
+                ingest = self._ingest_usa_quarantine_df_old
                 readable_group_name = 'state'
             elif level.lower() in ['us', 'usa', 'united states']:
-                quarantine_df = self._ingest_usa_quarantine_df(quarantine_df)
+                ingest = self._ingest_usa_quarantine_df
                 readable_group_name = 'state'
             elif level.lower() in ('country', 'world'):
-                quarantine_df = self._ingest_country_quarantine_df(quarantine_df)
+                ingest = self._ingest_country_quarantine_df
+            elif level.lower() == 'county':
+                # counties take the events of their state
+                ingest = self._ingest_usa_quarantine_df
             else:
-                raise ValueError('invalid level %s: only "US" and "country" allowed now' % level)
-        quarantine_df = quarantine_df.dropna(subset=[groupcol, 'lockdown_date'])
-        self._validate_quarantine_df(quarantine_df)
+                raise ValueError('invalid level %s: only "US", "country" and "county" allowed now' % level)
+            # cached by ingest method rather than `level`, so that aliases like US / USA share an entry
+            quarantine_df = load_ingested_data(quarantine_df, groupcol, ingest)
+            if level.lower() == 'county':
+                quarantine_df = self._align_state_events_to_counties(quarantine_df, df)
+        if quarantine_df is not None:
+            quarantine_df = quarantine_df.dropna(subset=[groupcol, 'lockdown_date'])
+            self._validate_quarantine_df(quarantine_df)
 
         object.__setattr__(self, 'df', df)
         object.__setattr__(self, 'quarantine_df', quarantine_df)
@@ -89,6 +115,11 @@ class CovidChart(object):
         if use_defaults:
             self.set_defaults()
 
+    def _metric_group_cols(self, df):
+        # group by every hierarchy column, since e.g. county names repeat across states
+        group_cols = [LEVEL_COLS[level] for level in LEVELS if LEVEL_COLS[level] in df.columns]
+        return group_cols if self.groupcol in group_cols else group_cols + [self.groupcol]
+
     def _validate_df(self, df):
         if self.groupcol not in df.columns:
             raise ValueError('grouping col should be in dataframe cols')
@@ -104,7 +135,7 @@ class CovidChart(object):
             raise ValueError('lockdown_type should be in quarantine_df columns')
 
     def _ingest_country_quarantine_df(self, quarantine_csv):
-        quarantine_df = pd.read_csv(quarantine_csv)
+        quarantine_df = load_quarantine_data(quarantine_csv)
         quarantine_df = quarantine_df.rename(
              columns={'date': 'lockdown_date', 'Date Enacted': 'lockdown_date',
                       'country_name': 'Country_Region', 'Coverage': 'coverage'}
@@ -119,16 +150,12 @@ class CovidChart(object):
         }).reset_index()
         quarantine_df = quarantine_df.applymap(strip_nans)
         if quarantine_csv.endswith('quarantine-activity-world-new-export.csv'):
-            lockdown_mapper = create_lockdown_type_world_new_export
-            quarantine_df['lockdown_type'] = quarantine_df.apply(lambda x: lockdown_mapper(quarantine_df, x, 0), axis=1)
-            quarantine_df['emoji_string'] = quarantine_df.apply(lambda x: lockdown_mapper(quarantine_df, x, 1), axis=1)
+            quarantine_df[['lockdown_type', 'emoji_string']] = encode_new_export_lockdown_types(quarantine_df)
         else:
-            lockdown_mapper = create_lockdown_type_world
-            quarantine_df['lockdown_type'] = quarantine_df.apply(lambda x: lockdown_mapper(x, 0), axis=1)
-            quarantine_df['emoji_string'] = quarantine_df.apply(lambda x: lockdown_mapper(x, 1), axis=1)
+            quarantine_df[['lockdown_type', 'emoji_string']] = encode_world_lockdown_types(quarantine_df)
       
         
-        quarantine_df['lockdown_type'].replace('', np.nan, inplace=True)
+        quarantine_df['lockdown_type'] = quarantine_df['lockdown_type'].replace('', np.nan)
         quarantine_df = quarantine_df.dropna(subset=['lockdown_type'])
         quarantine_df = quarantine_df.groupby(['lockdown_date', 'Country_Region']).agg({
             'lockdown_type': lambda col: '; '.join(col),
@@ -149,10 +176,10 @@ class CovidChart(object):
             self.groupcol, 'lockdown_date', 'lockdown_type', 'emoji_string', 'emoji', 'event_index', 'Coverage'
         ]
         quarantine_df = quarantine_df[quarantine_cols]
-        return quarantine_df
+        return compact_frame(quarantine_df)
 
     def _ingest_country_quarantine_df_old(self, quarantine_csv):
-        quarantine_df = pd.read_csv(quarantine_csv)
+        quarantine_df = load_quarantine_data(quarantine_csv).copy()
         # rename SK
         quarantine_df.loc[quarantine_df.Country_Region == 'Korea, South', 'Country_Region'] = 'South Korea'
         quarantine_df = quarantine_df.loc[quarantine_df.Level == 'Enforcement']
@@ -168,10 +195,10 @@ class CovidChart(object):
         quarantine_df.loc[
             quarantine_df.lockdown_type == 'Partial Internal Lockdown', 'lockdown_type'
         ] = 'Region-Specific Countermeasures Begin'
-        return quarantine_df
+        return compact_frame(quarantine_df)
 
     def _ingest_usa_quarantine_df_old(self, quarantine_csv):
-        quarantine_df = pd.read_csv(quarantine_csv)
+        quarantine_df = load_quarantine_data(quarantine_csv)
         # only show statewide bars for now
         quarantine_df = quarantine_df.loc[quarantine_df.Regions == 'All']
         quarantine_df_emergency = quarantine_df.copy()
@@ -190,16 +217,15 @@ class CovidChart(object):
         quarantine_df = quarantine_df.rename(
             columns={'Date Enacted': 'lockdown_date', 'Lockdown Type': 'lockdown_type'}
         )
-        return quarantine_df
+        return compact_frame(quarantine_df)
 
     def _ingest_usa_quarantine_df(self, quarantine_csv):
-        quarantine_df = pd.read_csv(quarantine_csv)
+        quarantine_df = load_quarantine_data(quarantine_csv)
 
         quarantine_df = quarantine_df.rename(columns={'State': 'Province_State', 'Effective Date': 'lockdown_date'})
         quarantine_df = quarantine_df.sort_values('Coverage', ascending=True)
-        quarantine_df['lockdown_type'] = quarantine_df.apply(lambda x: create_lockdown_type(x, 0), axis=1)
-        quarantine_df['emoji_string'] = quarantine_df.apply(lambda x: create_lockdown_type(x, 1), axis=1)
-        quarantine_df['lockdown_type'].replace('', np.nan, inplace=True)
+        quarantine_df[['lockdown_type', 'emoji_string']] = encode_us_lockdown_types(quarantine_df)
+        quarantine_df['lockdown_type'] = quarantine_df['lockdown_type'].replace('', np.nan)
         quarantine_df = quarantine_df.dropna(subset=['lockdown_type'])
         quarantine_df = quarantine_df.groupby(['lockdown_date', 'Province_State']).agg({
             'lockdown_type': lambda col: '; '.join(col),
@@ -218,23 +244,39 @@ class CovidChart(object):
         quarantine_df['event_index'] = quarantine_df.groupby(['Province_State', 'lockdown_date']).cumcount()
 
         quarantine_cols = [
-            self.groupcol, 'lockdown_date', 'lockdown_type', 'emoji', 'emoji_string', 'event_index', 'Coverage'
+            'Province_State', 'lockdown_date', 'lockdown_type', 'emoji', 'emoji_string', 'event_index', 'Coverage'
         ]
         # quarantine_cols = ['Province_State', 'lockdown_date', 'lockdown_type', 'emoji']
         quarantine_df = quarantine_df[quarantine_cols]
-        return quarantine_df
+        return compact_frame(quarantine_df)
+
+    def _align_state_events_to_counties(self, quarantine_df, df) -> pd.DataFrame:
+        # regional events don't say which counties they cover, so every county gets its state's statewide events
+        counties = df[['Province_State', self.groupcol]].drop_duplicates()
+        statewide = quarantine_df.loc[quarantine_df.Coverage == 'Statewide']
+        statewide, counties = align_categories([statewide, counties])
+        return statewide.merge(counties, on='Province_State', how='inner')
+
+    def _broadcast(self, df, per_group: pd.Series):
+        # the values of `per_group`, a series indexed by group, on the rows of `df`; NA for groups missing from it
+        indexer = per_group.index.get_indexer(df[self.groupcol])
+        return pd.Series(per_group.array.take(indexer, allow_fill=True), index=df.index)
 
     def _preprocess_quarantine_df(self, df) -> pd.DataFrame:
-        quarantine_df = self.quarantine_df.copy()
-        quarantine_df[self.x_type] = self.lockdown_type
+        quarantine_df = self.quarantine_df.assign(
+            **{self.x_type: pd.Categorical([self.lockdown_type] * len(self.quarantine_df), dtype=X_TYPE_DTYPE)}
+        )
+        if isinstance(df[self.groupcol].dtype, pd.CategoricalDtype):
+            # merge on the chart's categories; events of groups outside of them are dropped by the inner merge
+            quarantine_df = with_dtypes(quarantine_df, {self.groupcol: df[self.groupcol].dtype})
         quarantine_df = quarantine_df.merge(
-            df[[self.groupcol, 'date_of_N', self.xmax]].groupby(self.groupcol).first(),
+            df.groupby(self.groupcol, observed=True)[['date_of_N', self.xmax]].first(),
             on=self.groupcol,
             how='inner'
         )
-        quarantine_df[self.X] = quarantine_df.apply(
-            lambda x: days_between(x['date_of_N'], x['lockdown_date']), axis=1
-        )
+        quarantine_df[self.X] = (
+            to_datetime_series(quarantine_df['lockdown_date']) - to_datetime_series(quarantine_df['date_of_N'])
+        ).dt.days.astype(X_DTYPE)
         del quarantine_df['date_of_N']
         if self.spec.get('filter_lockdown_rules_beyond_xmax', True):
             quarantine_df = quarantine_df.loc[quarantine_df.x <= quarantine_df.xmax]
@@ -244,37 +286,30 @@ class CovidChart(object):
 
         # enrich lockdown events with the chronological index of when they occur
         # (might be useful for downstream vega stuff)
-        quarantine_df[self.lockdown_idx] = quarantine_df.sort_values(self.X).groupby(self.groupcol).cumcount()
+        # (sorting x as int64, since numpy orders ties differently when sorting the narrower ints of X_DTYPE)
+        order = quarantine_df[self.X].astype('int64').sort_values().index
+        quarantine_df[self.lockdown_idx] = quarantine_df.loc[order].groupby(self.groupcol, observed=True).cumcount()
         return quarantine_df
 
     def _preprocess_lockdown_info(self, df) -> pd.DataFrame:
         quarantine_df = self._preprocess_quarantine_df(df)
         # for trends, use earliest statewide shelter-in-place that appears... eventually we will want to specify this somehow
-        trend_df = quarantine_df.loc[quarantine_df.Coverage == 'Statewide']
-        trend_df = trend_df.loc[trend_df.emoji_string == 'l']
-        trend_df = trend_df.loc[trend_df.groupby(self.groupcol).x.idxmin()]
-        df = df.merge(
-            trend_df.rename(columns={self.X: self.lockdown_x})[[self.groupcol, self.lockdown_x]],
-            how='left',
-            on=self.groupcol
-        )
+        trend_df = quarantine_df.loc[(quarantine_df.Coverage == 'Statewide') & (quarantine_df.emoji_string == 'l')]
+        df[self.lockdown_x] = self._broadcast(df, trend_df.groupby(self.groupcol, observed=True)[self.X].min())
 
         # NB (smacke): quick hack to avoid using early days to calculate the counterfactual slope
-        df_elim_early = df.loc[df.lockdown_x - df.x < 5]
-        idx_before_at_lockdown = df_elim_early.loc[df_elim_early.x <= df_elim_early.lockdown_x].groupby(df_elim_early[self.groupcol]).x.idxmax()
-        df_lockdown_y = df_elim_early.loc[idx_before_at_lockdown]
-        df_intercept = df_elim_early.loc[df_elim_early.groupby(self.groupcol).x.idxmin()]
-        df = df.merge(
-            df_intercept.rename(columns={self.Y: 'y_start', self.X: 'x_start'})[[self.groupcol, 'y_start', 'x_start']],
-            how='left',
-            on=self.groupcol
-        )
-        df = df.merge(
-            df_lockdown_y.rename(columns={self.Y: self.lockdown_y})[[self.groupcol, self.lockdown_y]],
-            how='left',
-            on=self.groupcol
+        df_elim_early = df.loc[df.lockdown_x - df.x < 5, [self.groupcol, self.X, self.Y, self.lockdown_x]]
+        idx_before_at_lockdown = df_elim_early.loc[df_elim_early.x <= df_elim_early.lockdown_x].groupby(df_elim_early[self.groupcol], observed=True).x.idxmax()
+        df_lockdown_y = df_elim_early.loc[idx_before_at_lockdown.to_numpy()].set_axis(idx_before_at_lockdown.index)
+        idx_intercept = df_elim_early.groupby(self.groupcol, observed=True).x.idxmin()
+        df_intercept = df_elim_early.loc[idx_intercept.to_numpy()].set_axis(idx_intercept.index)
+        df['y_start'] = self._broadcast(df, df_intercept[self.Y])
+        df['x_start'] = self._broadcast(df, df_intercept[self.X])
+        df[self.lockdown_y] = self._broadcast(df, df_lockdown_y[self.Y])
+        # in float64, since with nullable ints it would be a Float64 column with both NA and NaN
+        df['lockdown_slope'] = np.power(
+            df.lockdown_y.astype(float) / df.y_start.astype(float), 1. / (df.lockdown_x - df.x_start).astype(float)
         )
-        df['lockdown_slope'] = np.power(df.lockdown_y / df.y_start, 1. / (df.lockdown_x - df.x_start))
 
         # these new rows are to ensure we have at least one point where x == lockdown_x since this is the filter
         # used to generate lockdown rules...
@@ -282,15 +317,14 @@ class CovidChart(object):
 
         # TODO (smacke): instead of x and lockdown_x, we should have x and x_type, where x_type can be normal,
         # lockdown, etc... This will also generalize better if we want to change x based on e.g. a dropdown
-        new_rows = df.groupby(self.groupcol).max().reset_index()[[self.groupcol, self.lockdown_x]]
+        new_rows = df.groupby(self.groupcol, observed=True)[self.lockdown_x].max().reset_index()
         new_rows[self.X] = new_rows.lockdown_x
-        df = df.append(new_rows, ignore_index=True, sort=False)
 
         # make sure the new rows have Y, lockdown_x, and lockdown_y
+        # (the keys of df and the new rows, in the order that appending the new rows to df would give them)
+        keys = concat_frames([df[[self.groupcol, self.X, self.Y, self.lockdown_x, self.lockdown_y]], new_rows])
         quarantine_df = quarantine_df.merge(
-            df[[
-                self.groupcol, self.X, self.Y, self.lockdown_x, self.lockdown_y
-            ]].groupby([self.groupcol, self.X]).first(),
+            keys.groupby([self.groupcol, self.X], observed=True).first(),
             on=[self.groupcol, self.X],
             how='left'
         )
@@ -298,61 +332,75 @@ class CovidChart(object):
         # ugh... we still need all the presampled values before here so that the left join works
         # so we do the sampling in this very weird spot
         if self.sample_every is not None:
-            df = df.sort_values(by=[self.groupcol, self.X])
-            df = df.iloc[::self.sample_every, :]
+            # positions of the sampled rows in `keys`; those past the end of df are new rows. The rows are sorted
+            # again at the end of `_preprocess_df`, so df's and the new rows needn't be interleaved here.
+            sampled = keys.sort_values(by=[self.groupcol, self.X]).index.to_numpy()[::self.sample_every]
+            is_new_row = sampled >= len(df)
+            new_rows = new_rows.take(sampled[is_new_row] - len(df))
+            df = df.take(sampled[~is_new_row])
 
-        # now add lockdown info as new rows in our df
-        df = df.append(quarantine_df, ignore_index=True, sort=False)
-        return df
+        # now add the new rows and lockdown info as new rows in our df
+        return concat_frames([df, new_rows, quarantine_df])
 
     def _preprocess_df(self) -> pd.DataFrame:
-        df = self.df.copy()
-        df = df.loc[df[self.groupcol] != 'Veteran Hospitals']
-        df[self.x_type] = 'normal'
+        """
+        The chart's rows, ready for `ChartSpec.compile`. Runs with pandas' copy-on-write mode on (pandas >= 1.5;
+        see `utils.copy_on_write`): every step makes a new frame (or adds columns to one) without changing its
+        input, attaches per-group values by lookup rather than by merging, and adds rows with a single concat, so
+        only the rows that filters keep and the columns that steps add are ever copied.
+        """
+        with stage('preprocess', rows_in=len(self.df)) as record:
+            with copy_on_write():
+                df = self._preprocess_df_stages()
+            record['rows_out'] = len(df)
+        return df
+
+    def _preprocess_df_stages(self) -> pd.DataFrame:
+        df = self.df.loc[self.df[self.groupcol] != 'Veteran Hospitals']
+        df[self.x_type] = pd.Series(self.normal_type, index=df.index, dtype=X_TYPE_DTYPE)
         if self.ycol_is_cumulative:
             df[self.Y] = df[self.ycol]
         else:
-            df[self.Y] = np.zeros_like(df[self.ycol])
-            for group in df[self.groupcol].unique():
-                pred = df[self.groupcol] == group
-                df.loc[pred, self.Y] = df.loc[pred, self.ycol].cumsum()
+            df[self.Y] = derive_metric(
+                df, self.ycol, CUMULATIVE, group_cols=self._metric_group_cols(df), date_col=self.xcol
+            ).where(df[self.groupcol].notna(), 0)
 
         if self.top_k_groups is not None:
-            # force showing India, Greece, SK, Denmark
-            top_k_groups = list(
-                set(
-                    df.groupby(self.groupcol)[self.Y].max().nlargest(self.top_k_groups).index
-                ) | {'India', 'Greece', 'South Korea', 'Denmark'}
-            )
-            df = df.loc[df[self.groupcol].isin(top_k_groups)]
-
-        df = self.start_criterion.transform(self, df)
-
-        if 'xdomain' in self.spec:
-            xmin, xmax = self.spec.xdomain[0], self.spec.xdomain[1]
-            df = df.loc[(df.x >= xmin) & (df.x <= xmax)]
-        if 'ydomain' in self.spec:
-            ymin, ymax = self.spec.ydomain[0], self.spec.ydomain[1]
-            df = df.loc[(df.y >= ymin) & (df.y <= ymax)]
-
-        # populate each group with max x value appearing in domain
-        xmax = df.loc[df.groupby(self.groupcol).x.idxmax()]
-        df = df.merge(
-            xmax.rename(columns={self.X: self.xmax})[[self.groupcol, self.xmax]],
-            how='left',
-            on=self.groupcol
-        )
+            with stage('top_k', rows_in=len(df)) as record:
+                # force showing India, Greece, SK, Denmark
+                top_k_groups = list(
+                    set(
+                        df.groupby(self.groupcol, observed=True)[self.Y].max().nlargest(self.top_k_groups).index
+                    ) | {'India', 'Greece', 'South Korea', 'Denmark'}
+                )
+                df = df.loc[df[self.groupcol].isin(top_k_groups)]
+                record['rows_out'] = len(df)
+
+        with stage('start_criterion', rows_in=len(df)) as record:
+            df = self.start_criterion.transform(self, df)
+            record['rows_out'] = len(df)
+
+        with stage('domain_filter', rows_in=len(df)) as record:
+            in_domain = np.ones(len(df), dtype=bool)
+            if 'xdomain' in self.spec:
+                xmin, xmax = self.spec.xdomain[0], self.spec.xdomain[1]
+                in_domain &= ((df.x >= xmin) & (df.x <= xmax)).to_numpy(dtype=bool, na_value=False)
+            if 'ydomain' in self.spec:
+                ymin, ymax = self.spec.ydomain[0], self.spec.ydomain[1]
+                in_domain &= ((df.y >= ymin) & (df.y <= ymax)).to_numpy(dtype=bool, na_value=False)
+            df = df.loc[in_domain]
+
+            # populate each group with max x value appearing in domain
+            df[self.xmax] = df.groupby(self.groupcol, observed=True)[self.X].transform('max')
+            record['rows_out'] = len(df)
 
         if self.quarantine_df is not None:
-            df = self._preprocess_lockdown_info(df)
-
-        groups = df.groupby(self.groupcol).first().reset_index().sort_values(self.groupcol)
-        groups['group_idx'] = np.arange(len(groups[self.groupcol]))
-        df = df.merge(
-            groups[[self.groupcol, 'group_idx']],
-            how='left',
-            on=self.groupcol
-        )
+            with stage('lockdown_info', rows_in=len(df)) as record:
+                df = self._preprocess_lockdown_info(df)
+                record['rows_out'] = len(df)
+
+        groups = pd.Index(df[self.groupcol].dropna().unique()).sort_values()
+        df['group_idx'] = self._broadcast(df, pd.Series(np.arange(len(groups)), index=groups))
 
         readable_group_name = self.spec.get('readable_group_name', None)
         if readable_group_name is not None:
@@ -361,7 +409,7 @@ class CovidChart(object):
 
         # needed to get alphabetic legend
         df = df.sort_values(by=[self.groupcol, self.X])
-        return df
+        return compact_frame(df)
 
     def _make_info_dict(self, qdf):
         info_dict = {}
@@ -524,6 +572,20 @@ class CovidChart(object):
         self.spec.grid = grid
         return self
 
+    def set_project_data(self, project=True):
+        self.spec.project_data = project
+        return self
+
+    def set_data_precision(self, digits: int = None):
+        # significant digits of float columns in the exported data; None keeps full precision
+        self.spec.data_precision = digits
+        return self
+
+    def set_encode_strings(self, encode=True):
+        # whether repeated strings in the exported data are replaced by codes into a per-chart lookup table
+        self.spec.encode_strings = encode
+        return self
+
     def set_defaults(self):
         self.spec.detailby = self.groupcol
         self.spec.colorby = self.groupcol
@@ -568,21 +630,51 @@ class CovidChart(object):
             'o' : "https://raw.githubusercontent.com/Murtz5253/covid19-vis/master/images/building.png",
             'j' : "https://raw.githubusercontent.com/Murtz5253/covid19-vis/master/images/gathering.png",
         }
-        def get_image_url(emoji_string):
-            if emoji_string in image_map:
-                return image_map[emoji_string]
-            else:
-                return '' # Altair will render this as a blank image--exactly what we want
         df_with_image_url = df.copy()
-        df_with_image_url['image_url'] = df['emoji_string'].apply(get_image_url)
+        if 'emoji_string' not in df.columns:
+            df_with_image_url['image_url'] = ''
+            return df_with_image_url
+        # Altair will render '' as a blank image--exactly what we want
+        df_with_image_url['image_url'] = df['emoji_string'].astype(object).map(image_map).fillna('').astype('category')
         return df_with_image_url
 
-    def compile(self):
+    def _chart_df(self):
         chart_df = self._preprocess_df()
-        chart_df = self.add_image_column(chart_df)
-        return self.spec.compile(chart_df)
+        with stage('add_image_column', rows_in=len(chart_df)) as record:
+            chart_df = self.add_image_column(chart_df)
+            record['rows_out'] = len(chart_df)
+        return chart_df
 
-    def export(self, fname="vis.json", js_var="vis"):
+    def compile(self):
+        with stage('compile'):
+            chart_df = self._chart_df()
+            with stage('spec_compile', rows_in=len(chart_df)):
+                return self.spec.compile(chart_df)
+
+    def compile_to_dict(self):
+        """The Vega-Lite spec dict of the chart; see `ChartSpec.compile_to_dict` for how specs are reused."""
+        with stage('compile'):
+            return self.spec.compile_to_dict(self._chart_df())
+
+    def export(self, fname="vis.json", js_var="vis", data_dir=None, data_url=None, data_format='json'):
+        """
+        Writes the compiled spec to `fname` as a javascript assignment to `js_var`.
+
+        By default the chart data is inlined into the spec. If `data_dir` is given, the datasets are instead
+        written to separate `data_format` ('json' or 'csv') files in `data_dir` and referenced from the spec
+        by `data_url` (defaults to `data_dir`), and altair's limit on inlined rows is lifted.
+        """
         import json
-        with open(fname, 'w') as f:
-            f.write(f"var {js_var} = {json.dumps(self.compile().to_dict())}")
+        with stage('export'):
+            if data_dir is None:
+                spec = self.compile_to_dict()
+            else:
+                with alt.data_transformers.enable('default', max_rows=None):
+                    spec = self.compile_to_dict()
+                with stage('externalize_datasets'):
+                    spec = externalize_datasets(
+                        spec, js_var, data_dir, data_dir if data_url is None else data_url, data_format=data_format
+                    )
+            with stage('write'):
+                with open(fname, 'w') as f:
+                    f.write(f"var {js_var} = {json.dumps(spec)}")
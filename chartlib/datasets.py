@@ -0,0 +1,293 @@
+import glob
+import hashlib
+import os
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from .dtypes import compact_frame, concat_frames
+from .hierarchy import add_rollups
+
+
+JHU_CSV = './data/jhu-data.csv'
+JHU_COUNTY_CSV = './data/jhu-county-data.csv'
+DEFAULT_CACHE_DIR = './.cache/datasets'
+DEFAULT_INGEST_CACHE_DIR = './.cache/ingested'
+DEFAULT_INGEST_CACHE_MAX_BYTES = 64 << 20
+
+JHU_DATE_COLS = ['Date']
+JHU_CATEGORICAL_COLS = ['Country_Region', 'Province_State']
+JHU_COUNTY_CATEGORICAL_COLS = ['Country_Region', 'Province_State', 'Admin2']
+JHU_VALUE_COLS = ['Confirmed', 'Recovered', 'Active', 'Deaths']
+JHU_DATE_FORMAT = '%m-%d-%Y'
+
+# in-memory memo: abspath -> (stat signature, content digest, frame)
+_MEMO: Dict[str, Tuple[Tuple[int, int], str, pd.DataFrame]] = {}
+
+# in-memory memo of hierarchies: input abspaths -> (inputs signature, input digests, frame)
+_HIERARCHY_MEMO: Dict[Tuple[str, ...], Tuple[tuple, Tuple[str, ...], pd.DataFrame]] = {}
+
+# in-memory memo of ingested frames: (abspath, ingest name, groupcol) -> (inputs signature, cache key, frame)
+# memos hold the latest version of each input only, so that long-running processes don't accumulate old frames
+_INGEST_MEMO: Dict[Tuple[str, str, str], Tuple[tuple, str, pd.DataFrame]] = {}
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _chartlib_sources() -> List[str]:
+    return sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')))
+
+
+def chartlib_source_digest() -> str:
+    """A digest of chartlib's own source, for invalidating anything derived by chartlib code."""
+    h = hashlib.sha1()
+    for path in _chartlib_sources():
+        h.update(os.path.basename(path).encode())
+        h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+
+def _stat_signature(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _inputs_signature(paths: List[str]) -> tuple:
+    # stat signatures of `paths` and chartlib's source: while they are unchanged, so are the digests of both
+    return tuple((path, _stat_signature(path)) for path in list(paths) + _chartlib_sources())
+
+
+def _cache_path(cache_dir: str, csv_path: str, digest: str) -> str:
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, f'{stem}-{digest[:16]}.feather')
+
+
+def _remove_stale_cache_files(cache_dir: str, csv_path: str, keep: str):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    for fname in os.listdir(cache_dir):
+        fpath = os.path.join(cache_dir, fname)
+        if fname.startswith(f'{stem}-') and fname.endswith('.feather') and fpath != keep:
+            os.remove(fpath)
+
+
+def _parse_csv(
+        csv_path: str, date_cols: List[str], date_format: str, categorical_cols: List[str], integer_cols: List[str]
+) -> pd.DataFrame:
+    df = pd.read_csv(csv_path)
+    # drop the unnamed index column written by `DataFrame.to_csv`
+    df = df.loc[:, [col for col in df.columns if not col.startswith('Unnamed: ')]]
+    for col in date_cols:
+        df[col] = pd.to_datetime(df[col], format=date_format)
+    for col in categorical_cols:
+        df[col] = df[col].astype('category')
+    return compact_frame(df, categorical_cols=[], count_cols=integer_cols)
+
+
+def _read_feather(path: str):
+    try:
+        return pd.read_feather(path)
+    except ImportError:
+        return None
+
+
+def _write_feather(df: pd.DataFrame, path: str) -> bool:
+    try:
+        df.to_feather(path)
+        return True
+    except (ImportError, TypeError, ValueError):
+        # pyarrow missing, or columns with mixed types that arrow refuses to store
+        return False
+
+
+def load_dataset(
+        csv_path: str,
+        date_cols: List[str] = None,
+        date_format: str = None,
+        categorical_cols: List[str] = None,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        integer_cols: List[str] = None,
+) -> pd.DataFrame:
+    """
+    Load a csv into a typed dataframe, parsing it at most once per version of the file.
+    `integer_cols` whose values are all integral are stored as the smallest nullable int that fits them.
+
+    Parsed frames are memoized in memory and stored as feather files in `cache_dir`, keyed by
+    the content hash of the csv and the parse options, so that the csv is only parsed again when its
+    contents change. If pyarrow is unavailable, only the in-memory memo is used.
+
+    The returned frame is shared between callers; filter or copy it before modifying it.
+    """
+    date_cols = date_cols or []
+    categorical_cols = categorical_cols or []
+    integer_cols = integer_cols or []
+    key = os.path.abspath(csv_path)
+    signature = _stat_signature(csv_path)
+    memoized = _MEMO.get(key)
+    if memoized is not None and memoized[0] == signature:
+        return memoized[2]
+    digest = file_digest(csv_path)
+    if memoized is not None and memoized[1] == digest:
+        _MEMO[key] = (signature, digest, memoized[2])
+        return memoized[2]
+
+    df = None
+    cache_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        options = repr((date_cols, date_format, categorical_cols, integer_cols))
+        cache_path = _cache_path(cache_dir, csv_path, hashlib.sha1(f'{digest}\0{options}'.encode()).hexdigest())
+        if os.path.exists(cache_path):
+            df = _read_feather(cache_path)
+    if df is None:
+        df = _parse_csv(csv_path, date_cols, date_format, categorical_cols, integer_cols)
+        if cache_path is not None and _write_feather(df, cache_path):
+            _remove_stale_cache_files(cache_dir, csv_path, keep=cache_path)
+    _MEMO[key] = (signature, digest, df)
+    return df
+
+
+def load_jhu_data(csv_path: str = JHU_CSV, cache_dir: str = DEFAULT_CACHE_DIR) -> pd.DataFrame:
+    return load_dataset(
+        csv_path,
+        date_cols=JHU_DATE_COLS,
+        date_format=JHU_DATE_FORMAT,
+        categorical_cols=JHU_CATEGORICAL_COLS,
+        cache_dir=cache_dir,
+        integer_cols=JHU_VALUE_COLS,
+    )
+
+
+def load_jhu_county_data(csv_path: str = JHU_COUNTY_CSV, cache_dir: str = DEFAULT_CACHE_DIR) -> pd.DataFrame:
+    return load_dataset(
+        csv_path,
+        date_cols=JHU_DATE_COLS,
+        date_format=JHU_DATE_FORMAT,
+        categorical_cols=JHU_COUNTY_CATEGORICAL_COLS,
+        cache_dir=cache_dir,
+        integer_cols=JHU_VALUE_COLS,
+    )
+
+
+def load_jhu_hierarchy(
+        csv_path: str = JHU_CSV, county_csv_path: str = JHU_COUNTY_CSV, cache_dir: str = DEFAULT_CACHE_DIR
+) -> pd.DataFrame:
+    """
+    The JHU country and state rows together with the county rows of `county_csv_path` (if it exists), with
+    a `level` column and rollups of any parent group that is only present at a finer level (see `add_rollups`).
+    Use `select_level` to get the rows of one level.
+
+    The rollups are computed once per version of the csvs and cached like `load_dataset`'s frames.
+    The returned frame is shared between callers; filter or copy it before modifying it.
+    """
+    paths = [csv_path] + ([county_csv_path] if os.path.exists(county_csv_path) else [])
+    memo_key = tuple(os.path.abspath(path) for path in paths)
+    signature = _inputs_signature(paths)
+    memoized = _HIERARCHY_MEMO.get(memo_key)
+    if memoized is not None and memoized[0] == signature:
+        return memoized[2]
+    key = tuple(file_digest(path) for path in paths) + (chartlib_source_digest(),)
+    if memoized is not None and memoized[1] == key:
+        _HIERARCHY_MEMO[memo_key] = (signature, key, memoized[2])
+        return memoized[2]
+
+    df = None
+    cache_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = hashlib.sha1('\0'.join(key).encode()).hexdigest()
+        cache_path = _cache_path(cache_dir, 'jhu-hierarchy', digest)
+        if os.path.exists(cache_path):
+            df = _read_feather(cache_path)
+    if df is None:
+        frames = [load_jhu_data(csv_path, cache_dir=cache_dir)]
+        if len(paths) > 1:
+            frames.append(load_jhu_county_data(county_csv_path, cache_dir=cache_dir))
+        df = add_rollups(concat_frames(frames), JHU_VALUE_COLS, date_col='Date')
+        # rollups sum into wider ints, and leave Admin2 all-null without county data
+        df = compact_frame(df, categorical_cols=JHU_COUNTY_CATEGORICAL_COLS, count_cols=JHU_VALUE_COLS)
+        if cache_path is not None and _write_feather(df, cache_path):
+            _remove_stale_cache_files(cache_dir, 'jhu-hierarchy', keep=cache_path)
+    _HIERARCHY_MEMO[memo_key] = (signature, key, df)
+    return df
+
+
+def load_quarantine_data(csv_path: str) -> pd.DataFrame:
+    # quarantine csvs are small; memoize them so that charts (and forked build workers) share one parse
+    return load_dataset(csv_path, cache_dir=None)
+
+
+def _evict_cache_files(cache_dir: str, max_bytes: int):
+    # drop the least recently used files until the directory fits in `max_bytes`
+    entries = []
+    for fname in os.listdir(cache_dir):
+        fpath = os.path.join(cache_dir, fname)
+        if fname.endswith('.pkl') and os.path.isfile(fpath):
+            st = os.stat(fpath)
+            entries.append((st.st_mtime_ns, st.st_size, fpath))
+    total = sum(size for _, size, _ in entries)
+    for _, size, fpath in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(fpath)
+        total -= size
+
+
+def load_ingested_data(
+        csv_path: str,
+        groupcol: str,
+        ingest: Callable[[str], pd.DataFrame],
+        cache_dir: str = DEFAULT_INGEST_CACHE_DIR,
+        max_bytes: int = DEFAULT_INGEST_CACHE_MAX_BYTES,
+) -> pd.DataFrame:
+    """
+    Return `ingest(csv_path)`, computing it at most once per version of the csv, `ingest` (by qualified
+    name), `groupcol` and chartlib's source.
+
+    Results are memoized in memory and pickled into `cache_dir`, which is kept under `max_bytes` by
+    evicting the least recently used entries. Pass `cache_dir=None` to only use the in-memory memo.
+
+    The returned frame is shared between callers; filter or copy it before modifying it.
+    """
+    memo_key = (os.path.abspath(csv_path), ingest.__qualname__, groupcol)
+    signature = _inputs_signature([csv_path])
+    memoized = _INGEST_MEMO.get(memo_key)
+    if memoized is not None and memoized[0] == signature:
+        return memoized[2]
+    h = hashlib.sha1()
+    for part in (file_digest(csv_path), ingest.__qualname__, groupcol, chartlib_source_digest()):
+        h.update(part.encode())
+        h.update(b'\0')
+    key = h.hexdigest()
+    if memoized is not None and memoized[1] == key:
+        _INGEST_MEMO[memo_key] = (signature, key, memoized[2])
+        return memoized[2]
+
+    df = None
+    cache_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(csv_path))[0]
+        cache_path = os.path.join(cache_dir, f'{stem}-{key[:16]}.pkl')
+        if os.path.exists(cache_path):
+            try:
+                df = pd.read_pickle(cache_path)
+                os.utime(cache_path)
+            except Exception:
+                # truncated or written by an incompatible pandas; ingest again
+                df = None
+    if df is None:
+        df = ingest(csv_path)
+        if cache_path is not None:
+            # write under a temporary name first, since parallel build workers may ingest the same csv
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, cache_path)
+            _evict_cache_files(cache_dir, max_bytes)
+    _INGEST_MEMO[memo_key] = (signature, key, df)
+    return df
@@ -0,0 +1,125 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+
+# Chart frames keep these dtypes from ingest through every merge and append: group, event and emoji columns are
+# categoricals, case counts and `x` are the smallest nullable int that fits them (nullable, since lockdown rows
+# leave gaps in them), and `x_type` is a fixed normal / lockdown categorical. Combine frames with
+# `concat_frames` (or `align_categories`), so that categoricals with different categories don't fall back to
+# object columns.
+
+# columns with few distinct strings repeated on many rows
+CATEGORICAL_COLS = [
+    'Country_Region', 'Province_State', 'Admin2',
+    'lockdown_type', 'emoji', 'emoji_string', 'Coverage', 'x_type', 'image_url',
+]
+# integral columns; rows of one kind (e.g. lockdown events) may leave gaps in rows of another
+COUNT_COLS = ['Confirmed', 'Recovered', 'Active', 'Deaths', 'x', 'xmax', 'group_idx', 'event_index', 'lockdown_idx']
+
+X_TYPE_DTYPE = pd.CategoricalDtype(['normal', 'lockdown'])
+# days relative to a chart's start criterion
+X_DTYPE = pd.Int16Dtype()
+
+_NULLABLE_INTS = [
+    (np.iinfo(np.int8), pd.Int8Dtype()),
+    (np.iinfo(np.int16), pd.Int16Dtype()),
+    (np.iinfo(np.int32), pd.Int32Dtype()),
+    (np.iinfo(np.int64), pd.Int64Dtype()),
+]
+
+
+def compact_int_dtype(col: pd.Series):
+    """The smallest nullable int dtype that holds every value of `col`, or None if `col` is not integral."""
+    if not pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+        return None
+    values = col.dropna().to_numpy(dtype=float, na_value=np.nan)
+    if len(values) > 0 and not np.array_equal(values, np.round(values)):
+        return None
+    lo, hi = (values.min(), values.max()) if len(values) > 0 else (0, 0)
+    for info, dtype in _NULLABLE_INTS:
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return None
+
+
+def _same_dtype(left, right) -> bool:
+    # unordered categorical dtypes compare equal regardless of the order of their categories
+    if isinstance(left, pd.CategoricalDtype) and isinstance(right, pd.CategoricalDtype):
+        return left.ordered == right.ordered and left.categories.equals(right.categories)
+    return left == right
+
+
+def with_dtypes(df: pd.DataFrame, dtypes: Dict[str, object]) -> pd.DataFrame:
+    """`df.astype(dtypes)`, but sharing the columns that keep their dtype instead of copying them."""
+    dtypes = {col: dtype for col, dtype in dtypes.items() if not _same_dtype(df[col].dtype, dtype)}
+    if len(dtypes) == 0:
+        return df
+    df = df.copy(deep=False)
+    for col, dtype in dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and isinstance(df[col].dtype, pd.CategoricalDtype):
+            # `astype` does nothing if only the order of the categories differs
+            df[col] = df[col].cat.set_categories(dtype.categories, ordered=dtype.ordered)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def compact_frame(
+        df: pd.DataFrame, categorical_cols: Iterable[str] = None, count_cols: Iterable[str] = None
+) -> pd.DataFrame:
+    """
+    Applies chartlib's dtype policy to the columns of `df` that it covers: categoricals for
+    `categorical_cols`, with just the categories that appear, sorted so that they sort like strings, and
+    the smallest nullable int for `count_cols` whose values are all integral. Other columns are left as
+    they are.
+    """
+    categorical_cols = CATEGORICAL_COLS if categorical_cols is None else categorical_cols
+    count_cols = COUNT_COLS if count_cols is None else count_cols
+    dtypes = {}
+    for col in categorical_cols:
+        if col not in df.columns:
+            continue
+        if col == 'x_type':
+            dtypes[col] = X_TYPE_DTYPE
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            codes = df[col].cat.codes.to_numpy()
+            categories = df[col].cat.categories[np.unique(codes[codes >= 0])]
+            if len(categories) == len(df[col].cat.categories) and categories.is_monotonic_increasing:
+                continue
+        else:
+            categories = df[col].dropna().unique()
+        dtypes[col] = pd.CategoricalDtype(sorted(categories))
+    for col in count_cols:
+        if col in df.columns:
+            dtype = compact_int_dtype(df[col])
+            if dtype is not None:
+                dtypes[col] = dtype
+    return with_dtypes(df, dtypes)
+
+
+def align_categories(frames: List[pd.DataFrame]) -> List[pd.DataFrame]:
+    """
+    Gives the categorical columns of `frames` the union of their categories, so that concatenating or
+    merging the frames keeps them categorical instead of falling back to object columns.
+    """
+    categories = {}
+    for frame in frames:
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                categories.setdefault(col, set()).update(frame[col].cat.categories)
+    if len(categories) == 0:
+        return frames
+    dtypes = {col: pd.CategoricalDtype(sorted(values)) for col, values in categories.items()}
+    if 'x_type' in dtypes:
+        dtypes['x_type'] = X_TYPE_DTYPE
+    return [
+        with_dtypes(frame, {col: dtype for col, dtype in dtypes.items() if col in frame.columns}) for frame in frames
+    ]
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """`pd.concat(frames, ignore_index=True, sort=False)` that keeps categorical columns categorical."""
+    return pd.concat(align_categories(frames), ignore_index=True, sort=False)
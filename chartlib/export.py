@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:  # optional; without it published assets only get a .gz copy
+    brotli = None
+
+
+DATA_FORMATS = ('json', 'csv')
+# hex digits of the content hash in the names of published assets
+ASSET_HASH_LENGTH = 10
+
+
+def dataset_refs(node, refs: List[Dict]) -> List[Dict]:
+    """Appends every `{"name": ...}` data reference in a Vega-Lite spec to `refs`, in document order."""
+    if isinstance(node, dict):
+        data = node.get('data', None)
+        if isinstance(data, dict) and 'name' in data:
+            refs.append(data)
+        for value in node.values():
+            dataset_refs(value, refs)
+    elif isinstance(node, list):
+        for value in node:
+            dataset_refs(value, refs)
+    return refs
+
+
+def _csv_parse_types(df: pd.DataFrame) -> Dict:
+    # csv loses types, so tell vega how to parse the non-string columns
+    parse = {}
+    for col in df.columns:
+        if pd.api.types.is_bool_dtype(df[col]):
+            parse[col] = 'boolean'
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            parse[col] = 'number'
+    return parse
+
+
+def _write_dataset(rows: List[Dict], path: str, data_format: str) -> Dict:
+    if data_format == 'json':
+        with open(path, 'w') as f:
+            json.dump(rows, f)
+        return {'type': 'json'}
+    df = pd.DataFrame(rows)
+    df.to_csv(path, index=False)
+    return {'type': 'csv', 'parse': _csv_parse_types(df)}
+
+
+def externalize_datasets(
+        spec: Dict, basename: str, data_dir: str, data_url: str, data_format: str = 'json'
+) -> Dict:
+    """
+    Moves the inline datasets of a compiled Vega-Lite spec dict into files under `data_dir`, and points
+    the spec at them via `data_url`. Files are named after `basename` and the order in which datasets
+    are first referenced, not after their contents, so a spec whose data changes keeps the same text.
+    """
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f'data_format should be one of {DATA_FORMATS}; got {data_format}')
+    datasets = spec.pop('datasets', {})
+    refs = dataset_refs(spec, [])
+    names = []
+    for ref in refs:
+        if ref['name'] in datasets and ref['name'] not in names:
+            names.append(ref['name'])
+    os.makedirs(data_dir, exist_ok=True)
+    replacements = {}
+    for idx, name in enumerate(names):
+        fname = f'{basename}.{data_format}' if idx == 0 else f'{basename}-{idx}.{data_format}'
+        data_format_spec = _write_dataset(datasets[name], os.path.join(data_dir, fname), data_format)
+        replacements[name] = {'url': f'{data_url.rstrip("/")}/{fname}', 'format': data_format_spec}
+    for ref in refs:
+        replacement = replacements.get(ref.get('name', None), None)
+        if replacement is not None:
+            ref.clear()
+            ref.update(replacement)
+    return spec
+
+
+def read_asset_manifest(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _write_atomically(path: str, data: bytes):
+    # so that an interrupted build never leaves a truncated file behind under the final name
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_asset_manifest(manifest: Dict[str, str], path: str):
+    _write_atomically(path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+
+def _compressed_copies(data: bytes) -> Dict[str, bytes]:
+    # mtime=0 so that the same content always compresses to the same bytes
+    copies = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies['.br'] = brotli.compress(data, quality=11)
+    return copies
+
+
+def _remove_asset(path: str):
+    for fname in (path, f'{path}.gz', f'{path}.br'):
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def publish_asset(path: str, manifest: Dict[str, str]) -> str:
+    """
+    Copies the file at `path` to a name that includes a hash of its contents, e.g. `chart.js` to
+    `chart.1f2e3d4c5b.js`, in the same directory, next to precompressed `.gz` and, if the brotli package is
+    installed, `.br` copies. Records the hashed name in `manifest` under the name of `path`, removing the copies
+    that it replaces. Nothing is written if the copies of the current contents already exist. Returns the
+    hashed name.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    hashed_name = f'{stem}.{hashlib.sha1(data).hexdigest()[:ASSET_HASH_LENGTH]}{ext}'
+    hashed_path = os.path.join(directory, hashed_name)
+    compressed_suffixes = ['.gz'] + (['.br'] if brotli is not None else [])
+    if not all(os.path.exists(hashed_path + suffix) for suffix in [''] + compressed_suffixes):
+        _write_atomically(hashed_path, data)
+        for suffix, compressed in _compressed_copies(data).items():
+            _write_atomically(hashed_path + suffix, compressed)
+    previous = manifest.get(name, None)
+    if previous is not None and previous != hashed_name:
+        _remove_asset(os.path.join(directory, previous))
+    manifest[name] = hashed_name
+    return hashed_name
@@ -0,0 +1,68 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .dtypes import concat_frames
+
+
+# levels of the country -> state -> county hierarchy, from the top down, and the column naming a group at each
+LEVELS = ['country', 'state', 'county']
+LEVEL_COLS = {'country': 'Country_Region', 'state': 'Province_State', 'county': 'Admin2'}
+LEVEL = 'level'
+
+# aliases of `CovidChart`'s `level` argument
+LEVEL_ALIASES = {
+    'country': 'country', 'world': 'country',
+    'us': 'state', 'usa': 'state', 'united states': 'state', 'usa_old': 'state', 'state': 'state',
+    'county': 'county',
+}
+
+
+def _row_levels(df: pd.DataFrame) -> np.ndarray:
+    # the level of a row is that of the deepest hierarchy column it names a group in
+    depth = np.zeros(len(df), dtype=int)
+    for idx, level in enumerate(LEVELS[1:], start=1):
+        depth[df[LEVEL_COLS[level]].notna().to_numpy()] = idx
+    return depth
+
+
+def add_rollups(df: pd.DataFrame, value_cols: List[str], date_col: str = 'Date') -> pd.DataFrame:
+    """
+    Adds a `level` column to a frame whose rows are groups at any level of the hierarchy, and adds a row for
+    every (parent group, date) that only appears at a finer level, summing `value_cols` over its children.
+    Rows that are already in `df` are kept as they are, so precomputed totals win over rollups.
+    """
+    cols = [LEVEL_COLS[level] for level in LEVELS]
+    df = df.assign(**{col: np.nan for col in cols if col not in df.columns})
+    depth = _row_levels(df)
+    frames = [df]
+    children = df.loc[depth == len(LEVELS) - 1]
+    for idx in range(len(LEVELS) - 2, -1, -1):
+        keys = cols[:idx + 1] + [date_col]
+        rolled = children.groupby(keys, observed=True, sort=False)[value_cols].sum().reset_index()
+        existing = pd.MultiIndex.from_frame(df.loc[depth == idx, keys])
+        rolled = rolled.loc[~pd.MultiIndex.from_frame(rolled[keys]).isin(existing)]
+        if len(rolled) > 0:
+            frames.append(rolled)
+        # parents that exist in `df` already are children of the next level up too
+        children = concat_frames([df.loc[depth == idx], rolled])
+    rollups = concat_frames(frames)
+    rollups[LEVEL] = pd.Categorical.from_codes(_row_levels(rollups), categories=LEVELS)
+    return rollups
+
+
+def select_level(df: pd.DataFrame, level: str, parent: Dict[str, str] = None) -> pd.DataFrame:
+    """
+    The rows of a frame with rollups (see `add_rollups`) at `level`, optionally only those whose parent
+    columns match `parent`, e.g. `select_level(df, 'county', {'Province_State': 'California'})`.
+    The `level` column and the columns of finer levels are dropped.
+    """
+    level = LEVEL_ALIASES.get(level.lower(), level.lower())
+    if level not in LEVEL_COLS:
+        raise ValueError(f'level should be one of {LEVELS}; got {level}')
+    pred = df[LEVEL] == level
+    for col, value in (parent or {}).items():
+        pred &= df[col] == value
+    finer = [LEVEL_COLS[finer_level] for finer_level in LEVELS[LEVELS.index(level) + 1:]]
+    return df.loc[pred, [col for col in df.columns if col != LEVEL and col not in finer]]
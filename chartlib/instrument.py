@@ -0,0 +1,107 @@
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+# callbacks that receive a record for every stage that finishes; stages do nothing while this is empty
+_LISTENERS: List[Callable[[Dict], None]] = []
+
+# records of the stages that are running, outermost first
+_RUNNING: List[Dict] = []
+
+# extra fields (e.g. the chart name) added to every record
+_FIELDS: Dict = {}
+
+
+def peak_rss_bytes():
+    """The peak resident set size of this process so far, or None where that is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def add_stage_listener(listener: Callable[[Dict], None]):
+    _LISTENERS.append(listener)
+
+
+def remove_stage_listener(listener: Callable[[Dict], None]):
+    _LISTENERS.remove(listener)
+
+
+@contextmanager
+def stage(name: str, rows_in: int = None):
+    """
+    Records the enclosed block as stage `name`: its wall time, the peak RSS of the process when it ends and
+    how much the stage raised it, its peak memory above what was allocated when it started (only when
+    tracemalloc is tracing), and `rows_in` / the `rows_out` that the block can set on the yielded dict.
+    Stages nest; a record's `stage` is the path of stage names, e.g. `compile/preprocess`.
+
+    Records are passed to every listener (see `recording_stages`) as stages finish, innermost first.
+    """
+    record = {}
+    if not _LISTENERS:
+        yield record
+        return
+    parent = _RUNNING[-1] if _RUNNING else None
+    record.update(_FIELDS)
+    record['stage'] = f'{parent["stage"]}/{name}' if parent is not None else name
+    record['rows_in'] = rows_in
+    record['rows_out'] = None
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            # resetting the peak below loses the parent's peak so far, so stash it
+            parent['_peak'] = max(parent.get('_peak', 0), peak)
+        record['_start'] = current
+        tracemalloc.reset_peak()
+    _RUNNING.append(record)
+    rss_at_start = peak_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        _RUNNING.pop()
+        record['peak_rss_bytes'] = peak_rss_bytes()
+        record['peak_rss_growth_bytes'] = None if rss_at_start is None else record['peak_rss_bytes'] - rss_at_start
+        record['peak_memory_bytes'] = None
+        if tracing:
+            peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak', 0))
+            record['peak_memory_bytes'] = peak - record.pop('_start')
+            if parent is not None:
+                parent['_peak'] = max(parent.get('_peak', 0), peak)
+        for listener in list(_LISTENERS):
+            listener(dict(record))
+
+
+@contextmanager
+def recording_stages(trace_memory: bool = False, **fields):
+    """
+    Collects the records of every stage run in the enclosed block into the yielded list, adding `fields`
+    to each. With `trace_memory`, tracemalloc runs for the duration of the block so that stages report
+    their own peak memory; this makes chart builds several times slower.
+    """
+    records = []
+    saved_fields = dict(_FIELDS)
+    _FIELDS.update(fields)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    add_stage_listener(records.append)
+    try:
+        yield records
+    finally:
+        remove_stage_listener(records.append)
+        if started_tracing:
+            tracemalloc.stop()
+        _FIELDS.clear()
+        _FIELDS.update(saved_fields)
@@ -6,198 +6,162 @@
 # face covering requirement = f/F
 
 # Opening:
-# emergency declaration lifted = a/A; 
+# emergency declaration lifted = a/A;
 # travel restrictions lifted= d/D;
 # border closures lifted = k/K;
 # shelter-in-place lifted = h/H;
-# night-time curfew lifted= i/I; 
+# night-time curfew lifted= i/I;
 # Banning gatherings lifted = j/J;
 # Face covering requirement lifted =p/P;
 # k-12 school open = m/M;
 # Bar and Dine-in Restaurant open = q/Q;
 # Non-essential Businesses open = o/O
 
-severityScore = {'e':0.1,'g':0.3, 'c':0.3, 's':0.4,'r':0.6 , 't':0.6, 'n':0.8, 'l':1, 'f':0.5,
-                 'a':-0.1, 'd':-0.6, 'k':-0.3, 'h':-1, 'n':-0.8, 'p':-0.5, 'q':-0.6, 'o':-0.8, 'j':-0.3}
-
+# Computes the intervention footprint of every state over time: for each date on which the state (or a
+# region in it) enacted something, the population-weighted severity of the most severe measure in effect
+# at every location of the state. Statewide measures apply to every location; the part of the state not
+# covered by any regional measure is represented by an "Others" location.
+#
+# Usage (from the repository root): python -m chartlib.interventionFootprint
 
-import pandas as pd
 import numpy as np
-from utils import create_lockdown_type, split_into_list, str2emo
-df = pd.read_csv("../data/combined-activity-US-Jun9.csv")
-
-
-# START modified from _ingest_usa_quarantine_df
-# quarantine_csv = "../data/combined-activity-US-Jun9-with-pop.csv"
-quarantine_csv = "../data/combined-activity-US-Jun9-with-partial-pop-b4-Apr16.csv"
-quarantine_df = pd.read_csv(quarantine_csv)
-
-quarantine_df = quarantine_df.rename(columns={'Effective.Date' : 'Effective Date', 'State.of.Emergency.Declaration' : 'State of Emergency Declaration', 
-                'Travel.Restrictions' : 'Travel Restrictions', 'Shelter.in.place.Order' : 'Shelter-in-place Order', 
-                'Gathering.Limitations' : 'Gathering Limitations', 'Banning.Gatherings.of.a.Certain.Size' : 'Banning Gatherings of a Certain Size',
-                'K.12.School.Closure' : 'K-12 School Closure', 'Bar.and.Dine.in.Restaurant.Closure' : 'Bar and Dine-in Restaurant Closure',
-                'Non.essential.Businesses.Closure' : 'Non-essential Businesses Closure', 'Details..if.any.' : 'Details (if any)',
-                'Reference.links' : 'Reference links', 'Face.Covering.Requirements' : 'Face Covering Requirements', 'state_pop_2019' : 'population_size'})
-quarantine_df = quarantine_df.drop('Unnamed: 0', axis=1)
-
-
-groupcol = 'Province_State'
-
-quarantine_df = quarantine_df.rename(columns={'State': 'Province_State', 'Effective Date': 'lockdown_date','Coverage.type':'Coverage'})
-quarantine_df = quarantine_df.sort_values('Coverage', ascending=True)
-quarantine_df['lockdown_type'] = quarantine_df.apply(lambda x: create_lockdown_type(x, 0), axis=1)
-quarantine_df['emoji_string'] = quarantine_df.apply(lambda x: create_lockdown_type(x, 1), axis=1)
-quarantine_df['lockdown_type'].replace('', np.nan, inplace=True)
-
-quarantine_df = quarantine_df.dropna(subset=['lockdown_type'])
-# #TODO: this is where the columns get dropped
-# quarantine_df = quarantine_df.groupby(['lockdown_date', 'Province_State']).agg({
-#     'lockdown_type': lambda col: '; '.join(col),
-#     'emoji_string': lambda col: ''.join(col),
-#     'population_size': lambda col:col,
-#     'Coverage.location': lambda col:col
-# }).reset_index()
-
-quarantine_df.loc[quarantine_df.lockdown_type=="Regional Border Closure/Visitor Quarantine","emoji_string"]="t"#bugfix
-# Breaking up emoji into separate rows for vertical stacking
-quarantine_df.emoji_string = quarantine_df.emoji_string.apply(split_into_list)
-
-quarantine_df = quarantine_df.explode(column='emoji_string')
-quarantine_df['Coverage'] = quarantine_df.emoji_string.apply(
-    lambda x: 'Statewide' if str(x).isupper() else 'Regional'
-)
-quarantine_df = quarantine_df.sort_values('Coverage', ascending=False)
-quarantine_df.emoji_string = quarantine_df.emoji_string.str.lower()
-quarantine_df['emoji'] = quarantine_df['emoji_string'].map(str2emo)
-quarantine_df['event_index'] = quarantine_df.groupby(['Province_State', 'lockdown_date']).cumcount()
-
-# # quarantine_cols = [
-# #     groupcol, 'lockdown_date', 'lockdown_type', 'emoji', 'emoji_string', 'event_index', 'Coverage','Coverage.location'
-# # ]
-quarantine_cols = ['Province_State', 'Coverage', 'lockdown_date','population_size','lockdown_type', 'emoji_string', 'emoji',
-       'event_index']
-
-print(quarantine_df.columns)
-quarantine_df = quarantine_df[quarantine_cols]
-
-# # END modified from _ingest_usa_quarantine_df
-
-quarantine_df_orig = pd.read_csv(quarantine_csv)
-quarantine_df_orig = quarantine_df_orig.rename(columns={'Effective.Date' : 'Effective Date', 'State.of.Emergency.Declaration' : 'State of Emergency Declaration', 
-                'Travel.Restrictions' : 'Travel Restrictions', 'Shelter.in.place.Order' : 'Shelter-in-place Order', 
-                'Gathering.Limitations' : 'Gathering Limitations', 'Banning.Gatherings.of.a.Certain.Size' : 'Banning Gatherings of a Certain Size',
-                'K.12.School.Closure' : 'K-12 School Closure', 'Bar.and.Dine.in.Restaurant.Closure' : 'Bar and Dine-in Restaurant Closure',
-                'Non.essential.Businesses.Closure' : 'Non-essential Businesses Closure', 'Details..if.any.' : 'Details (if any)',
-                'Reference.links' : 'Reference links', 'Face.Covering.Requirements' : 'Face Covering Requirements', 'state_pop_2019' : 'population_size'})
-quarantine_df_orig = quarantine_df_orig.drop('Unnamed: 0', axis=1)
-
-state_populations = quarantine_df_orig[["State","population_size"]].drop_duplicates()
-state_populations = state_populations.rename(columns={'State': 'Province_State',"population_size":"state_population_size"})
-state_populations.loc[state_populations["Province_State"]=="Puerto Rico","state_population_size"] = 3725789 # Obtained from https://www.census.gov/quickfacts/PR
-state_populations.state_population_size = state_populations.state_population_size.astype("int")
-
-quarantine_df = quarantine_df.merge(state_populations)
-
-quarantine_df = quarantine_df.dropna(subset=["population_size"])
-#quarantine_df.population_size = quarantine_df.population_size.str.replace(",","")
-quarantine_df.population_size = quarantine_df.population_size.astype("int")
-
-quarantine_df["severityScore"] = quarantine_df.emoji_string.apply(lambda x: severityScore[x])
-quarantine_df.lockdown_date = quarantine_df.lockdown_date.str.replace("/","-")
-quarantine_df.lockdown_date = pd.to_datetime(quarantine_df.lockdown_date)
-quarantine_df = quarantine_df[['Province_State', 'Coverage', 'lockdown_date',
-       'population_size', 'state_population_size', 'severityScore']]
-
-"""def compute_state_replacements(qdf,state):
-    df_state_replacements = []
-    qdf = quarantine_df[quarantine_df["Province_State"]==state]
-    statewideEvents = qdf[qdf["Coverage"]=="Statewide"]
-    relevantCountiesInState= list(set(qdf[qdf["Province_State"]==state]["Coverage.location"]) - set([state]))
-    # adding "Others" dummy state populated with statewide population - sum(relevant counties population)
-    relevantCountiesInState= list(set(qdf[qdf["Province_State"]==state]["Coverage.location"]) - set([state]))
-    relevant_county_population_lookup = qdf[qdf["Coverage.location"].isin(relevantCountiesInState)][["Coverage.location","population_size"]].drop_duplicates()
-    state_population_size = state_populations[state_populations["Province_State"]==state].state_population_size.values[0]
-    other_population = state_population_size - relevant_county_population_lookup.population_size.sum()
-    qdf.loc[len(qdf)] = [state,"Regional","Others",np.nan,other_population,state_population_size,np.nan]
-    relevantCountiesInState  = relevantCountiesInState + ["Others"]
-    for statewideEvent in statewideEvents.iterrows(): 
-    #     statewideLockdown_date = "2020-03-12"
-    #     statewideSeverity = "0.1"
-        statewideLockdown_date = statewideEvent[1].lockdown_date
-        statewideSeverity = statewideEvent[1].severityScore
-        for county in relevantCountiesInState: 
-            #print(county)
-            #display(qdf[qdf["Coverage.location"]==county])
-            try:
-                # Catch error since some counties don't show up until a later date, ignore these counties 
-                clone = np.repeat(qdf[qdf["Coverage.location"]==county].iloc[0],1)
-                clone.lockdown_date = statewideLockdown_date
-                clone.severityScore = statewideSeverity
-                df_state_replacements.append(clone)
-            except (IndexError):
-                pass"""
-def compute_state_replacements(qdf,state):
-    df_state_replacements = []
-    qdf = quarantine_df[quarantine_df["Province_State"]==state]
-    statewideEvents = qdf[qdf["Coverage"]=="Statewide"]
-    regionalEvents = qdf[qdf["Coverage"]=="Regional"]
-    state_population_size = state_populations[state_populations["Province_State"]==state].state_population_size.values[0]
-    for statewideEvent in statewideEvents.iterrows(): 
-    #     statewideLockdown_date = "2020-03-12"
-    #     statewideSeverity = "0.1"
-        statewideLockdown_date = statewideEvent[1].lockdown_date
-        statewideSeverity = statewideEvent[1].severityScore
-        for county in relevantCountiesInState: 
-            #print(county)
-            #display(qdf[qdf["Coverage.location"]==county])
-            try:
-                # Catch error since some counties don't show up until a later date, ignore these counties 
-                clone = np.repeat(qdf[qdf["Coverage.location"]==county].iloc[0],1)
-                clone.lockdown_date = statewideLockdown_date
-                clone.severityScore = statewideSeverity
-                df_state_replacements.append(clone)
-            except (IndexError):
-                pass
-                
-
-    df_state_replacements = pd.DataFrame(df_state_replacements,columns=qdf.columns)
-    return df_state_replacements 
-
-def compute_state_intervention_footprint_curve(state):
-    qdf = quarantine_df[quarantine_df["Province_State"]==state]
-    qdf_additional = compute_state_replacements(qdf,state)
-    qdf_result = pd.concat([qdf,qdf_additional])
-    # For each date, compute a cumulative max, keeping only the entry with the maximum severity score
-    qdf_keep_all=[]
-    for ldate in qdf.lockdown_date.unique():
-        # ldate = "2020-03-13"
-        qdf_before = qdf_result[qdf_result["lockdown_date"]<=ldate]
-        # Compute the max severity for that location for the given day
-        qdf_before["severityMax"] = qdf_before.groupby("Coverage.location")["severityScore"].transform(max)
-        qdf_keep = qdf_before[qdf_before["severityScore"] == qdf_before["severityMax"]]
-        qdf_keep["dateBefore"] = ldate
-        qdf_keep = qdf_keep.drop_duplicates(subset="Coverage.location") # applicable only for the last date when severityMax=1 for multiple lockdown_dates, keep just one so that last entry doesn't exceed 1
-        qdf_keep_all.append(qdf_keep)
-    #     display(qdf_keep)
-    qdf_keep_all = pd.concat(qdf_keep_all)
-
-    # compute the intervention footprint for the kept df
-    qdf_keep_all["pctStateAffected"]= qdf_keep_all["population_size"]/qdf_keep_all["state_population_size"]
-    qdf_keep_all["interventionFootprint"] = qdf_keep_all["pctStateAffected"]*qdf_keep_all["severityScore"]
-
-    qdf_keep_all = qdf_keep_all[qdf_keep_all["Coverage"]=="Regional"]
-    # Sum the intervention footprint based on the date we used for the keep max (note this is based on the lockdown date)
-    qdf_keep_all_result = qdf_keep_all.groupby("dateBefore").sum().reset_index()
-    return qdf_keep_all_result
-
-
-df_all = []
-for state in quarantine_df.Province_State.unique():
-    print (state)
-    
-    statedf = compute_state_intervention_footprint_curve(state)
-    statedf["State"]=state
-    df_all.append(statedf)
-
-df_all = pd.concat(df_all)
-df_all.to_csv("../data/interventionFootprintByState.csv")
\ No newline at end of file
+import pandas as pd
+
+from .utils import encode_us_lockdown_types, to_datetime_series
+
+FOOTPRINT_QUARANTINE_CSV = './data/combined-activity-US-Jun9-with-partial-pop-b4-Apr16.csv'
+FOOTPRINT_CSV = './data/interventionFootprintByState.csv'
+
+severityScore = {'e':0.1,'g':0.3, 'c':0.3, 's':0.4,'r':0.6 , 't':0.6, 'n':0.8, 'l':1, 'f':0.5,
+                 'a':-0.1, 'd':-0.6, 'k':-0.3, 'h':-1, 'p':-0.5, 'q':-0.6, 'o':-0.8, 'j':-0.3}
+
+OTHERS = 'Others'
+FOOTPRINT_COLS = [
+    'dateBefore', 'population_size', 'state_population_size', 'severityScore', 'severityMax',
+    'pctStateAffected', 'interventionFootprint', 'State',
+]
+
+
+def load_footprint_events(quarantine_csv: str = FOOTPRINT_QUARANTINE_CSV) -> pd.DataFrame:
+    """
+    One row per event and measure (emoji code) of an event csv with per-location populations, with columns
+    Province_State, Coverage (Statewide / Regional), Coverage.location, lockdown_date, population_size,
+    state_population_size and severityScore.
+    """
+    quarantine_df = pd.read_csv(quarantine_csv)
+    quarantine_df = quarantine_df.rename(columns={'Effective.Date' : 'Effective Date', 'State.of.Emergency.Declaration' : 'State of Emergency Declaration',
+                    'Travel.Restrictions' : 'Travel Restrictions', 'Shelter.in.place.Order' : 'Shelter-in-place Order',
+                    'Gathering.Limitations' : 'Gathering Limitations', 'Banning.Gatherings.of.a.Certain.Size' : 'Banning Gatherings of a Certain Size',
+                    'K.12.School.Closure' : 'K-12 School Closure', 'Bar.and.Dine.in.Restaurant.Closure' : 'Bar and Dine-in Restaurant Closure',
+                    'Non.essential.Businesses.Closure' : 'Non-essential Businesses Closure', 'Details..if.any.' : 'Details (if any)',
+                    'Reference.links' : 'Reference links', 'Face.Covering.Requirements' : 'Face Covering Requirements', 'state_pop_2019' : 'population_size'})
+    quarantine_df = quarantine_df.drop('Unnamed: 0', axis=1)
+
+    # the population of each state is the population of the rows that cover the whole state
+    state_populations = quarantine_df.loc[quarantine_df['Coverage.location'] == quarantine_df['State'], ['State', 'population_size']]
+    state_populations = state_populations.drop_duplicates().rename(
+        columns={'State': 'Province_State', 'population_size': 'state_population_size'}
+    )
+    state_populations.state_population_size = state_populations.state_population_size.astype("int")
+
+    quarantine_df = quarantine_df.rename(columns={'State': 'Province_State', 'Effective Date': 'lockdown_date','Coverage.type':'Coverage'})
+    quarantine_df = quarantine_df.sort_values('Coverage', ascending=True)
+    quarantine_df[['lockdown_type', 'emoji_string']] = encode_us_lockdown_types(quarantine_df)
+    quarantine_df = quarantine_df.loc[quarantine_df.lockdown_type != '']
+    quarantine_df.loc[quarantine_df.lockdown_type=="Regional Border Closure/Visitor Quarantine","emoji_string"]="t"#bugfix
+
+    # Breaking up emoji into separate rows, one per measure
+    quarantine_df.emoji_string = quarantine_df.emoji_string.apply(list)
+    quarantine_df = quarantine_df.explode(column='emoji_string')
+    quarantine_df['Coverage'] = np.where(quarantine_df.emoji_string.str.isupper(), 'Statewide', 'Regional')
+    quarantine_df = quarantine_df.sort_values('Coverage', ascending=False)
+    quarantine_df.emoji_string = quarantine_df.emoji_string.str.lower()
+
+    quarantine_df = quarantine_df.merge(state_populations)
+    quarantine_df = quarantine_df.dropna(subset=["population_size"])
+    quarantine_df.population_size = quarantine_df.population_size.astype("int")
+    quarantine_df["severityScore"] = quarantine_df.emoji_string.map(lambda x: severityScore[x])
+    quarantine_df.lockdown_date = to_datetime_series(quarantine_df.lockdown_date.str.replace("/","-"))
+    return quarantine_df[['Province_State', 'Coverage', 'Coverage.location', 'lockdown_date',
+                          'population_size', 'state_population_size', 'severityScore']].reset_index(drop=True)
+
+
+def add_statewide_replacements(events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Repeats every statewide event at each other location of its state, including an "Others" location that
+    stands for the rest of the state's population. Repeated events take the population and coverage of the
+    first event at their location. Adds a `rank` column that orders the original events before the repeats.
+    """
+    events = events.assign(rank=np.arange(len(events)))
+    regional = events.loc[events['Coverage.location'] != events.Province_State]
+    others = (
+        regional[['Province_State', 'Coverage.location', 'population_size']].drop_duplicates()
+        .groupby('Province_State', sort=False).population_size.sum()
+    )
+    state_populations = events[['Province_State', 'state_population_size']].drop_duplicates('Province_State')
+    others = state_populations.assign(
+        **{'Coverage': 'Regional', 'Coverage.location': OTHERS},
+        population_size=lambda df: df.state_population_size - df.Province_State.map(others).fillna(0).astype('int'),
+    )
+    locations = pd.concat([regional.drop_duplicates(['Province_State', 'Coverage.location']), others])
+    locations = locations[['Province_State', 'Coverage', 'Coverage.location', 'population_size', 'state_population_size']]
+
+    statewide = events.loc[events.Coverage == 'Statewide', ['Province_State', 'lockdown_date', 'severityScore', 'rank']]
+    replacements = statewide.merge(locations, on='Province_State').sort_values('rank', kind='stable')
+    replacements['rank'] = len(events) + np.arange(len(replacements))
+    return pd.concat([events, replacements[events.columns]], ignore_index=True)
+
+
+def intervention_footprint(events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the intervention footprint curve of every state from `load_footprint_events` output, with one
+    row per state and date on which the state had an event (see `FOOTPRINT_COLS`).
+    """
+    state_dates = events[['Province_State', 'lockdown_date']].drop_duplicates().rename(columns={'lockdown_date': 'dateBefore'})
+    events = add_statewide_replacements(events)
+    location = ['Province_State', 'Coverage.location']
+
+    # For each location, the event in effect after each of its dates: the most severe one so far, and
+    # among equally severe ones the first by rank. Ordering events by (severity descending, rank) turns
+    # this into a running minimum over date-sorted events.
+    severity_rank = events.severityScore.rank(method='dense', ascending=False).astype('int64')
+    events['order'] = severity_rank * len(events) + events['rank']
+    events = events.sort_values(location + ['lockdown_date'], kind='stable')
+    events['in_effect'] = events.groupby(location, sort=False)['order'].cummin()
+    in_effect = events.groupby(location + ['lockdown_date'], sort=False)['in_effect'].last().reset_index()
+    by_order = events.set_index('order')
+    for col in ['Coverage', 'population_size', 'state_population_size', 'severityScore', 'rank']:
+        in_effect[col] = in_effect['in_effect'].map(by_order[col])
+
+    # evaluate every location of a state on each date on which the state had an event
+    grid = state_dates.merge(in_effect[location].drop_duplicates(), on='Province_State')
+    kept = pd.merge_asof(
+        grid.sort_values('dateBefore'), in_effect.sort_values('lockdown_date'),
+        left_on='dateBefore', right_on='lockdown_date', by=location,
+    )
+    kept = kept.dropna(subset=['in_effect'])
+    kept = kept.loc[kept.Coverage == 'Regional']
+    kept = kept.astype({'population_size': 'int64', 'state_population_size': 'int64'})
+    kept['severityMax'] = kept.severityScore
+    kept["pctStateAffected"] = kept["population_size"]/kept["state_population_size"]
+    kept["interventionFootprint"] = kept["pctStateAffected"]*kept["severityScore"]
+
+    # Sum the intervention footprint of each state and date, adding up locations in rank order
+    kept = kept.sort_values('rank', kind='stable')
+    sum_cols = FOOTPRINT_COLS[1:-1]
+    footprint = kept.groupby(['Province_State', 'dateBefore'], sort=False)[sum_cols].sum().reset_index()
+    footprint['state_order'] = footprint.Province_State.map(
+        {state: idx for idx, state in enumerate(state_dates.Province_State.unique())}
+    )
+    footprint = footprint.sort_values(['state_order', 'dateBefore']).rename(columns={'Province_State': 'State'})
+    footprint.index = footprint.groupby('State', sort=False).cumcount()
+    return footprint[FOOTPRINT_COLS]
+
+
+def main():
+    footprint = intervention_footprint(load_footprint_events(FOOTPRINT_QUARANTINE_CSV))
+    footprint.to_csv(FOOTPRINT_CSV)
+
+
+if __name__ == '__main__':
+    main()
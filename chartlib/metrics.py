@@ -0,0 +1,161 @@
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dtypes import compact_int_dtype
+from .hierarchy import LEVELS, LEVEL_COLS
+from .utils import to_datetime_series
+
+
+# metrics derived from a column of per-group counts; the windowed ones take a window in days
+CUMULATIVE = 'cumulative'    # running total of a column of daily counts
+NEW = 'new'                  # daily change of a column of running totals
+NEW_AVG = 'new_avg'          # mean of the daily change over the last `window` days
+GROWTH_FACTOR = 'growth_factor'  # daily change over the last `window` days / over the `window` days before
+DOUBLING_TIME = 'doubling_time'  # days for the running total to double, at its growth over the last `window` days
+METRICS = [CUMULATIVE, NEW, NEW_AVG, GROWTH_FACTOR, DOUBLING_TIME]
+WINDOWED_METRICS = [NEW_AVG, GROWTH_FACTOR, DOUBLING_TIME]
+DEFAULT_WINDOW = 7
+
+_METRIC_NAME = re.compile(
+    r'^(?P<col>.+)_(?P<metric>{})(?:_(?P<window>\d+)d)?$'.format('|'.join(sorted(METRICS, key=len, reverse=True)))
+)
+
+
+def metric_name(col: str, metric: str, window: int = None) -> str:
+    """The column name of `metric` of `col`, e.g. `Confirmed_new_avg_7d`; usable as a `CovidChart` ycol."""
+    if metric not in METRICS:
+        raise ValueError(f'metric should be one of {METRICS}; got {metric}')
+    if metric not in WINDOWED_METRICS:
+        if window is not None:
+            raise ValueError(f'{metric} does not take a window')
+        return f'{col}_{metric}'
+    return f'{col}_{metric}_{DEFAULT_WINDOW if window is None else window}d'
+
+
+def parse_metric_name(name: str) -> Optional[Tuple[str, str, Optional[int]]]:
+    """The (col, metric, window) of a name made by `metric_name`, or None if `name` isn't one."""
+    match = _METRIC_NAME.match(name)
+    if match is None:
+        return None
+    window = match.group('window')
+    if (window is not None) != (match.group('metric') in WINDOWED_METRICS) or window == '0':
+        return None
+    return match.group('col'), match.group('metric'), None if window is None else int(window)
+
+
+class _SortedGroups(object):
+    # the rows of a frame sorted by group and date, with each row's position within its group
+    def __init__(self, df: pd.DataFrame, group_cols: List[str], date_col: str):
+        group_ids = df.groupby(group_cols, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        dates = to_datetime_series(df[date_col]).to_numpy()
+        self.order = np.lexsort((dates, group_ids))
+        group_ids = group_ids[self.order]
+        idx = np.arange(len(group_ids))
+        is_first = np.ones(len(group_ids), dtype=bool)
+        is_first[1:] = group_ids[1:] != group_ids[:-1]
+        # index (in sorted order) of the first row of each row's group
+        self.start = np.maximum.accumulate(np.where(is_first, idx, 0))
+        self.pos = idx - self.start
+
+    def sort(self, values: pd.Series) -> np.ndarray:
+        return values.to_numpy(dtype=float, na_value=np.nan)[self.order]
+
+    def unsort(self, values: np.ndarray, index: pd.Index) -> pd.Series:
+        unsorted = np.empty_like(values)
+        unsorted[self.order] = values
+        return pd.Series(unsorted, index=index)
+
+    def lag(self, values: np.ndarray, periods: int) -> np.ndarray:
+        # the value `periods` rows earlier in the same group, or NaN
+        lagged = np.full(len(values), np.nan)
+        if periods < len(values):
+            lagged[periods:] = values[:len(values) - periods]
+        lagged[self.pos < periods] = np.nan
+        return lagged
+
+    def _running(self, values: np.ndarray) -> np.ndarray:
+        # running totals within each group, counting NaN as 0
+        total = np.cumsum(np.where(np.isnan(values), 0., values))
+        return total - np.where(self.start > 0, total[np.maximum(self.start - 1, 0)], 0.)
+
+    def cumsum(self, values: np.ndarray) -> np.ndarray:
+        # running totals within each group, skipping NaN like pandas' cumsum: NaN rows stay NaN
+        return np.where(np.isnan(values), np.nan, self._running(values))
+
+    def diff(self, values: np.ndarray) -> np.ndarray:
+        # change from the previous row of the group; a group's first row counts from 0
+        return values - np.where(self.pos == 0, 0., self.lag(values, 1))
+
+    def rolling_mean(self, values: np.ndarray, window: int) -> np.ndarray:
+        # mean over the last `window` rows of the group; NaN until a group has that many rows, and for
+        # windows with a NaN in them
+        def window_sums(totals):
+            return totals - np.where(self.pos == window - 1, 0., self.lag(totals, window))
+        sums = window_sums(self._running(values))
+        sums[(self.pos < window - 1) | (window_sums(self._running(np.isnan(values).astype(float))) > 0)] = np.nan
+        return sums / window
+
+
+def _with_int_dtype(derived: pd.Series, source: pd.Series) -> pd.Series:
+    # counts derived from integral counts stay (nullable) ints
+    dtype = compact_int_dtype(derived) if compact_int_dtype(source) is not None else None
+    return derived if dtype is None else derived.astype(dtype)
+
+
+def derive_metric(
+        df: pd.DataFrame,
+        col: str,
+        metric: str,
+        window: int = None,
+        group_cols: List[str] = None,
+        date_col: str = 'Date',
+) -> pd.Series:
+    """
+    `metric` (one of `METRICS`) of `col` for every row of `df`, computed for all groups at once on the
+    rows sorted by group and `date_col`. Groups are the distinct values of `group_cols`, by default the
+    hierarchy columns (see `hierarchy.LEVEL_COLS`) in `df`. Windows are in rows, so each group should have
+    one row per day.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'metric should be one of {METRICS}; got {metric}')
+    window = DEFAULT_WINDOW if window is None else window
+    if metric in WINDOWED_METRICS and window < 1:
+        raise ValueError(f'window should be at least 1 day; got {window}')
+    if group_cols is None:
+        group_cols = [LEVEL_COLS[level] for level in LEVELS if LEVEL_COLS[level] in df.columns]
+    if len(df) == 0 or len(group_cols) == 0:
+        groups = _SortedGroups(df.assign(_group=0), ['_group'], date_col)
+    else:
+        groups = _SortedGroups(df, group_cols, date_col)
+    values = groups.sort(df[col])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == CUMULATIVE:
+            derived = groups.cumsum(values)
+        elif metric == NEW:
+            derived = groups.diff(values)
+        elif metric == NEW_AVG:
+            derived = groups.rolling_mean(groups.diff(values), window)
+        elif metric == GROWTH_FACTOR:
+            new_avg = groups.rolling_mean(groups.diff(values), window)
+            before = groups.lag(new_avg, window)
+            derived = np.where(before > 0, new_avg / before, np.nan)
+        else:
+            ratio = values / groups.lag(values, window)
+            derived = np.where(ratio > 1, window * np.log(2) / np.log(ratio), np.nan)
+    derived = groups.unsort(derived, df.index)
+    return _with_int_dtype(derived, df[col]) if metric in (CUMULATIVE, NEW) else derived
+
+
+def add_metric(df: pd.DataFrame, name: str, group_cols: List[str] = None, date_col: str = 'Date') -> pd.DataFrame:
+    """
+    A copy of `df` with a column `name` (see `metric_name`) holding that metric, e.g.
+    `add_metric(df, 'Confirmed_new_avg_7d')` for the 7-day average of new confirmed cases.
+    """
+    parsed = parse_metric_name(name)
+    if parsed is None or parsed[0] not in df.columns:
+        raise ValueError(f'{name} does not name a metric of a column of the frame')
+    col, metric, window = parsed
+    return df.assign(**{name: derive_metric(df, col, metric, window, group_cols=group_cols, date_col=date_col)})
@@ -3,7 +3,8 @@ from typing import TYPE_CHECKING
 
 import pandas as pd
 
-from .utils import days_between
+from .dtypes import X_DTYPE
+from .utils import to_datetime_series
 if TYPE_CHECKING:  # ref: https://stackoverflow.com/questions/39740632/python-type-hinting-without-cyclic-imports
     from .covid_chart import CovidChart
 
@@ -24,9 +25,13 @@ class DaysSinceNumReached(StartCriterion):
         col = self.col
         if col is None:
             col = chart.Y
-        days_since_N = df[df[col] > self.N].groupby(chart.groupcol)[chart.xcol].min().to_dict()
         date_of_N = 'date_of_N'
-        df[date_of_N] = df.apply(lambda x: days_since_N.get(x[chart.groupcol]), axis=1)
+        dates = to_datetime_series(df[chart.xcol])
+        # earliest date on which each group exceeds N, broadcast back to every row of the group
+        df[date_of_N] = dates.where(df[col] > self.N).groupby(
+            df[chart.groupcol], observed=True
+        ).transform('min')
+        df[chart.X] = (dates - df[date_of_N]).dt.days
         df = df.dropna(subset=[date_of_N])
-        df[chart.X] = df.apply(lambda x: days_between(x[date_of_N], x[chart.xcol]), axis=1)
+        df[chart.X] = df[chart.X].astype(X_DTYPE)
         return df
@@ -1,6 +1,8 @@
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Union
+from typing import List, Union
 
+import numpy as np
 import pandas as pd
 
 
@@ -19,6 +21,29 @@ def days_between(d1: Union[str, datetime], d2: Union[str, datetime]):
             d2 = datetime.strptime(d2, "%Y-%m-%d")
     return int((d2 - d1).days)
 
+
+def copy_on_write():
+    """
+    A context with pandas' copy-on-write mode enabled (pandas >= 1.5), in which frames derived from one
+    another share the columns they don't change. Does nothing on pandas without it, or where it is on already.
+    """
+    try:
+        enabled = pd.get_option('mode.copy_on_write')
+    except KeyError:
+        return nullcontext()
+    return nullcontext() if enabled is True else pd.option_context('mode.copy_on_write', True)
+
+
+def to_datetime_series(dates: pd.Series) -> pd.Series:
+    # vectorized counterpart of the parsing done in `days_between`
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    parsed = pd.to_datetime(dates, format="%m-%d-%Y", errors='coerce')
+    unparsed = parsed.isna() & dates.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(dates[unparsed], format="%Y-%m-%d")
+    return parsed
+
 # Closure:
 # emergency declaration = e/E; restaurant closure = r/R
 # border screening = b/B; travel restrictions= t/T; border closures = c/C
@@ -148,99 +173,83 @@ def create_lockdown_type(x, emo_flag):
     return (r + s).strip()
 
 
-# Performing a delta for world events
-def append_most_recent_events (df, x):
-    df = df[df['Country_Region'] == x['Country_Region']]
-    df = df[df['lockdown_date'] < x['lockdown_date']]
-    if (x['coverage'] == 'General'):
-        df = df[df['coverage'] != 'Targeted']
-    df = df.sort_values(by = ['lockdown_date'])
-    # print (x['lockdown_date'], df)
-    for i in {'Travel Restrictions', 'Gathering Limitations', 'Shelter-in-place Order', 'K-12 School Closure', 'Non-essential Businesses Closure'}:
-        s_global = "" # most recent global/complete
-        s_targeted = "" # most recent targeted
-        for index, r in df.iterrows():
-            if (r[i] != ''):
-                if (r['coverage'] == 'Targeted'):
-                    s_targeted = r[i]
-                else:
-                    s_global = r[i]
-        x[i] = x[i] + "*"  + s_global + "*" + s_targeted
-    # print ("appended: ", x)
-    return x
-
-# Helper function that computes the emoji and string for world events
-def interpret_events (y, regional_flag, not_the_first_flag, s, emo_s, lockdown_type):
-    a = y[lockdown_type].lower().split('*')
-    if (lockdown_type == 'Shelter-in-place Order'):
-        readable_closed = " Shelter-in-place Order"; readable_open = " Shelter-in-place Order Lifted";
-        emoji_close = "L"; emoji_open = "H"
-    if (lockdown_type == 'Gathering Limitations'): 
-        readable_closed = " Gatherings Banned"; readable_open = " Gathering Ban Lifted";
-        emoji_close = "G"; emoji_open = "J"
-    if (lockdown_type == 'K-12 School Closure'): 
-        readable_closed = " Schools Closed"; readable_open = " Schools Reopened";
-        emoji_close = "S"; emoji_open = "M"
-    if (lockdown_type == 'Non-essential Businesses Closure'): 
-        readable_closed = " Businesses Closed"; readable_open = " Businesses Reopened";
-        emoji_close = "N"; emoji_open = "O"
-
-
-    # a targeted reopening is one where we move to a 
-    # -- "no measure/recommend" state from a targeted or global "restrict"
-    # -- targeted "restrict" state from a global "restrict", and a targeted "non-restricted" state
-    # a global reopening is one where we move to a  
-    # -- "no measure/recommend" state from a targeted or global "restrict"
-    if ((
-            (("recommend" in a[0]) or ("no measures" in a[0])) and 
-            (("require" in a[1]) or ("require" in a[2]))
-        ) or 
-        (
-            (regional_flag == 1) and ("require" in a[0]) and 
-            ("require" in a[1]) and ("require" not in a[2])
-        )): 
-        if not_the_first_flag == 1: s = s + ","
-        s = s + readable_open
-        r = emoji_open.lower() if (regional_flag == 1) else emoji_open
-        emo_s = (emo_s + emoji_open.lower()) if (regional_flag == 1) else (emo_s + emoji_open)
-        not_the_first_flag = 1
+# Measures interpreted for the new world export, in the order their events are listed, as
+# measure: (closing label, opening label, closing emoji code, opening emoji code)
+NEW_EXPORT_MEASURES = {
+    'Shelter-in-place Order': (' Shelter-in-place Order', ' Shelter-in-place Order Lifted', 'l', 'h'),
+    'Gathering Limitations': (' Gatherings Banned', ' Gathering Ban Lifted', 'g', 'j'),
+    'K-12 School Closure': (' Schools Closed', ' Schools Reopened', 's', 'm'),
+    'Non-essential Businesses Closure': (' Businesses Closed', ' Businesses Reopened', 'n', 'o'),
+}
 
-    # a targeted closing is one where we move to a 
-    # -- "restrict" state where neither targeted nor global is "restricted"
-    # a global reopening is one where we move to a  
-    # -- "restrict" state where the global is not "restricted"
-    if ((
-            (regional_flag == 1) and ("require" in a[0]) and 
-            ("require" not in a[1]) and ("require" not in a[2])
-        ) or
-        (
-            (regional_flag != 1) and ("require" in a[0]) and ("require" not in a[1])
-        )):
-        if not_the_first_flag == 1: s = s + ","
-        s = s + readable_closed
-        r = emoji_close.lower() if (regional_flag == 1) else emoji_close
-        emo_s = (emo_s + emoji_close.lower()) if (regional_flag == 1) else (emo_s + emoji_close)
-        not_the_first_flag = 1
 
+def most_recent_events(df: pd.DataFrame, measures: List[str]):
+    """
+    For every row of a world event frame with one row per lockdown_date, Country_Region and coverage,
+    find the most recent earlier non-empty value of each measure in the same country, once among general
+    (non-targeted) events and once among targeted events. General rows get no targeted history.
 
-    return not_the_first_flag, s, emo_s 
+    Returns a pair of frames (general, targeted) aligned with `df`, with '' where there is no earlier event.
+    """
+    keys = pd.DataFrame({'Country_Region': df['Country_Region'], 'date': to_datetime_series(df['lockdown_date'])})
+    dates = pd.MultiIndex.from_frame(keys.drop_duplicates().sort_values(['Country_Region', 'date']))
+    targeted = (df['coverage'] == 'Targeted').to_numpy()
+    history = []
+    for is_targeted in (False, True):
+        rows = targeted == is_targeted
+        values = df.loc[rows, measures].replace('', np.nan)
+        values.index = pd.MultiIndex.from_frame(keys.loc[rows])
+        # carry each country's values forward over all of its event dates, then step back one date
+        # so that events on the same date are not counted as history
+        carried = values.reindex(dates).groupby(level=0, sort=False).ffill()
+        carried = carried.groupby(level=0, sort=False).shift(1)
+        carried = carried.reindex(pd.MultiIndex.from_frame(keys)).fillna('')
+        carried.index = df.index
+        history.append(carried)
+    general, targeted_history = history
+    targeted_history.loc[~targeted] = ''
+    return general, targeted_history
 
 
-# lockdown new export: requires df
-def create_lockdown_type_world_new_export(df, x, emo_flag):
-    s = r = emo_s = ""
-    x = append_most_recent_events (df, x)
-    regional_flag = closure_flag = not_the_first_flag = 0
-    if x['coverage'] == 'Targeted':
-        r = 'Regional'
-        regional_flag = 1
-    for i in {'Shelter-in-place Order', 'Gathering Limitations','K-12 School Closure', 'Non-essential Businesses Closure'}:
-        not_the_first_flag, s, emo_s = interpret_events (x, regional_flag, not_the_first_flag, s, emo_s, i)
-    if emo_flag == 1:
-        return emo_s
-    if s == "":
-        return s  # Ensures just "Regional" is not returned
-    return (r + s).strip()
+def encode_new_export_lockdown_types(df: pd.DataFrame, measures: List[str] = None) -> pd.DataFrame:
+    """
+    Compute the `lockdown_type` and `emoji_string` of every row of the new world export, where each event is
+    interpreted relative to the most recent earlier general and targeted events of its country.
+
+    A targeted reopening moves to a "no measures" / "recommend" state from a targeted or general "require",
+    or to a targeted "require" from a general "require" and a targeted non-"require". A general reopening moves
+    to a "no measures" / "recommend" state from a targeted or general "require".
+    A targeted closing moves to a "require" state where neither the general nor the targeted state required;
+    a general closing moves to a "require" state where the general state did not require.
+    """
+    measures = list(NEW_EXPORT_MEASURES) if measures is None else measures
+    n = len(df)
+    regional = (df['coverage'] == 'Targeted').to_numpy()
+    general, targeted = most_recent_events(df, measures)
+    text = np.full(n, '', dtype=object)
+    emoji = np.full(n, '', dtype=object)
+    has_event = np.zeros(n, dtype=bool)
+    for measure in measures:
+        closed_label, open_label, closed_code, open_code = NEW_EXPORT_MEASURES[measure]
+        current = df[measure].str.lower()
+        requires = current.str.contains('require', regex=False).to_numpy()
+        relaxes = (current.str.contains('recommend', regex=False) | current.str.contains('no measures', regex=False)).to_numpy()
+        general_requires = general[measure].str.lower().str.contains('require', regex=False).to_numpy()
+        targeted_requires = targeted[measure].str.lower().str.contains('require', regex=False).to_numpy()
+        opening = (
+            (relaxes & (general_requires | targeted_requires))
+            | (regional & requires & general_requires & ~targeted_requires)
+        )
+        closing = (
+            (regional & requires & ~general_requires & ~targeted_requires)
+            | (~regional & requires & ~general_requires)
+        )
+        for matched, label, code in ((opening, open_label, open_code), (closing, closed_label, closed_code)):
+            text[matched & has_event] += ','
+            text[matched] += label
+            emoji[matched] += code
+            has_event |= matched
+    return _lockdown_type_frame(df, text, emoji, regional)
 
 
 # border screening = b/B; travel restrictions= t/T; border closures = c/C
@@ -304,6 +313,149 @@ def create_lockdown_type_world(x, emo_flag):
 
 
 
+# Table-driven counterparts of `create_lockdown_type` and `create_lockdown_type_world`, which encode
+# a whole event frame at once instead of one row at a time.
+#
+# Columns are listed in the order in which their events appear in `lockdown_type`, as
+# (column, any value counts as an event, events mark a closure). Each event after the first is
+# separated by a comma; a column whose values all count as events is separated even when none of its
+# rules match. Once a closure has been listed, later closures use their short (second) label.
+#
+# Rules are (column, match, value, label, emoji code). `match` is 'eq' for exact matches, 'contains'
+# for substring matches and 'other' for any value not matched by an 'eq' rule of the same column;
+# `{}` in a label is replaced by the value itself. Several rules of one column can match the same row.
+# Emoji codes are upper-cased for events that cover a whole state or country.
+US_LOCKDOWN_COLUMNS = [
+    ('State of Emergency Declaration', False, False),
+    ('Travel Restrictions', True, False),
+    ('Shelter-in-place Order', True, False),
+    ('Gathering Limitations', True, False),
+    ('Banning Gatherings of a Certain Size', True, False),
+    ('Face Covering Requirements', True, False),
+    ('K-12 School Closure', True, True),
+    ('Bar and Dine-in Restaurant Closure', True, True),
+    ('Non-essential Businesses Closure', True, True),
+]
+US_LOCKDOWN_RULES = [
+    ('State of Emergency Declaration', 'eq', 'State of Emergency declared', ' Declaration of Emergency', 'e'),
+    ('Travel Restrictions', 'contains', 'Travel restrictions for out of state travelers',
+     ' Border Closure/Visitor Quarantine', 't'),
+    ('Travel Restrictions', 'contains', 'Travel restrictions for out of state travelers lifted',
+     ' Border Opening/Visitor Quarantine Lifted', 'd'),
+    ('Travel Restrictions', 'contains', 'Border closures', ' Border Closure/Visitor Quarantine', 'c'),
+    ('Travel Restrictions', 'contains', 'Border closures lifted', ' Border Opening/Visitor Quarantine Lifted', 'k'),
+    ('Shelter-in-place Order', 'eq', 'Shelter-in-place order', ' Stay-at-home Order', 'l'),
+    ('Shelter-in-place Order', 'eq', 'Night-time curfew', ' Curfew', 'l'),
+    ('Shelter-in-place Order', 'eq', 'Shelter-in-place order lifted', ' Stay-at-home Order Lifted', 'h'),
+    ('Shelter-in-place Order', 'eq', 'Night-time curfew lifted', ' Curfew Lifted', 'i'),
+    ('Gathering Limitations', 'eq', 'Banning gatherings lifted', ' Gatherings Ban Lifted', 'j'),
+    ('Gathering Limitations', 'other', None, ' Gatherings Banned', 'g'),
+    ('Banning Gatherings of a Certain Size', 'other', None, ' Gatherings (>{}) Banned', 'g'),
+    ('Face Covering Requirements', 'eq', 'Face covering requirements lifted', ' Face covering requirements lifted', 'p'),
+    ('Face Covering Requirements', 'other', None, ' Face covering required', 'f'),
+    ('K-12 School Closure', 'eq', 'Schools closed', ' Closure of Schools', 's'),
+    ('K-12 School Closure', 'eq', 'Schools open', ' Opening of Schools', 'm'),
+    ('Bar and Dine-in Restaurant Closure', 'eq', 'Bar and dine-in restaurant closed (except take-out and delivery)',
+     (' Restaurants', ' Restaurants'), 'r'),
+    ('Bar and Dine-in Restaurant Closure', 'other', None, (' Restaurants', ' Restaurants'), 'q'),
+    ('Non-essential Businesses Closure', 'eq', 'Non-essential businesses closed',
+     (' Closure of Non-essential Businesses', ' Non-essential Businesses'), 'n'),
+    ('Non-essential Businesses Closure', 'eq',
+     'Some (cherry-picked) businesses closed; others allowed to operate possibly with extra requirements',
+     (' Closure of Non-essential Businesses', ' Non-essential Businesses'), 'n'),
+    ('Non-essential Businesses Closure', 'eq', 'Some (cherry-picked) businesses closed',
+     (' Closure of Non-essential Businesses', ' Non-essential Businesses'), 'n'),
+    ('Non-essential Businesses Closure', 'eq', 'Non-essential businesses allowed to operate possibly with extra requirements',
+     (' Opening of Non-essential Businesses', ' Non-essential Businesses'), 'o'),
+]
+
+WORLD_LOCKDOWN_COLUMNS = [
+    ('Travel Restrictions', False, False),
+    ('Shelter-in-place Order', False, False),
+    ('Gathering Limitations', False, False),
+    ('K-12 School Closure', False, True),
+    ('Non-essential Businesses Closure', False, True),
+]
+WORLD_LOCKDOWN_RULES = [
+    ('Travel Restrictions', 'eq', 'Screening', ' Border Screening', 'b'),
+    ('Travel Restrictions', 'eq', 'Quarantine on high-risk regions', ' Visitor Quarantine', 't'),
+    ('Travel Restrictions', 'eq', 'Ban on high risk regions', ' Border Closures', 'c'),
+    ('Shelter-in-place Order', 'eq', 'Restrict movement', ' Stay-at-home Order', 'l'),
+    ('Gathering Limitations', 'eq', 'Required Cancelling Public Events', ' Gatherings Banned', 'g'),
+    ('K-12 School Closure', 'eq', 'Required Closing', ' Closure of Schools', 's'),
+    ('Non-essential Businesses Closure', 'eq', 'Required Closing Workspaces',
+     (' Closure of Non-essential Businesses', ' Non-essential Businesses'), 'n'),
+]
+
+
+def _rule_matches(values: pd.Series, present: pd.Series, match: str, value, eq_values: List[str]) -> np.ndarray:
+    if match == 'eq':
+        return (values == value).to_numpy()
+    if match == 'contains':
+        return (present & values.astype(str).str.contains(value, regex=False)).to_numpy()
+    if match == 'other':
+        return (present & ~values.isin(eq_values)).to_numpy()
+    raise ValueError(f'unknown match kind: {match}')
+
+
+def encode_lockdown_types(df: pd.DataFrame, columns: List, rules: List, regional: pd.Series) -> pd.DataFrame:
+    """
+    Compute the `lockdown_type` and `emoji_string` of every row of an event frame in one pass,
+    using a column / rule table such as `US_LOCKDOWN_COLUMNS` / `US_LOCKDOWN_RULES`.
+    Columns of the table that are missing from `df` are treated as having no events.
+    """
+    n = len(df)
+    regional = regional.to_numpy(dtype=bool)
+    text = np.full(n, '', dtype=object)
+    emoji = np.full(n, '', dtype=object)
+    has_event = np.zeros(n, dtype=bool)
+    has_closure = np.zeros(n, dtype=bool)
+    for col, any_value_is_event, marks_closure in columns:
+        if col not in df.columns:
+            continue
+        values = df[col]
+        present = values.notna()
+        col_rules = [rule for rule in rules if rule[0] == col]
+        eq_values = [rule[2] for rule in col_rules if rule[1] == 'eq']
+        matches = [_rule_matches(values, present, rule[1], rule[2], eq_values) for rule in col_rules]
+        is_event = present.to_numpy() if any_value_is_event else np.logical_or.reduce(matches + [np.zeros(n, bool)])
+        text[is_event & has_event] += ','
+        for (_, _, _, label, code), matched in zip(col_rules, matches):
+            if not matched.any():
+                continue
+            if isinstance(label, tuple):
+                label = np.where(has_closure[matched], label[1], label[0]).astype(object)
+            elif '{}' in label:
+                label = np.array([label.format(v) for v in values.to_numpy()[matched]], dtype=object)
+            text[matched] += label
+            emoji[matched] += code
+        has_event |= is_event
+        if marks_closure:
+            has_closure |= is_event
+    return _lockdown_type_frame(df, text, emoji, regional)
+
+
+def _lockdown_type_frame(df: pd.DataFrame, text: np.ndarray, emoji: np.ndarray, regional: np.ndarray) -> pd.DataFrame:
+    # prefix regional events with "Regional" (but never return just "Regional"), and upper-case the
+    # emoji codes of events that cover a whole state or country
+    text = pd.Series(text, index=df.index)
+    lockdown_type = ('Regional' + text).where(regional, text).str.strip().where(text != '', '')
+    emoji_string = pd.Series(emoji, index=df.index)
+    emoji_string = emoji_string.where(regional, emoji_string.str.upper())
+    return pd.DataFrame({'lockdown_type': lockdown_type, 'emoji_string': emoji_string})
+
+
+def encode_us_lockdown_types(df: pd.DataFrame) -> pd.DataFrame:
+    # vectorized `create_lockdown_type`
+    return encode_lockdown_types(df, US_LOCKDOWN_COLUMNS, US_LOCKDOWN_RULES, df['Coverage'] != 'State-wide')
+
+
+def encode_world_lockdown_types(df: pd.DataFrame) -> pd.DataFrame:
+    # vectorized `create_lockdown_type_world`
+    return encode_lockdown_types(df, WORLD_LOCKDOWN_COLUMNS, WORLD_LOCKDOWN_RULES, df['coverage'] == 'Targeted')
+
+
+
 
 
 def str2emo(s):
@@ -1,6 +1,23 @@
 # Modified from: https://github.com/wadefagen/91-DIVOC/blob/master/pages/covid-visualization/processData.py
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from datetime import datetime
+
+import pandas as pd
+
 path = '../COVID-19/csse_covid_19_data/csse_covid_19_daily_reports/'
 
+# per-day frames that were already processed, and the hashes of the daily reports (and of this
+# script) they came from
+cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'daily-reports')
+manifestPath = os.path.join(cacheDir, 'manifest.json')
+
+
+countyColumns = ["Country_Region", "Province_State", "Admin2", "Confirmed", "Recovered", "Active", "Deaths", "Date"]
+
 
 def processDate(date):
   print(date)
@@ -13,6 +30,10 @@ def processDate(date):
     })
 
   df = df[ df['Province_State'].str.contains('Diamond Princess') != True ]
+  return processStates(df, date), processCounties(df, date)
+
+
+def processStates(df, date):
 
   #print(df['Province_State'].str.contains('Diamond Princess'))
   stateData = df.groupby(['Country_Region', 'Province_State']).agg('sum').reset_index()
@@ -21,28 +42,102 @@ def processDate(date):
   countrydata = df.groupby(['Country_Region']).agg('sum').reset_index()
   countrydata['Province_State'] = ""
 
-  df = stateData.append( countrydata )
+  df = pd.concat([stateData, countrydata])
   if 'Active' not in df:
     df['Active'] = df['Confirmed'] - df['Recovered'] - df['Deaths']
-  df = df[ ["Country_Region", "Province_State", "Confirmed", "Recovered", "Active", "Deaths"] ] 
+  df = df[ ["Country_Region", "Province_State", "Confirmed", "Recovered", "Active", "Deaths"] ]
   df["Date"] = date
 
   return df
 
 
+def processCounties(df, date):
+  # US reports list counties (Admin2) since 03-22-2020
+  if 'Admin2' not in df:
+    return pd.DataFrame(columns=countyColumns)
+  df = df[ (df["Country_Region"] == "US") & df["Admin2"].notnull() ]
+  valueColumns = [col for col in ["Confirmed", "Recovered", "Active", "Deaths"] if col in df]
+  countyData = df.groupby(['Country_Region', 'Province_State', 'Admin2'])[valueColumns].sum().reset_index()
+  if 'Active' not in countyData:
+    countyData['Active'] = countyData['Confirmed'] - countyData['Recovered'] - countyData['Deaths']
+  countyData["Date"] = date
+  return countyData[countyColumns]
+
+
+def fileDigest(filename):
+  h = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+def cachedDatePath(date):
+  return os.path.join(cacheDir, date + '.pkl')
 
-import pandas as pd
-import os
 
-df = pd.DataFrame()
-print (os.listdir(path))
-for filename in os.listdir(path):
-  if not filename.endswith(".csv"): continue
-  print ("filename:",filename)
-  # print ("date:",date)
+def cachedCountyPath(date):
+  return os.path.join(cacheDir, date + '-counties.pkl')
+
+
+def processAndCacheDate(date):
+  df, countyDf = processDate(date)
+  df.to_pickle(cachedDatePath(date))
+  countyDf.to_pickle(cachedCountyPath(date))
+  return df, countyDf
+
+
+def readManifest():
+  if not os.path.exists(manifestPath):
+    return {}
+  with open(manifestPath, 'r') as f:
+    return json.load(f)
+
+
+def writeManifest(manifest):
+  with open(manifestPath, 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+parser = argparse.ArgumentParser(description='Combine the JHU daily reports into jhu-data.csv.')
+parser.add_argument('--full', action='store_true', help='reprocess every daily report, even unchanged ones')
+parser.add_argument('--jobs', '-j', type=int, default=0, help='number of daily reports to process in parallel (0: one per core)')
+args = parser.parse_args()
+
+os.makedirs(cacheDir, exist_ok=True)
+manifest = {} if args.full else readManifest()
+
+# daily reports are named MM-DD-YYYY.csv; process them in date order
+filenames = [filename for filename in os.listdir(path) if filename.endswith(".csv")]
+filenames.sort(key=lambda filename: datetime.strptime(filename[0:10], "%m-%d-%Y"))
+digests = {filename: fileDigest(path + filename) for filename in filenames}
+# cached frames are only valid for the code that produced them; a changed script means a full rebuild
+processorDigest = fileDigest(os.path.abspath(__file__))
+if manifest.get('processor') != processorDigest:
+  manifest = {}
+reports = manifest.get('reports', {})
+
+frames = {}
+countyFrames = {}
+stale = []
+for filename in filenames:
   date = filename[0:10]
+  if reports.get(filename) == digests[filename] and os.path.exists(cachedDatePath(date)) and os.path.exists(cachedCountyPath(date)):
+    frames[date] = pd.read_pickle(cachedDatePath(date))
+    countyFrames[date] = pd.read_pickle(cachedCountyPath(date))
+  else:
+    stale.append(date)
+print ("processing", len(stale), "of", len(filenames), "daily reports")
 
-  df = df.append(processDate(date))
+if len(stale) > 0:
+  # fork, so that workers see the functions above without re-running this script
+  with multiprocessing.get_context("fork").Pool(args.jobs or None) as pool:
+    for date, (frame, countyFrame) in zip(stale, pool.map(processAndCacheDate, stale)):
+      frames[date] = frame
+      countyFrames[date] = countyFrame
+
+df = pd.concat([frames[filename[0:10]] for filename in filenames])
+countyDf = pd.concat([countyFrames[filename[0:10]] for filename in filenames])
 
 
 # == Replace Data to Match Population ==
@@ -58,22 +153,17 @@ countryReplacement = {
   "Mainland China": "China",
   "Iran (Islamic Republic of)": "Iran",
   "Republic of Korea": "South Korea",
-  "UK": "United Kingdom"  
+  "UK": "United Kingdom"
 }
 
 stateReplacement = {
   "United States Virgin Islands": "Virgin Islands"
 }
 
-for key in countryReplacement:
-  old = key
-  new = countryReplacement[key]
-  df["Country_Region"] = df["Country_Region"].replace(old, new)
-
-for key in stateReplacement:
-  old = key
-  new = stateReplacement[key]
-  df["Province_State"] = df["Province_State"].replace(old, new)
+df["Country_Region"] = df["Country_Region"].replace(countryReplacement)
+df["Province_State"] = df["Province_State"].replace(stateReplacement)
+countyDf["Country_Region"] = countyDf["Country_Region"].replace(countryReplacement)
+countyDf["Province_State"] = countyDf["Province_State"].replace(stateReplacement)
 
 
 # == Add Population ==
@@ -81,5 +171,10 @@ for key in stateReplacement:
 
 #print(df)
 df.to_csv('jhu-data.csv')
+# county rows for chartlib's country -> state -> county hierarchy (see chartlib/hierarchy.py)
+countyDf.to_csv('jhu-county-data.csv')
+
+# only record the reports that made it into jhu-data.csv
+writeManifest({'processor': processorDigest, 'reports': digests})
 
-print ('Completed processData')
\ No newline at end of file
+print ('Completed processData')
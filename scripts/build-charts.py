@@ -1,18 +1,64 @@
 #!/usr/bin/env python
+import argparse
+import glob
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
 import sys
+import time
+import traceback
 sys.path.append('.')
 from datetime import datetime
 
+import altair as alt
 import pandas as pd
 import yaml
 
-from chartlib import CovidChart, DaysSinceNumReached, days_between
+from chartlib import (
+    CovidChart, DaysSinceNumReached, days_between, load_jhu_hierarchy, load_quarantine_data, select_level
+)
+from chartlib.datasets import JHU_COUNTY_CSV, JHU_CSV, chartlib_source_digest, file_digest
+from chartlib.export import publish_asset, read_asset_manifest, write_asset_manifest
+from chartlib.instrument import recording_stages, stage
 
 
 STAGING = True  # os.environ.get('STAGING', os.environ.get('STAGE', False))
 
 EXTRA_DAYS_TO_INCLUDE = days_between('2020-04-28', datetime.now())
 
+WORLD_CASES_QUARANTINE_CSV = './data/quarantine-activity-world-new-export.csv'
+WORLD_DEATHS_QUARANTINE_CSV = './data/quarantine-activity-Apr19.csv'
+US_QUARANTINE_CSV = './data/combined-activity-US-Jun9.csv'
+US_QUARANTINE_CSV_OLD = './data/quarantine-activity-US.csv'
+
+# input hashes of each chart as of the last time it was built
+CHART_MANIFEST = './.cache/chart-manifest.json'
+
+# timings, row counts and memory of each stage of each chart built by the last build, one json object per line
+BUILD_REPORT = './.cache/build-report.jsonl'
+
+# where chart datasets go when exported separately from their specs (--split-data)
+CHART_DATA_DIR = './website/js/autogen/data'
+CHART_DATA_URL = 'js/autogen/data'
+
+# content-hashed, precompressed copies of the chart scripts (see `publish_asset`) that the site loads, by script name
+ASSET_DIR = './website/js/autogen'
+ASSET_URL = 'js/autogen'
+ASSET_MANIFEST = './website/js/autogen/manifest.json'
+
+JEKYLL_CONFIG_IN = './website/_config.in.yml'
+
+# files that --watch polls; a change to code restarts the build, since it may change any chart
+WATCHED_DATA_GLOBS = ['./data/*.csv', JEKYLL_CONFIG_IN]
+WATCHED_CODE_GLOBS = ['./chartlib/*.py', os.path.relpath(os.path.abspath(__file__))]
+
+
+def jhu_inputs():
+    # county rows are optional (see data/processData.py); when present they are part of the JHU hierarchy
+    return [JHU_CSV] + ([JHU_COUNTY_CSV] if os.path.exists(JHU_COUNTY_CSV) else [])
+
 
 def first_alphabetic_group(df, groupcol):
     return sorted(df[groupcol].unique())[0]
@@ -24,24 +70,29 @@ def chart_configs():
         'ytitle': '',
         'emoji_legend': False,
     }
+    jhu_csvs = jhu_inputs()
     configs = [
         {
             'name': 'jhu_us_cases',
             'gen': make_jhu_state_cases_chart,
+            'inputs': jhu_csvs + [_us_level_and_quarantine_csv()[1]],
             'make_text_area': True,
         },
         {
             'name': 'jhu_us_deaths',
             'gen': make_jhu_state_deaths_chart,
+            'inputs': jhu_csvs + [_us_level_and_quarantine_csv()[1]],
             'make_text_area': True,
         },
         {
             'name': 'jhu_world_cases',
             'gen': make_jhu_country_cases_chart,
+            'inputs': jhu_csvs + [WORLD_CASES_QUARANTINE_CSV],
         },
         {
             'name': 'jhu_world_deaths',
             'gen': make_jhu_country_deaths_chart,
+            'inputs': jhu_csvs + [WORLD_DEATHS_QUARANTINE_CSV],
         },
     ]
 
@@ -74,14 +125,21 @@ def _maybe_add_staging_props(chart):
     return chart
 
 
-def make_jhu_country_cases_chart(override_props) -> CovidChart:
-    jhu_df = pd.read_csv('./data/jhu-data.csv')
-    jhu_df = jhu_df[(jhu_df.Province_State.isnull()) & (jhu_df.Country_Region != 'China')]
+def _us_level_and_quarantine_csv():
+    if STAGING:
+        #qcsv = './data/quarantine-activity-US-Apr16.csv'
+        return 'usa', US_QUARANTINE_CSV
+    else:
+        return 'usa_old', US_QUARANTINE_CSV_OLD
+
+
+def make_jhu_country_cases_chart(override_props, days_since=50, top_k_groups=30) -> CovidChart:
+    jhu_df = select_level(load_jhu_hierarchy(), 'country')
+    jhu_df = jhu_df[jhu_df.Country_Region != 'China']
 
     #qcsv = './data/quarantine-activity-Apr19.csv'
-    qcsv = './data/quarantine-activity-world-new-export.csv'
+    qcsv = WORLD_CASES_QUARANTINE_CSV
     
-    days_since = 50
     groupcol = 'Country_Region'
     chart = CovidChart(
         jhu_df,
@@ -90,7 +148,7 @@ def make_jhu_country_cases_chart(override_props) -> CovidChart:
         ycol='Confirmed',
         level='country',
         xcol='Date',
-        top_k_groups=30,
+        top_k_groups=top_k_groups,
         sample_every=3,
         quarantine_df=qcsv
     )
@@ -109,13 +167,12 @@ def make_jhu_country_cases_chart(override_props) -> CovidChart:
     return chart
 
 
-def make_jhu_country_deaths_chart(override_props) -> CovidChart:
-    jhu_df = pd.read_csv("./data/jhu-data.csv")
-    jhu_df = jhu_df.loc[(jhu_df.Country_Region != 'China') & jhu_df.Province_State.isnull()]
+def make_jhu_country_deaths_chart(override_props, days_since=10, top_k_groups=30) -> CovidChart:
+    jhu_df = select_level(load_jhu_hierarchy(), 'country')
+    jhu_df = jhu_df.loc[jhu_df.Country_Region != 'China']
 
-    qcsv = './data/quarantine-activity-Apr19.csv'
+    qcsv = WORLD_DEATHS_QUARANTINE_CSV
 
-    days_since = 10
     groupcol = 'Country_Region'
     chart = CovidChart(
         jhu_df,
@@ -124,7 +181,7 @@ def make_jhu_country_deaths_chart(override_props) -> CovidChart:
         ycol='Deaths',
         xcol='Date',
         level='country',
-        top_k_groups=30,
+        top_k_groups=top_k_groups,
         sample_every=3,
         quarantine_df=qcsv
     )
@@ -140,20 +197,12 @@ def make_jhu_country_deaths_chart(override_props) -> CovidChart:
     return chart
 
 
-def make_jhu_state_cases_chart(override_props) -> CovidChart:
-    jhu_df = pd.read_csv('./data/jhu-data.csv')
+def make_jhu_state_cases_chart(override_props, days_since=20, top_k_groups=30) -> CovidChart:
     # grab us-specific
-    jhu_df = jhu_df[(jhu_df.Country_Region == 'United States') & jhu_df.Province_State.notnull()]
+    jhu_df = select_level(load_jhu_hierarchy(), 'state', {'Country_Region': 'United States'})
 
-    if STAGING:
-        level = 'usa'
-        #qcsv = './data/quarantine-activity-US-Apr16.csv'
-        qcsv = './data/combined-activity-US-Jun9.csv'
-    else:
-        level = 'usa_old'
-        qcsv = './data/quarantine-activity-US.csv'
+    level, qcsv = _us_level_and_quarantine_csv()
 
-    days_since = 20
     groupcol = 'Province_State'
     chart = CovidChart(
         jhu_df,
@@ -162,7 +211,7 @@ def make_jhu_state_cases_chart(override_props) -> CovidChart:
         ycol='Confirmed',
         level=level,
         xcol='Date',
-        top_k_groups=30,
+        top_k_groups=top_k_groups,
         sample_every=3,
         quarantine_df=qcsv  # should have a column with same name as `groupcol`
     )
@@ -178,19 +227,11 @@ def make_jhu_state_cases_chart(override_props) -> CovidChart:
     return chart
 
 
-def make_jhu_state_deaths_chart(override_props) -> CovidChart:
-    jhu_df = pd.read_csv('./data/jhu-data.csv')
-    jhu_df = jhu_df.loc[(jhu_df.Country_Region == 'United States') & jhu_df.Province_State.notnull()]
+def make_jhu_state_deaths_chart(override_props, days_since=10, top_k_groups=30) -> CovidChart:
+    jhu_df = select_level(load_jhu_hierarchy(), 'state', {'Country_Region': 'United States'})
 
-    if STAGING:
-        level = 'usa'
-        #qcsv = './data/quarantine-activity-US-Apr16.csv'
-        qcsv = './data/combined-activity-US-Jun9.csv'
-    else:
-        level = 'usa_old'
-        qcsv = './data/quarantine-activity-US.csv'
+    level, qcsv = _us_level_and_quarantine_csv()
 
-    days_since = 10
     groupcol = 'Province_State'
     chart = CovidChart(
         jhu_df,
@@ -199,7 +240,7 @@ def make_jhu_state_deaths_chart(override_props) -> CovidChart:
         ycol='Deaths',
         xcol='Date',
         level=level,
-        top_k_groups=30,
+        top_k_groups=top_k_groups,
         sample_every=3,
         quarantine_df=qcsv  # should have a column with same name as `groupcol`
     )
@@ -216,9 +257,8 @@ def make_jhu_state_deaths_chart(override_props) -> CovidChart:
 
 
 def make_jhu_selected_state_chart(override_props) -> CovidChart:
-    jhu_df = pd.read_csv('./data/jhu-data.csv')
     # grab us-specific
-    jhu_df = jhu_df[(jhu_df.Country_Region == 'United States') & jhu_df.Province_State.notnull()]
+    jhu_df = select_level(load_jhu_hierarchy(), 'state', {'Country_Region': 'United States'})
     # jhu_df[(nyt_df["state"]=="Illinois")|(nyt_df["state"]=="New York")| (nyt_df["state"]=="New Jersey")| (nyt_df["state"]=="Washington")| (nyt_df["state"]=="Michigan")]
     days_since = 20
     chart = CovidChart(
@@ -244,11 +284,112 @@ def make_jhu_selected_state_chart(override_props) -> CovidChart:
     return chart
 
 
-def export_charts(configs):
+def chart_output_path(config):
+    return f'{ASSET_DIR}/{config["name"]}.js'
+
+
+def export_chart(config, trace_memory=False):
+    name = config['name']
+    with recording_stages(trace_memory=trace_memory, chart=name) as records:
+        with stage('generate'):
+            chart = config['gen'](config.get('override_props', {}))
+        chart.export(chart_output_path(config), f'{name}', **config.get('export_options', {}))
+    return records
+
+
+def chart_input_digest(config, shared_digest, file_digests):
+    """
+    Hashes everything a chart's output depends on: its data files, the generator's source,
+    the rest of its config, plus `shared_digest` (chartlib, shared build helpers, the date).
+    """
+    h = hashlib.sha1(shared_digest.encode())
+    for fname in config['inputs']:
+        if fname not in file_digests:
+            file_digests[fname] = file_digest(fname)
+        h.update(f'{fname}:{file_digests[fname]}'.encode())
+    h.update(inspect.getsource(config['gen']).encode())
+    resolved = {k: v for k, v in config.items() if k != 'gen'}
+    h.update(json.dumps(resolved, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def shared_input_digest():
+    h = hashlib.sha1()
+    h.update(chartlib_source_digest().encode())
+    for helper in (first_alphabetic_group, _maybe_add_staging_props, _us_level_and_quarantine_csv, export_chart):
+        h.update(inspect.getsource(helper).encode())
+    h.update(json.dumps([STAGING, EXTRA_DAYS_TO_INCLUDE, alt.__version__, pd.__version__]).encode())
+    return h.hexdigest()
+
+
+def read_chart_manifest():
+    if not os.path.exists(CHART_MANIFEST):
+        return {}
+    with open(CHART_MANIFEST, 'r') as f:
+        return json.load(f)
+
+
+def write_chart_manifest(manifest):
+    os.makedirs(os.path.dirname(CHART_MANIFEST), exist_ok=True)
+    with open(CHART_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def charts_to_rebuild(configs, manifest, digests):
+    return [
+        config for config in configs
+        if manifest.get(config['name']) != digests[config['name']] or not os.path.exists(chart_output_path(config))
+    ]
+
+
+def preload_datasets():
+    # parse everything the generators read up front, so that forked workers inherit the frames
+    load_jhu_hierarchy()
+    for qcsv in (WORLD_CASES_QUARANTINE_CSV, WORLD_DEATHS_QUARANTINE_CSV, _us_level_and_quarantine_csv()[1]):
+        load_quarantine_data(qcsv)
+
+
+# configs being exported by the worker pool; set before forking so workers can look them up by index
+_POOL_CONFIGS = None
+_POOL_TRACE_MEMORY = False
+
+
+def _export_pool_config(idx):
+    return export_chart(_POOL_CONFIGS[idx], trace_memory=_POOL_TRACE_MEMORY)
+
+
+def export_charts(configs, jobs=1, trace_memory=False):
+    """Exports every chart of `configs`; returns the stage records of each chart (see `chartlib.instrument`)."""
+    if jobs <= 1 or len(configs) <= 1:
+        return [export_chart(config, trace_memory=trace_memory) for config in configs]
+    global _POOL_CONFIGS, _POOL_TRACE_MEMORY
+    _POOL_CONFIGS = configs
+    _POOL_TRACE_MEMORY = trace_memory
+    preload_datasets()
+    # fork (rather than spawn) so that workers share the already-loaded frames copy-on-write
+    with multiprocessing.get_context('fork').Pool(min(jobs, len(configs))) as pool:
+        return pool.map(_export_pool_config, range(len(configs)), chunksize=1)
+
+
+def publish_chart_assets(configs):
+    """
+    Publishes the chart scripts of `configs` under content-hashed names, so that browsers and CDNs can cache them
+    indefinitely, and lists them in the asset manifest; only changed scripts are written and compressed again.
+    """
+    manifest = read_asset_manifest(ASSET_MANIFEST)
     for config in configs:
-        name = config['name']
-        chart = config['gen'](config.get('override_props', {}))
-        chart.export(f'./website/js/autogen/{name}.js', f'{name}')
+        if os.path.exists(chart_output_path(config)):
+            publish_asset(chart_output_path(config), manifest)
+    write_asset_manifest(manifest, ASSET_MANIFEST)
+    return manifest
+
+
+def write_build_report(chart_records, path=BUILD_REPORT):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for records in chart_records:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
 
 
 def make_vega_embed_script(configs):
@@ -267,6 +408,23 @@ function loadScript(scriptUrl) {
     }
   });
 }
+
+// call `embed` once the element with id `embedId` is (nearly) on screen;
+// elements in hidden tabs are display: none and so only intersect once their tab is shown
+function embedWhenVisible(embedId, embed) {
+  var el = document.getElementById(embedId);
+  if (el === null || !('IntersectionObserver' in window)) {
+    embed();
+    return;
+  }
+  var observer = new IntersectionObserver(function(entries) {
+    if (entries.some(function(entry) { return entry.isIntersecting; })) {
+      observer.disconnect();
+      embed();
+    }
+  }, {rootMargin: '200px 0px'});
+  observer.observe(el);
+}
     """
     script = """
 var COVIDVIS_CHARTS = {{}};
@@ -274,41 +432,45 @@ var COVIDVIS_CHARTS = {{}};
 function startVegaEmbedding() {{
   var embedOpt = {{"mode": "vega-lite"}};
   $(document).ready(function() {{
+    // start downloading every chart right away, but only embed charts as they scroll into view
+{load_calls}
 {embed_calls}
   }});
 }}
     """
-    embed_calls = None
-    for config in reversed(configs):
+    manifest = read_asset_manifest(ASSET_MANIFEST)
+    load_calls = []
+    embed_calls = []
+    for config in configs:
+        name = config["name"]
+        embed_id = config.get("embed_id", name)
         then_add_listener = ''
         if STAGING and config.get('make_text_area', False):
             then_add_listener = f'''
-    var handler = makePopulateInfoPageSpaceHandler('{config["name"]}');
-    chart.view.addSignalListener('click', handler);
-    handler('click', chart.view.signal('click'));
-'''
-        then = f'''.then(function(chart) {{
-    COVIDVIS_CHARTS['{config["name"]}'] = chart;
-    {then_add_listener}
-}})'''
-        embed_call = f'vegaEmbed("#{config.get("embed_id", config["name"])}", {config["name"]}, embedOpt){then};'
-        embed_call = f'loadScript("js/autogen/{config["name"]}.js").then(function() {{{ embed_call }}})'
-        if embed_calls is None:
-            embed_calls = embed_call
-        else:
-            embed_calls = f"""
-{embed_call}.then(function() {{
-    {embed_calls}
-}})
-        """.strip()
-    script = script.format(load_script_function=load_script_function, embed_calls=embed_calls)
-    with open('./website/js/autogen/vega_embed.js', 'w') as f:
+        var handler = makePopulateInfoPageSpaceHandler('{name}');
+        chart.view.addSignalListener('click', handler);
+        handler('click', chart.view.signal('click'));'''
+        script_name = manifest.get(f'{name}.js', f'{name}.js')
+        load_calls.append(f'    var {name}_loaded = loadScript("{ASSET_URL}/{script_name}");')
+        embed_calls.append(f'''    embedWhenVisible("{embed_id}", function() {{
+      {name}_loaded.then(function() {{
+        return vegaEmbed("#{embed_id}", {name}, embedOpt);
+      }}).then(function(chart) {{
+        COVIDVIS_CHARTS['{name}'] = chart;{then_add_listener}
+      }});
+    }});''')
+    script = script.format(
+        load_script_function=load_script_function,
+        load_calls='\n'.join(load_calls),
+        embed_calls='\n'.join(embed_calls),
+    )
+    with open(f'{ASSET_DIR}/vega_embed.js', 'w') as f:
         f.write(script)
 
 
 def make_chart_detail():
     #.str.strip(to_strip='"')
-    quarantine_df = pd.read_csv(qcsv = './data/combined-activity-US-Jun9.csv')
+    quarantine_df = pd.read_csv(US_QUARANTINE_CSV)
     quarantine_df["detail_html"] = '<li>'+quarantine_df["Effective Date"].str.replace("-","/")+": "+quarantine_df["Details (if any) "]+" [<a href='"+quarantine_df["Reference links"]+"'>source</a>]"+'</li>'
 
     quarantine_df["detail_html"] = quarantine_df["detail_html"].fillna("")
@@ -325,7 +487,7 @@ def make_chart_detail():
 
 
 def make_jekyll_config():
-    with open('./website/_config.in.yml', 'r') as f:
+    with open(JEKYLL_CONFIG_IN, 'r') as f:
         jekyll_config = yaml.load(f.read(), yaml.SafeLoader)
     jekyll_config['date_last_modified'] = datetime.now().strftime('%B %d, %Y')
     # for config in configs:
@@ -335,12 +497,176 @@ def make_jekyll_config():
         yaml.dump(jekyll_config, f)
 
 
+def build_stale_charts(
+        configs, manifest, shared_digest, file_digests, jobs=1, trace_memory=False, report=BUILD_REPORT
+):
+    """
+    Exports the charts of `configs` whose inputs changed since `manifest`, records them in it, and publishes
+    the hashed chart scripts (see `publish_chart_assets`).
+    """
+    digests = {config['name']: chart_input_digest(config, shared_digest, file_digests) for config in configs}
+    stale_configs = charts_to_rebuild(configs, manifest, digests)
+    print(f'building {len(stale_configs)} of {len(configs)} charts', file=sys.stderr)
+    chart_records = export_charts(stale_configs, jobs=jobs, trace_memory=trace_memory)
+    write_build_report(chart_records, report)
+    template_hits = [
+        record['template_cache_hit']
+        for records in chart_records for record in records if 'template_cache_hit' in record
+    ]
+    if len(template_hits) > 0:
+        print(f'reused the compiled spec of {sum(template_hits)} of {len(template_hits)} charts', file=sys.stderr)
+    manifest.update({config['name']: digests[config['name']] for config in stale_configs})
+    write_chart_manifest(manifest)
+    publish_chart_assets(configs)
+    return stale_configs
+
+
+def stat_signatures(globs):
+    signatures = {}
+    for pattern in globs:
+        for path in glob.glob(pattern):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signatures[os.path.normpath(path)] = (st.st_mtime_ns, st.st_size)
+    return signatures
+
+
+def _wait_for_change(globs, signatures, interval, build_date):
+    # poll until some file changes (or the day does), then until the files stop changing (editors and scripts
+    # write in steps)
+    while True:
+        time.sleep(interval)
+        current = stat_signatures(globs)
+        if current != signatures or datetime.now().date() != build_date:
+            break
+    while True:
+        time.sleep(interval)
+        settled = stat_signatures(globs)
+        if settled == current:
+            break
+        current = settled
+    return {path for path in set(current) | set(signatures) if current.get(path) != signatures.get(path)}, current
+
+
+def _print_build_failure():
+    # charts whose export failed are not recorded in the chart manifest, so the next build retries them
+    traceback.print_exc(file=sys.stderr)
+    print('build failed; waiting for the next change', file=sys.stderr)
+
+
+def watch(configs, manifest, shared_digest, file_digests, interval=1., **build_options):
+    """
+    Rebuilds the charts whose inputs change, until interrupted. Parsed datasets and ingested quarantine frames
+    stay memoized in this process, so only changed csvs are parsed again. A change to chartlib or to this
+    script restarts the process, since it may change every chart; so does a new day (the x domains and the
+    jekyll config's date depend on it) or the county csv appearing or disappearing (it changes the JHU inputs).
+    A build that fails is reported and retried on the next change.
+    """
+    try:
+        preload_datasets()
+    except Exception:
+        _print_build_failure()
+    build_date = datetime.now().date()
+    watched_jhu_inputs = jhu_inputs()
+    globs = WATCHED_DATA_GLOBS + WATCHED_CODE_GLOBS
+    signatures = stat_signatures(globs)
+    print(f'watching {len(signatures)} files for changes', file=sys.stderr)
+    # changes that no successful build has handled yet
+    pending = set()
+    while True:
+        changed, signatures = _wait_for_change(globs, signatures, interval, build_date)
+        changed_code = sorted(path for path in changed if path.endswith('.py'))
+        if changed_code:
+            print(f'{", ".join(changed_code)} changed; restarting', file=sys.stderr)
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        if datetime.now().date() != build_date:
+            print('the date changed; restarting', file=sys.stderr)
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        if jhu_inputs() != watched_jhu_inputs:
+            print(f'{JHU_COUNTY_CSV} was added or removed; restarting', file=sys.stderr)
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        print(f'{", ".join(sorted(changed))} changed', file=sys.stderr)
+        start = time.perf_counter()
+        for fname in [fname for fname in file_digests if os.path.normpath(fname) in changed]:
+            del file_digests[fname]
+        pending |= changed
+        try:
+            if build_stale_charts(configs, manifest, shared_digest, file_digests, **build_options):
+                make_vega_embed_script(configs)
+            if os.path.normpath(JEKYLL_CONFIG_IN) in pending:
+                make_jekyll_config()
+            if os.path.normpath(US_QUARANTINE_CSV) in pending:
+                make_chart_detail()
+        except Exception:
+            _print_build_failure()
+            continue
+        pending = set()
+        print(f'rebuilt in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Build the chart scripts and jekyll config for the website.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of charts to build in parallel (0 to use all cores)'
+    )
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='rebuild every chart, even those whose inputs have not changed since the last build'
+    )
+    parser.add_argument(
+        '--split-data', action='store_true',
+        help=f'write chart datasets to {CHART_DATA_DIR} instead of inlining them in each chart script'
+    )
+    parser.add_argument(
+        '--data-format', choices=['json', 'csv'], default='json',
+        help='file format of the chart datasets written by --split-data'
+    )
+    parser.add_argument(
+        '--report', default=BUILD_REPORT,
+        help='where to write the per-stage timings, row counts and memory of every chart built, as json lines'
+    )
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help='report the peak memory of each stage with tracemalloc (several times slower)'
+    )
+    parser.add_argument(
+        '-w', '--watch', action='store_true',
+        help='after building, keep the data in memory and rebuild the charts whose inputs change'
+    )
+    parser.add_argument(
+        '--poll-interval', type=float, default=1.,
+        help='seconds between checks for changed inputs with --watch'
+    )
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
     configs = chart_configs()
-    export_charts(configs)
-    make_vega_embed_script(configs)
-    make_jekyll_config()
-    make_chart_detail()
+    if args.split_data:
+        for config in configs:
+            config['export_options'] = dict(
+                data_dir=CHART_DATA_DIR, data_url=CHART_DATA_URL, data_format=args.data_format
+            )
+    shared_digest = shared_input_digest()
+    file_digests = {}
+    manifest = {} if args.force else read_chart_manifest()
+    build_options = dict(jobs=jobs, trace_memory=args.trace_memory, report=args.report)
+    try:
+        build_stale_charts(configs, manifest, shared_digest, file_digests, **build_options)
+        make_vega_embed_script(configs)
+        make_jekyll_config()
+        make_chart_detail()
+    except Exception:
+        # with --watch, a failed build (e.g. after a bad edit restarted the process) waits for the next change
+        if not args.watch:
+            raise
+        _print_build_failure()
+    if args.watch:
+        try:
+            watch(configs, manifest, shared_digest, file_digests, interval=args.poll_interval, **build_options)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
@@ -17,9 +17,14 @@ if [[ -z "$(ls -A website/_site)" ]]; then
 fi
 pushd "${DEPLOYDIR}"
 git pull
-git rm -r * && rm -rf *
-cp -r "${WEBDIR}"/_site/* .
-git add .
-git commit -m "deploy"
-git push origin $BRANCH
+# copy only files whose contents changed and remove the ones that are gone; chart scripts have
+# content-hashed names (see js/autogen/manifest.json), so unchanged charts are left alone
+rsync -r --checksum --delete --exclude .git "${WEBDIR}"/_site/ .
+git add -A .
+if git diff --cached --quiet; then
+    echo "nothing changed since the last deploy"
+else
+    git commit -m "deploy"
+    git push origin $BRANCH
+fi
 popd
@@ -1,10 +1,14 @@
 import urllib.request as rq
 from collections import defaultdict
+from itertools import groupby
 from pprint import pprint
 import csv
 import json
 from sys import exit, exc_info
 
+import numpy as np
+import pandas as pd
+
 COUNTRY = {}
 TARGET = ['C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7', 'C8']
 oxford_to_covidvis = {
@@ -39,10 +43,43 @@ def get_data():
     rq.urlretrieve("https://raw.githubusercontent.com/OxCGRT/covid-policy-tracker/master/data/OxCGRT_latest_withnotes.csv", "OxCGRT_latest.csv")
     raw_csv = open("OxCGRT_latest.csv", 'r')
     raw_data = csv.reader(raw_csv, delimiter=',')
-    data = [row for row in raw_data]
-    return data[0], data[1:]
+    # rows are streamed from the file as `transpose` consumes them
+    return next(raw_data), raw_data
+
+def compile_header(header):
+    """
+    Compiles the OxCGRT header into a plan for `transpose`: one
+    (column index, measure code, kind, starts a new record, value lookup)
+    per column of a measure in `oxford_terms`, in header order.
 
-def transpose(data):
+    kind is one of "notes", "flag" (coverage), "amount" or "level"; the lookup
+    maps recorded values to coverage / level names, and is None for amounts
+    and for the flags of amount measures, which are parsed but not recorded.
+    """
+    plan = []
+    previous_flag = ""
+    for label_idx, label in enumerate(header):
+        flag = label[:2]
+        if flag not in oxford_terms:
+            continue
+        starts_record = flag != previous_flag
+        previous_flag = flag
+        lookup = None
+        if "Notes" in label:
+            kind = "notes"
+        elif "Flag" in label:
+            kind = "flag"
+            if "amount" not in oxford_terms[flag]:
+                lookup = oxford_terms[flag]["coverage"]
+        elif "amount" in oxford_terms[flag]:
+            kind = "amount"
+        else:
+            kind = "level"
+            lookup = oxford_terms[flag]["levels"]
+        plan.append((label_idx, flag, kind, starts_record, lookup))
+    return plan
+
+def transpose(data, plan):
     for entry in data:
         if len(entry) < 40: continue
         country_idx = entry[1]
@@ -52,29 +89,29 @@ def transpose(data):
                 "country_name": entry[0],
                 "country_code": entry[1]
             }
-            
+        country = COUNTRY[country_idx]
+
         entry_date = entry[2]
-        previous_flag = ""
         current_record = {}
-        for label_idx, label in enumerate(header):
-            flag = label[:2]
-            if flag in oxford_terms and flag != previous_flag:
-                previous_flag = flag
-                if flag not in COUNTRY[country_idx]:
-                    COUNTRY[country_idx][flag]={
+        events = None
+        saved = False
+        for label_idx, flag, kind, starts_record, lookup in plan:
+            if starts_record:
+                if flag not in country:
+                    country[flag]={
                         "code": flag,
                         "name": oxford_terms[flag]["name"],
                         "events": []
                     }
-                current_record = {"date": entry_date}                
-            # elif flag in oxford_terms and len(COUNTRY[country_idx][flag]["events"])>0:
-            #     if COUNTRY[country_idx][flag]["events"][-1] != current_record:
-            #         COUNTRY[country_idx][flag]["events"].append(current_record)
-            if flag in oxford_terms:
+                events = country[flag]["events"]
+                current_record = {"date": entry_date}
+                saved = False
+
+            if kind == "notes":
+                current_record["Notes"] = entry[label_idx]
+            else:
                 try:
-                    if "Notes" in label:
-                        pass
-                    elif len(entry[label_idx]) > 0:
+                    if len(entry[label_idx]) > 0:
                         recorded_value = str(int(float(entry[label_idx])))
                     else: continue
                 except:
@@ -82,33 +119,26 @@ def transpose(data):
                         print(header[idx], "\t|\t",  e)
                     exit()
 
-                if "Notes" in label:
-                    current_record["Notes"] = entry[label_idx]
-                
-                elif "Flag" in label:
-                    if "amount" in oxford_terms[flag]:
-                        pass
-                    else:
-                        current_record["coverage"] = oxford_terms[flag]["coverage"][recorded_value]
-
-                else:
-                    if "amount" in oxford_terms[flag]:
-                        current_record["amount"] = str(recorded_value) + ' USD'
-                    else:
-                        current_record["level"] = oxford_terms[flag]["levels"][recorded_value]
-            
-            #save into history
-            if 'level' not in current_record and 'amount' not in current_record:
-                pass
-            elif flag in oxford_terms and flag in COUNTRY[country_idx] and len(COUNTRY[country_idx][flag]["events"])>0:
-                p_record = COUNTRY[country_idx][flag]["events"][-1]
-                
-                if p_record['date'] == current_record['date'] and len(current_record) >= len(p_record):
-                    COUNTRY[country_idx][flag]["events"] = COUNTRY[country_idx][flag]["events"][:-1]
-                COUNTRY[country_idx][flag]["events"].append(current_record)
+                if kind == "amount":
+                    current_record["amount"] = recorded_value + ' USD'
+                elif kind == "flag" and lookup is not None:
+                    current_record["coverage"] = lookup[recorded_value]
+                elif kind == "level":
+                    current_record["level"] = lookup[recorded_value]
 
-            elif flag in oxford_terms and flag in COUNTRY[country_idx] and len(COUNTRY[country_idx][flag]["events"]) == 0:
-                    COUNTRY[country_idx][flag]["events"].append(current_record)
+            #save into history, once the record has a level or an amount. A record
+            #replaces an earlier one for the same date (e.g. from a regional row)
+            #unless that one was recorded with more fields; later fields of this
+            #row are added to the saved record in place.
+            if saved or ('level' not in current_record and 'amount' not in current_record):
+                pass
+            else:
+                if len(events) > 0:
+                    p_record = events[-1]
+                    if p_record['date'] == current_record['date'] and len(current_record) >= len(p_record):
+                        events.pop()
+                events.append(current_record)
+                saved = True
 
 def clean_the_measure(data):
     if len(data) == 1:
@@ -160,15 +190,125 @@ def clean_the_measure(data):
     return cleaned_data
 
 
-def cleanup(data):
-    for country in COUNTRY:
-        for measure in COUNTRY[country]:
+def events_table(data):
+    """
+    Flattens the event lists of every country and measure into one table with
+    a row per event: country, measure, group (a running number per country and
+    measure), position in its list, date, level, coverage and amount (None
+    where the event has no such field). Also returns the event dicts, in the
+    order of the table's rows.
+    """
+    columns = {name: [] for name in ['country', 'measure', 'group', 'position', 'date', 'level', 'coverage', 'amount']}
+    events = []
+    group = 0
+    for country in data:
+        for measure in data[country]:
             if "country" in measure: continue
-            if len(COUNTRY[country][measure]["events"]) == 0:
-                continue
-            updated_events = clean_the_measure(COUNTRY[country][measure]["events"])
-            COUNTRY[country][measure]["events"] = updated_events
-    
+            measure_events = data[country][measure]["events"]
+            if len(measure_events) == 0: continue
+            n = len(measure_events)
+            columns['country'].extend([country] * n)
+            columns['measure'].extend([measure] * n)
+            columns['group'].extend([group] * n)
+            columns['position'].extend(range(n))
+            columns['date'].extend(event['date'] for event in measure_events)
+            columns['level'].extend(event.get('level') for event in measure_events)
+            columns['coverage'].extend(event.get('coverage') for event in measure_events)
+            columns['amount'].extend(event.get('amount') for event in measure_events)
+            events.extend(measure_events)
+            group += 1
+    return pd.DataFrame(columns), events
+
+def _previous(values, starts):
+    # the value of the previous row, or None on the first row of each run
+    previous = np.empty_like(values)
+    previous[1:] = values[:-1]
+    previous[starts] = None
+    return previous
+
+def _carried_forward(values, present, starts):
+    # the value of the most recent row where `present`, without looking past the first row of each run
+    rows = np.arange(len(values))
+    return values[np.maximum.accumulate(np.where(present | starts, rows, 0))]
+
+def clean_the_measures(table):
+    """
+    Columnar version of `clean_the_measure` over an `events_table`: returns a
+    boolean Series that is True for the events to keep.
+
+    Events are kept where the level changes, where the coverage changes from the
+    previous recorded coverage of the same level (if the level's first event
+    recorded one), and where the amount changes to something other than 0 USD.
+    The last kept event of a measure is dropped if it lasted 3 events or less.
+    This assumes at most one event per measure and date; `cleanup` hands
+    measures with repeated dates to `clean_the_measure` instead.
+    """
+    position = table['position'].to_numpy()
+    level = table['level'].to_numpy(dtype=object)
+    coverage = table['coverage'].to_numpy(dtype=object)
+    amount = table['amount'].to_numpy(dtype=object)
+    first = position == 0
+
+    # level changes start a new segment, in which coverage changes are tracked
+    level_change = ~first & pd.notna(level) & (level != _previous(level, first))
+    segment_start = first | level_change
+    has_coverage = pd.notna(coverage)
+    start_coverage = _carried_forward(coverage, segment_start, segment_start)
+    previous_coverage = _previous(_carried_forward(coverage, has_coverage, segment_start), segment_start)
+    coverage_change = ~segment_start & has_coverage & pd.notna(start_coverage) & (coverage != previous_coverage)
+
+    # amounts are compared with the last amount that was not 0 USD (or the first one)
+    nonzero_amount = pd.notna(amount) & (amount != '0 USD')
+    previous_amount = _previous(_carried_forward(amount, first | nonzero_amount, first), first)
+    amount_change = ~first & nonzero_amount & (amount != previous_amount)
+
+    keep = first | level_change | coverage_change | amount_change
+
+    # preventative actions, dropping recently imposed measures: the last kept
+    # event of each measure lasts until its last event
+    last = np.append(first[1:], True)
+    last_kept = np.maximum.accumulate(np.where(keep, np.arange(len(keep)), 0))[last]
+    duration = position[last] - position[last_kept]
+    recent = (position[last] > 0) & (duration <= 3)
+    keep[last_kept[recent]] = False
+    return pd.Series(keep, index=table.index)
+
+def cleanup(data):
+    table, events = events_table(data)
+    if len(table) == 0:
+        return
+    keep = clean_the_measures(table).to_numpy()
+    group = table['group'].to_numpy()
+    date = table['date'].to_numpy(dtype=object)
+    repeated_date = np.zeros(len(table), dtype=bool)
+    repeated_date[1:] = (group[1:] == group[:-1]) & (date[1:] == date[:-1])
+
+    kept_events = {}
+    for idx in np.flatnonzero(keep):
+        kept_events.setdefault(group[idx], []).append(events[idx])
+    repeated_groups = set(group[repeated_date])
+    starts = np.flatnonzero(table['position'].to_numpy() == 0)
+    for idx in starts:
+        country, measure = table.at[idx, 'country'], table.at[idx, 'measure']
+        if group[idx] in repeated_groups:
+            updated_events = clean_the_measure(data[country][measure]["events"])
+        else:
+            updated_events = kept_events.get(group[idx], [])
+        data[country][measure]["events"] = updated_events
+
+def transpose_by_country(data, plan):
+    """
+    `transpose` and `cleanup`, one country at a time. OxCGRT rows are grouped
+    by country, so each country is cleaned up as soon as its rows end, and only
+    its kept events (and their notes) are held while the rest of the file is read.
+    """
+    rows = (entry for entry in data if len(entry) >= 40)
+    for country_idx, country_rows in groupby(rows, key=lambda entry: entry[1]):
+        if country_idx in COUNTRY:
+            exit(f'the rows of {country_idx} are not consecutive; cleaning it up early would lose events')
+        transpose(country_rows, plan)
+        cleanup({country_idx: COUNTRY[country_idx]})
+
 def export(data):
     out_file = csv.writer(open('quarantine-activity-world-new-export.csv', 'w'))
     out_file.writerow(EXPORT_HEADER)
@@ -222,8 +362,7 @@ if __name__ == '__main__':
     oxford_terms = json.load(open("oxford_terms.json", "r"))
     header, data = get_data()
 
-    transpose(data)
-    cleanup(COUNTRY)
+    transpose_by_country(data, compile_header(header))
     export(COUNTRY)
     # for c in COUNTRY:
     #     if c == 'USA':
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Serves the compiled Vega-Lite specs of the site's charts over HTTP, with the chart parameters that
+build-charts.py fixes left to the request. The JHU hierarchy and the quarantine csvs are loaded once at
+startup, and compiled specs are kept in an LRU cache keyed by the chart, its normalized parameters and
+the versions of its input files. Run from the repository root:
+
+    scripts/serve-charts.py [--port 8050] [--max-entries 64] [--warm]
+
+Endpoints:
+
+    GET /charts               the chart names and the defaults of their parameters
+    GET /chart/<name>?...     the spec of chart <name> (e.g. jhu_us_cases, jhu_world_deaths_mobile) as json;
+                              parameters: threshold, top_k, width, height, xmin, xmax, ymin, ymax
+    GET /stats                cache hits / misses / evictions and compile times, and the hit rate of the spec
+                              templates that let a chart whose input files changed skip rebuilding its layers
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+sys.path.append('.')
+
+import altair as alt
+
+from chartlib.chart_spec import TEMPLATE_CACHE
+from chartlib.lru import LRUCache
+
+
+def _load_build_charts():
+    # the chart definitions live in build-charts.py, which can't be imported by name
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build-charts.py')
+    spec = importlib.util.spec_from_file_location('build_charts', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+build_charts = _load_build_charts()
+
+# request parameter -> (type, keyword of the chart generator, or None for properties set on the generated chart)
+PARAMS = {
+    'threshold': (int, 'days_since'),
+    'top_k': (int, 'top_k_groups'),
+    'width': (int, None),
+    'height': (int, None),
+    'xmin': (float, None),
+    'xmax': (float, None),
+    'ymin': (float, None),
+    'ymax': (float, None),
+}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class UnknownChart(LookupError):
+    pass
+
+
+def _generator_defaults(gen):
+    return {
+        param: inspect.signature(gen).parameters[keyword].default
+        for param, (_, keyword) in PARAMS.items() if keyword is not None
+    }
+
+
+def _input_signature(config):
+    # cheap stand-in for the content digests of build-charts.py; a changed input makes its old entries unreachable
+    signature = []
+    for fname in config['inputs']:
+        st = os.stat(fname)
+        signature.append((fname, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+class ChartService(object):
+    def __init__(self, max_entries=64):
+        self.configs = {config['name']: config for config in build_charts.chart_configs()}
+        self.cache = LRUCache(max_entries)
+        self.started = time.time()
+        start = time.perf_counter()
+        build_charts.preload_datasets()
+        self.data_load_seconds = time.perf_counter() - start
+        # altair's themes and data transformers are global, so charts are compiled one at a time
+        self._compile_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.compiles = 0
+        self.compile_seconds = 0.
+
+    def normalize_params(self, name, query):
+        """The chart config and the parameters of `query`, parsed and without the ones left at their defaults."""
+        config = self.configs.get(name)
+        if config is None:
+            raise UnknownChart(name)
+        defaults = _generator_defaults(config['gen'])
+        params = {}
+        for param, values in query.items():
+            if param not in PARAMS:
+                raise BadRequest(f'unknown parameter {param}; expected one of {sorted(PARAMS)}')
+            try:
+                value = float(values[-1])
+            except ValueError:
+                raise BadRequest(f'{param} should be a number; got {values[-1]}')
+            if not math.isfinite(value) or (PARAMS[param][0] is int and not value.is_integer()):
+                raise BadRequest(f'{param} should be a finite {PARAMS[param][0].__name__}; got {values[-1]}')
+            # so that e.g. threshold=50 and threshold=50.0 share a cache entry
+            value = PARAMS[param][0](value)
+            if value < 0 or (param in ('top_k', 'width', 'height') and value == 0):
+                raise BadRequest(f'{param} should be positive; got {value}')
+            if defaults.get(param, None) != value:
+                params[param] = value
+        return config, params
+
+    def _make_spec(self, config, params):
+        kwargs = {PARAMS[param][1]: value for param, value in params.items() if PARAMS[param][1] is not None}
+        chart = config['gen'](config.get('override_props', {}), **kwargs)
+        if 'width' in params:
+            chart.set_width(params['width'])
+        if 'height' in params:
+            chart.set_height(params['height'])
+        xdomain, ydomain = chart.xdomain, chart.ydomain
+        chart.set_xdomain((params.get('xmin', xdomain[0]), params.get('xmax', xdomain[1])))
+        chart.set_ydomain((params.get('ymin', ydomain[0]), params.get('ymax', ydomain[1])))
+        # like CovidChart.export with separate data, without altair's limit on inlined rows
+        with alt.data_transformers.enable('default', max_rows=None):
+            return json.dumps(chart.compile_to_dict()).encode()
+
+    def spec(self, name, query):
+        """The compiled spec of chart `name` with the parameters of `query`, as json bytes."""
+        config, params = self.normalize_params(name, query)
+        key = (name, tuple(sorted(params.items())), _input_signature(config))
+        spec = self.cache.get(key)
+        if spec is not None:
+            return spec
+        with self._compile_lock:
+            # another request may have compiled it while we waited
+            spec = self.cache.peek(key)
+            if spec is None:
+                start = time.perf_counter()
+                spec = self._make_spec(config, params)
+                with self._stats_lock:
+                    self.compiles += 1
+                    self.compile_seconds += time.perf_counter() - start
+                self.cache.put(key, spec)
+        return spec
+
+    def chart_defaults(self):
+        return {name: _generator_defaults(config['gen']) for name, config in self.configs.items()}
+
+    def count_request(self, failed=False):
+        with self._stats_lock:
+            self.requests += 1
+            self.errors += int(failed)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                **self.cache.stats(),
+                'requests': self.requests,
+                'errors': self.errors,
+                'compiles': self.compiles,
+                'compile_seconds': self.compile_seconds,
+                'mean_compile_seconds': self.compile_seconds / self.compiles if self.compiles > 0 else None,
+                'data_load_seconds': self.data_load_seconds,
+                'template_cache': TEMPLATE_CACHE.stats(),
+                'uptime_seconds': time.time() - self.started,
+            }
+
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+    service: ChartService = None
+
+    def _send_json(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        status, body = 200, None
+        try:
+            if path == '/charts':
+                body = self.service.chart_defaults()
+            elif path == '/stats':
+                body = self.service.stats()
+            elif path.startswith('/chart/'):
+                body = self.service.spec(path[len('/chart/'):], parse_qs(url.query))
+            else:
+                status, body = 404, {'error': f'no such endpoint {url.path}'}
+        except UnknownChart as e:
+            status, body = 404, {'error': f'no such chart {e.args[0]}; see /charts'}
+        except BadRequest as e:
+            status, body = 400, {'error': str(e)}
+        except Exception:
+            # the details may include paths and data; they go to the log, not to the client
+            traceback.print_exc(file=sys.stderr)
+            status, body = 500, {'error': 'internal error'}
+        if path != '/stats':
+            self.service.count_request(failed=status != 200)
+        self._send_json(status, body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--max-entries', type=int, default=64, help='number of compiled specs to keep in memory')
+    parser.add_argument('--warm', action='store_true', help='compile every chart with its default parameters on startup')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', FutureWarning)
+    service = ChartService(max_entries=args.max_entries)
+    if args.warm:
+        for name in service.configs:
+            try:
+                service.spec(name, {})
+            except Exception as e:
+                print(f'could not compile {name}: {type(e).__name__}: {e}', file=sys.stderr)
+    ChartRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), ChartRequestHandler)
+    print(f'serving {len(service.configs)} charts on http://{args.host}:{args.port}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())